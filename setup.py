@@ -41,6 +41,8 @@ setup(name = "z3c.dav",
           test = ["z3c.etree",
                   "zope.testing",
                   ],
+          brotli = ["brotli"],
+          lxml = ["lxml"],
           ),
 
       include_package_data = True,
@@ -15,8 +15,10 @@ __docformat__ = 'restructuredtext'
 
 from BTrees.OOBTree import OOBTree
 
+import zope.component
 import zope.interface
 import zope.annotation.interfaces
+import zope.lifecycleevent.interfaces
 from zope.dublincore.interfaces import IDCTimes, IDCDescriptiveProperties
 
 import z3c.dav.coreproperties
@@ -217,6 +219,19 @@ class OpaqueProperties(object):
       >>> list(opaqueProperties.getAllProperties())
       ['{examplens:}prop2']
 
+    The values of many properties can be read at once.
+
+      >>> verifyObject(z3c.dav.interfaces.IBulkOpaquePropertyStorage,
+      ...              opaqueProperties)
+      True
+      >>> opaqueProperties.setProperty('{examplens:}prop3',
+      ...    '<E:prop3 xmlns:E="examplens:">PROP3</E:prop3>')
+      >>> list(opaqueProperties.getProperties())
+      [('{examplens:}prop2', '<E:prop2 xmlns:E="examplens:">PROP2</E:prop2>'), ('{examplens:}prop3', '<E:prop3 xmlns:E="examplens:">PROP3</E:prop3>')]
+      >>> list(opaqueProperties.getProperties(
+      ...     ['{examplens:}prop3', '{examplens:}missing']))
+      [('{examplens:}prop3', '<E:prop3 xmlns:E="examplens:">PROP3</E:prop3>')]
+
     Cleanup this test.
 
       >>> component.getGlobalSiteManager().unregisterAdapter(
@@ -226,7 +241,7 @@ class OpaqueProperties(object):
       True
 
     """
-    zope.interface.implements(z3c.dav.interfaces.IOpaquePropertyStorage)
+    zope.interface.implements(z3c.dav.interfaces.IBulkOpaquePropertyStorage)
 
     _annotations = None
 
@@ -257,6 +272,12 @@ class OpaqueProperties(object):
         """Returns None."""
         return self._mapping.get(tag, None)
 
+    def getProperties(self, tags = None):
+        if tags is None:
+            return self._mapping.items()
+        mapping = self._mapping
+        return [(tag, mapping[tag]) for tag in tags if tag in mapping]
+
     def setProperty(self, tag, value):
         self._mapping[tag] = value
         self._changed()
@@ -265,6 +286,109 @@ class OpaqueProperties(object):
         del self._mapping[tag]
         self._changed()
 
+
+@zope.component.adapter(zope.annotation.interfaces.IAnnotatable,
+                        zope.lifecycleevent.interfaces.IObjectAddedEvent)
+def createOpaqueProperties(ob, event):
+    """
+    Create the storage of the dead properties of `ob` when it is added.
+
+    `OpaqueProperties` only stores its mapping in the annotations of a
+    resource when the first dead property is set. Two PROPPATCH requests
+    setting the first dead properties of the same resource at the same
+    time then both write the annotations, and one of them fails with a
+    `ConflictError`. Once the mapping exists, a PROPPATCH request only
+    writes the mapping, an `OOBTree` which merges concurrent changes to
+    different properties.
+
+      >>> import os, shutil, tempfile, transaction
+      >>> import ZODB, ZODB.FileStorage
+      >>> from persistent.mapping import PersistentMapping
+      >>> from zope.annotation.attribute import AttributeAnnotations
+      >>> from zope.annotation.interfaces import IAttributeAnnotatable
+      >>> from zope.lifecycleevent import ObjectAddedEvent
+      >>> from zope import component
+      >>> component.getGlobalSiteManager().registerAdapter(
+      ...     AttributeAnnotations,
+      ...     (zope.annotation.interfaces.IAnnotatable,),
+      ...      zope.annotation.interfaces.IAnnotations)
+
+      >>> tmpdir = tempfile.mkdtemp()
+      >>> db = ZODB.DB(ZODB.FileStorage.FileStorage(
+      ...     os.path.join(tmpdir, 'Data.fs')))
+      >>> tm1 = transaction.TransactionManager()
+      >>> conn1 = db.open(tm1)
+      >>> tm2 = transaction.TransactionManager()
+      >>> conn2 = db.open(tm2)
+
+      >>> def addResource(name):
+      ...     resource = PersistentMapping()
+      ...     zope.interface.alsoProvides(resource, IAttributeAnnotatable)
+      ...     conn1.root()[name] = resource
+      ...     component.handle(
+      ...         resource, ObjectAddedEvent(resource, conn1.root(), name))
+      ...     tm1.commit()
+      >>> def setProperties(name):
+      ...     OpaqueProperties(conn1.root()[name]).setProperty(
+      ...         '{example:}a', '<E:a xmlns:E="example:" />')
+      ...     OpaqueProperties(conn2.root()[name]).setProperty(
+      ...         '{example:}b', '<E:b xmlns:E="example:" />')
+      ...     tm1.commit()
+      ...     tm2.commit()
+
+    Without the storage the first dead properties set concurrently
+    conflict.
+
+      >>> addResource('resource')
+      >>> conn2.sync()
+      >>> setProperties('resource') #doctest: +ELLIPSIS
+      Traceback (most recent call last):
+      ...
+      ConflictError: database conflict error (...)
+      >>> tm2.abort()
+
+      >>> component.getGlobalSiteManager().registerHandler(
+      ...     createOpaqueProperties)
+      >>> addResource('other')
+      >>> annotations = zope.annotation.interfaces.IAnnotations(
+      ...     conn1.root()['other'])
+      >>> list(annotations[_opaque_namespace_key])
+      []
+
+      >>> conn2.sync()
+      >>> setProperties('other')
+      >>> txn = tm1.begin()
+      >>> list(OpaqueProperties(conn1.root()['other']).getAllProperties())
+      ['{example:}a', '{example:}b']
+
+    A storage already there is kept.
+
+      >>> storage = annotations[_opaque_namespace_key]
+      >>> createOpaqueProperties(conn1.root()['other'], None)
+      >>> annotations[_opaque_namespace_key] is storage
+      True
+
+    Cleanup this test.
+
+      >>> tm1.abort()
+      >>> conn1.close()
+      >>> conn2.close()
+      >>> db.close()
+      >>> shutil.rmtree(tmpdir)
+      >>> component.getGlobalSiteManager().unregisterHandler(
+      ...     createOpaqueProperties)
+      True
+      >>> component.getGlobalSiteManager().unregisterAdapter(
+      ...     AttributeAnnotations,
+      ...     (zope.annotation.interfaces.IAnnotatable,),
+      ...      zope.annotation.interfaces.IAnnotations)
+      True
+
+    """
+    annotations = zope.annotation.interfaces.IAnnotations(ob)
+    if annotations.get(_opaque_namespace_key) is None:
+        annotations[_opaque_namespace_key] = OOBTree()
+
 ################################################################################
 #
 # GetEtag property based on z3c.conditionalviews.
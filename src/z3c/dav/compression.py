@@ -0,0 +1,271 @@
+##############################################################################
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+##############################################################################
+"""Compression of the XML bodies of WebDAV responses.
+
+Multistatus responses are verbose and compress very well. With a
+`IResponseCompression' utility registered the bodies are compressed with
+the best content coding the client accepts in its `Accept-Encoding'
+header. The `br' coding is only offered when the `brotli' package is
+installed.
+"""
+__docformat__ = 'restructuredtext'
+
+import zlib
+
+import zope.component
+import zope.interface
+from zope.publisher.interfaces.http import IResult
+from zope.schema.fieldproperty import FieldProperty
+
+import z3c.dav.interfaces
+import z3c.dav.utils
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def getAcceptedCodings(request):
+    """
+    Return a dictionary of the content codings listed in the
+    `Accept-Encoding' header of request, and their quality values.
+
+      >>> from zope.publisher.browser import TestRequest
+      >>> getAcceptedCodings(TestRequest())
+      {}
+      >>> codings = getAcceptedCodings(TestRequest(environ = {
+      ...     'HTTP_ACCEPT_ENCODING': 'GZIP;q=0.5, deflate , br;q=0, x;q=a'}))
+      >>> sorted(codings.items())
+      [('br', 0.0), ('deflate', 1.0), ('gzip', 0.5)]
+
+    """
+    codings = {}
+    header = request.getHeader("accept-encoding", None)
+    if not header:
+        return codings
+
+    for coding in header.split(","):
+        params = coding.split(";")
+        name = params[0].strip().lower()
+        if not name:
+            continue
+
+        qvalue = 1.0
+        for param in params[1:]:
+            param = param.strip()
+            if param[:2].lower() == "q=":
+                try:
+                    qvalue = float(param[2:])
+                except ValueError:
+                    qvalue = None
+        if qvalue is not None:
+            codings[name] = qvalue
+
+    return codings
+
+
+class BrotliCompressor(object):
+    # Give a `brotli.Compressor' the same API as a zlib compression object.
+
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality = level)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
+
+
+class CompressedResult(object):
+    """
+    Compress the chunks of an iterable result on the fly.
+
+      >>> compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS)
+      >>> result = CompressedResult(['<a>', '<b />' * 100, '</a>'],
+      ...                           compressor)
+      >>> IResult.providedBy(result)
+      True
+      >>> data = ''.join(result)
+      >>> zlib.decompress(data) == '<a>' + '<b />' * 100 + '</a>'
+      True
+
+    """
+    zope.interface.implements(IResult)
+
+    def __init__(self, result, compressor):
+        self.result = result
+        self.compressor = compressor
+
+    def __iter__(self):
+        for data in self.result:
+            data = self.compressor.compress(data)
+            if data:
+                yield data
+        yield self.compressor.flush()
+
+
+class ResponseCompression(object):
+    """
+    Compress response bodies with gzip, deflate or brotli.
+
+      >>> from zope.interface.verify import verifyObject
+      >>> from zope.publisher.browser import TestRequest
+      >>> compression = ResponseCompression(threshold = 10)
+      >>> verifyObject(z3c.dav.interfaces.IResponseCompression, compression)
+      True
+
+    The best coding accepted by the client is used.
+
+      >>> body = '<multistatus>%s</multistatus>' %('<response />' * 100)
+      >>> request = TestRequest(environ = {
+      ...     'HTTP_ACCEPT_ENCODING': 'deflate;q=0.5, gzip'})
+      >>> data = compression.compress(request, body)
+      >>> request.response.getHeader('content-encoding')
+      'gzip'
+      >>> request.response.getHeader('vary')
+      'Accept-Encoding'
+      >>> len(data) < len(body)
+      True
+      >>> zlib.decompress(data, 16 + zlib.MAX_WBITS) == body
+      True
+
+      >>> request = TestRequest(environ = {
+      ...     'HTTP_ACCEPT_ENCODING': 'deflate, gzip;q=0.5'})
+      >>> zlib.decompress(compression.compress(request, body)) == body
+      True
+      >>> request.response.getHeader('content-encoding')
+      'deflate'
+
+    Iterable results are compressed incrementally.
+
+      >>> request = TestRequest(environ = {'HTTP_ACCEPT_ENCODING': 'gzip'})
+      >>> data = compression.compress(request, iter(['<a>', body, '</a>']))
+      >>> isinstance(data, CompressedResult)
+      True
+      >>> zlib.decompress(''.join(data), 16 + zlib.MAX_WBITS) == \\
+      ...     '<a>' + body + '</a>'
+      True
+
+    Small bodies are not compressed, nor are the bodies sent to clients
+    that don't accept any of our codings.
+
+      >>> request = TestRequest(environ = {'HTTP_ACCEPT_ENCODING': 'gzip'})
+      >>> compression.compress(request, '<a />')
+      '<a />'
+      >>> request.response.getHeader('content-encoding') is None
+      True
+      >>> request.response.getHeader('vary')
+      'Accept-Encoding'
+
+      >>> request = TestRequest(environ = {
+      ...     'HTTP_ACCEPT_ENCODING': 'compress, *;q=0'})
+      >>> compression.compress(request, body) == body
+      True
+      >>> request.response.getHeader('content-encoding') is None
+      True
+
+    The `Vary' header is extended, not replaced.
+
+      >>> request = TestRequest(environ = {'HTTP_ACCEPT_ENCODING': '*'})
+      >>> request.response.setHeader('vary', 'Prefer')
+      >>> data = compression.compress(request, body)
+      >>> request.response.getHeader('vary')
+      'Prefer, Accept-Encoding'
+      >>> request.response.getHeader('content-encoding') in ('br', 'gzip')
+      True
+
+    """
+    zope.interface.implements(z3c.dav.interfaces.IResponseCompression)
+
+    threshold = FieldProperty(
+        z3c.dav.interfaces.IResponseCompression["threshold"])
+    level = FieldProperty(z3c.dav.interfaces.IResponseCompression["level"])
+
+    def __init__(self, threshold = 1024, level = 6):
+        self.threshold = threshold
+        self.level = level
+
+    @property
+    def codings(self):
+        # content codings we support, in order of preference.
+        if brotli is not None:
+            return ("br", "gzip", "deflate")
+        return ("gzip", "deflate")
+
+    def getCoding(self, request):
+        accepted = getAcceptedCodings(request)
+        best = None
+        bestqvalue = 0
+        for coding in self.codings:
+            qvalue = accepted.get(coding, accepted.get("*", 0))
+            if qvalue > bestqvalue:
+                best, bestqvalue = coding, qvalue
+        return best
+
+    def getCompressor(self, coding):
+        if coding == "br":
+            return BrotliCompressor(self.level)
+        if coding == "gzip":
+            wbits = 16 + zlib.MAX_WBITS
+        else: # deflate is the zlib format, see RFC 2616
+            wbits = zlib.MAX_WBITS
+        return zlib.compressobj(self.level, zlib.DEFLATED, wbits)
+
+    def compress(self, request, result):
+        response = request.response
+        z3c.dav.utils.addVary(response, "Accept-Encoding")
+
+        if response.getHeader("content-encoding"):
+            return result
+
+        size = getattr(result, "__len__", None)
+        if size is not None and size() < self.threshold:
+            return result
+
+        coding = self.getCoding(request)
+        if coding is None:
+            return result
+
+        response.setHeader("content-encoding", coding)
+        compressor = self.getCompressor(coding)
+        if isinstance(result, str):
+            return compressor.compress(result) + compressor.flush()
+        return CompressedResult(result, compressor)
+
+
+def compress(request, result):
+    """
+    Compress the body `result' of the response to request if a
+    `IResponseCompression' utility is registered.
+
+      >>> from zope.publisher.browser import TestRequest
+      >>> request = TestRequest(environ = {'HTTP_ACCEPT_ENCODING': 'gzip'})
+      >>> compress(request, '<a />' * 1000) == '<a />' * 1000
+      True
+
+      >>> compression = ResponseCompression(threshold = 0)
+      >>> zope.component.getGlobalSiteManager().registerUtility(compression)
+      >>> zlib.decompress(compress(request, '<a />'),
+      ...                 16 + zlib.MAX_WBITS)
+      '<a />'
+
+      >>> zope.component.getGlobalSiteManager().unregisterUtility(compression)
+      True
+
+    """
+    compression = zope.component.queryUtility(
+        z3c.dav.interfaces.IResponseCompression)
+    if compression is None:
+        return result
+    return compression.compress(request, result)
@@ -18,8 +18,6 @@
 """
 __docformat__ = 'restructuredtext'
 
-import xml.etree.ElementTree
-
 import zope.interface
 import zope.component
 from zope import schema
@@ -28,6 +26,7 @@ import zope.publisher.interfaces.http
 
 from z3c.dav.properties import DAVProperty, DeadField
 import z3c.dav.widgets
+from z3c.dav.xmlengine import ElementTree
 
 class IDAVCreationdate(zope.interface.Interface):
 
@@ -356,8 +355,8 @@ class LockdiscoveryDAVWidget(z3c.dav.widgets.ListDAVWidget):
     zope.interface.classProvides(z3c.dav.interfaces.IIDAVWidget)
 
     def render(self):
-        el = xml.etree.ElementTree.Element(
-            xml.etree.ElementTree.QName(self.namespace, self.name))
+        el = ElementTree.Element(
+            ElementTree.QName(self.namespace, self.name))
 
         if self._value is not self.context.missing_value:
             for value in self._value:
@@ -20,8 +20,6 @@ IPublication.handleException method.
 """
 __docformat__ = 'restructuredtext'
 
-from xml.etree import ElementTree
-
 from zope import interface
 from zope import schema
 from zope import component
@@ -29,8 +27,10 @@ import zope.publisher.interfaces.http
 from zope.publisher.interfaces.http import IHTTPException
 import zope.publisher.defaultview
 
+import z3c.dav.compression
 import z3c.dav.interfaces
 import z3c.dav.utils
+from z3c.dav.xmlengine import ElementTree
 
 class DAVError(object):
     interface.implements(z3c.dav.interfaces.IDAVErrorWidget)
@@ -130,7 +130,9 @@ class MultiStatusErrorView(object):
 
         self.request.response.setStatus(207)
         self.request.response.setHeader("content-type", "application/xml")
-        return ElementTree.tostring(multistatus(), encoding = "utf-8")
+        return z3c.dav.compression.compress(
+            self.request,
+            multistatus.serialize())
 
 
 class WebDAVPropstatErrorView(object):
@@ -165,7 +167,9 @@ class WebDAVPropstatErrorView(object):
 
         self.request.response.setStatus(207)
         self.request.response.setHeader("content-type", "application/xml")
-        return ElementTree.tostring(multistatus(), encoding = "utf-8")
+        return z3c.dav.compression.compress(
+            self.request,
+            multistatus.serialize())
 
 ################################################################################
 #
@@ -187,6 +191,23 @@ class HTTPForbiddenError(object):
         return ""
 
 
+class PropfindFiniteDepthError(object):
+    interface.implements(IHTTPException)
+    component.adapts(z3c.dav.interfaces.IPropfindFiniteDepth,
+                     zope.publisher.interfaces.http.IHTTPRequest)
+
+    def __init__(self, error, request):
+        self.error = error
+        self.request = request
+
+    def __call__(self):
+        self.request.response.setStatus(403)
+        self.request.response.setHeader("content-type", "application/xml")
+        error = z3c.dav.utils.makedavelement(
+            "error", z3c.dav.utils.makedavelement("propfind-finite-depth"))
+        return ElementTree.tostring(error, encoding = "utf-8")
+
+
 class HTTPConflictError(object):
     interface.implements(IHTTPException)
     component.adapts(z3c.dav.interfaces.IConflictError,
@@ -215,6 +236,20 @@ class PreconditionFailed(object):
         return ""
 
 
+class RequestEntityTooLargeError(object):
+    interface.implements(IHTTPException)
+    component.adapts(z3c.dav.interfaces.IRequestEntityTooLarge,
+                     zope.publisher.interfaces.http.IHTTPRequest)
+
+    def __init__(self, error, request):
+        self.error = error
+        self.request = request
+
+    def __call__(self):
+        self.request.response.setStatus(413)
+        return ""
+
+
 class HTTPUnsupportedMediaTypeError(object):
     interface.implements(IHTTPException)
     component.adapts(z3c.dav.interfaces.IUnsupportedMediaType,
@@ -27,6 +27,7 @@ from zope.publisher.interfaces import IDefaultViewName
 
 import z3c.dav.publisher
 import z3c.etree.testing
+import z3c.dav.xmlengine
 
 class IResource(interface.Interface):
 
@@ -99,7 +100,7 @@ class TestPropstatErrorView(unittest.TestCase):
     def setUp(self):
         super(TestPropstatErrorView, self).setUp()
 
-        z3c.etree.testing.etreeSetup(key = "py25")
+        z3c.etree.testing.etreeSetup(key = z3c.dav.xmlengine.engine)
 
         gsm = component.getGlobalSiteManager()
         gsm.registerAdapter(DummyResourceURL,
@@ -157,7 +158,7 @@ class TestMSErrorView(unittest.TestCase):
     def setUp(self):
         super(TestMSErrorView, self).setUp()
 
-        z3c.etree.testing.etreeSetup(key = "py25")
+        z3c.etree.testing.etreeSetup(key = z3c.dav.xmlengine.engine)
 
         gsm = component.getGlobalSiteManager()
         gsm.registerAdapter(DummyResourceURL,
@@ -24,6 +24,7 @@ from zope.formlib.namedtemplate import INamedTemplate
 import z3c.dav.interfaces
 import z3c.dav.exceptions
 import z3c.dav.exceptions.browser
+from z3c.dav.xmlengine import ElementTree
 
 from zope.publisher.browser import TestRequest
 
@@ -90,6 +91,16 @@ class TestExceptionViews(unittest.TestCase):
         self.assertEqual(request.response.getStatus(), 415)
         self.assertEqual(result, "")
 
+    def test_requestentitytoolarge(self):
+        request = TestRequest()
+        error = z3c.dav.interfaces.RequestEntityTooLarge(request)
+        view = z3c.dav.exceptions.RequestEntityTooLargeError(error, request)
+
+        result = view()
+
+        self.assertEqual(request.response.getStatus(), 413)
+        self.assertEqual(result, "")
+
     def test_alreadylocked(self):
         request = TestRequest()
         error = z3c.dav.interfaces.AlreadyLocked(None, "Alread locked")
@@ -100,6 +111,21 @@ class TestExceptionViews(unittest.TestCase):
         self.assertEqual(request.response.getStatus(), 423)
         self.assertEqual(result, "")
 
+    def test_propfindfinitedepth(self):
+        request = TestRequest()
+        error = z3c.dav.interfaces.PropfindFiniteDepth(None)
+        view = z3c.dav.exceptions.PropfindFiniteDepthError(error, request)
+
+        result = view()
+
+        self.assertEqual(request.response.getStatus(), 403)
+        self.assertEqual(request.response.getHeader("content-type"),
+                         "application/xml")
+        error = ElementTree.fromstring(result)
+        self.assertEqual(error.tag, "{DAV:}error")
+        self.assertEqual([el.tag for el in error],
+                         ["{DAV:}propfind-finite-depth"])
+
 
 class TestDAVErrors(unittest.TestCase):
 
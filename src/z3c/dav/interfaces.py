@@ -57,6 +57,29 @@ class BadRequest(Exception):
         return "%r, %r" %(self.request, self.message)
 
 
+class IRequestEntityTooLarge(IException):
+    """
+    The body of the request is larger then the server is willing to
+    process.
+    """
+
+    request = zope.interface.Attribute(
+        """The request in which the error occured.""")
+
+    message = zope.interface.Attribute(
+        """Message to send back to the user.""")
+
+class RequestEntityTooLarge(Exception):
+    zope.interface.implements(IRequestEntityTooLarge)
+
+    def __init__(self, request, message = None):
+        self.request = request
+        self.message = message
+
+    def __str__(self):
+        return "%r, %r" %(self.request, self.message)
+
+
 class IUnsupportedMediaType(IException):
     """
     Unsupported media type.
@@ -150,6 +173,16 @@ class ForbiddenError(DAVException):
     zope.interface.implements(IForbiddenError)
 
 
+class IPropfindFiniteDepth(IForbiddenError):
+    """
+    The server doesn't allow infinite-depth PROPFIND requests on the
+    collection, or the request exceeded the limits configured for them.
+    """
+
+class PropfindFiniteDepth(ForbiddenError):
+    zope.interface.implements(IPropfindFiniteDepth)
+
+
 class IUnprocessableError(IDAVException):
     """
     The entity body couldn't be parsed or is invalid.
@@ -299,6 +332,10 @@ class IWebDAVRequest(IHTTPRequest):
 
     If there was no input or the input wasn't in XML then this attribute
     is None.
+
+    The input is parsed when this attribute, or `content_type', is first
+    used. A `BadRequest' or `RequestEntityTooLarge' exception is raised
+    then if the input isn't valid XML or is too large.
     """)
 
     content_type = zope.interface.Attribute("""
@@ -530,6 +567,220 @@ class IOpaquePropertyStorage(zope.interface.Interface):
         """
 
 
+class IBulkOpaquePropertyStorage(IOpaquePropertyStorage):
+    """
+    A dead property storage that can return the values of many properties
+    in one call. PROPFIND requests for all the properties of a resource use
+    this, instead of looking up each dead property in turn, when the storage
+    provides it.
+    """
+
+    def getProperties(tags = None):
+        """
+        Return an iterable of (tag, value) pairs of the named dead
+        properties, or of all the dead properties if `tags` is None. Tags
+        that aren't defined for the current resource are skipped.
+        """
+
+
+class IBulkPropertyProvider(zope.interface.Interface):
+    """
+    Optional multi-adapter of a collection and the request that supplies the
+    values of some live properties for all the members of the collection in
+    one call, for example from a catalog. PROPFIND requests with a depth of
+    1 or infinity query this adapter before rendering the members of a
+    collection, any property value not returned by this adapter is looked
+    up through the storage adapter of the member.
+
+    Since the storage adapters are not used the provider is responsible for
+    only returning values that the current user is allowed to see.
+    """
+
+    def getPropertyValues(tags):
+        """
+        Return a mapping from the `__name__' of each member of the collection
+        to a mapping of the property tags to the value of the property. The
+        value of a property must be valid for the field of the corresponding
+        IDAVProperty utility.
+
+        `tags' is the list of property tags, in Clark notation, requested.
+        The provider may leave out any members or properties it doesn't know
+        about.
+        """
+
+
+class IRequestLimits(zope.interface.Interface):
+    """
+    Limits placed on the XML bodies of WebDAV requests, which are checked
+    while the body is parsed. Register a utility providing this interface,
+    or use the `webdav:requestlimits' ZCML directive, to change the default
+    limits.
+
+    Bodies larger then `maxSize' are rejected with a 413 (Request Entity
+    Too Large) status, and bodies exceeding the other limits, or containing
+    a document type declaration, with a 400 (Bad Request) status.
+    """
+
+    maxSize = schema.Int(
+        title = u"Maximum size",
+        description = u"""Maximum size in bytes of a XML request body. None
+                          means no limit.""",
+        min = 1,
+        default = 10 * 1024 * 1024,
+        required = False)
+
+    maxElements = schema.Int(
+        title = u"Maximum number of elements",
+        description = u"""Maximum number of elements in a XML request body.
+                          None means no limit.""",
+        min = 1,
+        default = 100000,
+        required = False)
+
+    maxDepth = schema.Int(
+        title = u"Maximum depth",
+        description = u"""Maximum depth to which the elements of a XML
+                          request body are nested. None means no limit.""",
+        min = 1,
+        default = 100,
+        required = False)
+
+
+class IPropfindPolicy(zope.interface.Interface):
+    """
+    Limits placed on the PROPFIND requests handled by this server. Register
+    a utility providing this interface, or use the `webdav:propfind' ZCML
+    directive, to change the default policy.
+    """
+
+    depthInfinity = schema.Bool(
+        title = u"Allow Depth infinity",
+        description = u"""If False then all PROPFIND requests with a Depth
+                          of infinity are rejected with a 403 status and the
+                          `DAV:propfind-finite-depth' precondition.""",
+        default = True,
+        required = False)
+
+    maxResources = schema.Int(
+        title = u"Maximum number of resources",
+        description = u"""Maximum number of resources rendered in response
+                          to a PROPFIND request with a Depth of infinity.
+                          None means no limit.""",
+        min = 1,
+        default = None,
+        required = False)
+
+    timeLimit = schema.Float(
+        title = u"Time limit",
+        description = u"""Maximum number of seconds spent rendering the
+                          response to a PROPFIND request with a Depth of
+                          infinity. None means no limit.""",
+        min = 0.0,
+        default = None,
+        required = False)
+
+    truncate = schema.Bool(
+        title = u"Truncate responses",
+        description = u"""If True a PROPFIND request that exceeds one of
+                          the above limits returns the resources rendered
+                          so far followed by a 507 (Insufficient Storage)
+                          response for the requested resource. Otherwise the
+                          request fails with a 403 status and the
+                          `DAV:propfind-finite-depth' precondition.""",
+        default = True,
+        required = False)
+
+    errorSamples = schema.Int(
+        title = u"Error samples",
+        description = u"""Number of errors of the same type, raised
+                          rendering the same property, that are passed to
+                          the error reporting utility during one PROPFIND
+                          request. Any further errors are only counted and
+                          logged once the response is rendered.""",
+        min = 0,
+        default = 1,
+        required = False)
+
+
+class IPropfindCache(zope.interface.Interface):
+    """
+    Cache of the `response' XML elements rendered in reply to PROPFIND
+    requests. Register a utility providing this interface, or use the
+    `webdav:propfindcache' ZCML directive, to enable caching.
+
+    Only the responses of persistent objects are cached, and they are only
+    used for the same committed state of the object. The responses of an
+    object are forgotten when an `IObjectModifiedEvent' or
+    `IObjectMovedEvent' is fired for it.
+    """
+
+    size = schema.Int(
+        title = u"Size",
+        description = u"""Maximum number of rendered responses kept in the
+                          cache. The least recently used responses are
+                          discarded first.""",
+        min = 1,
+        default = 1000,
+        required = True)
+
+    uncacheable = zope.interface.Attribute(u"""Set of property tags whose
+    value can change without the resource being modified, for example the
+    `{DAV:}lockdiscovery' property. These properties are left out of the
+    cached responses and rendered again for every request.""")
+
+    def get(ob, key):
+        """
+        Return the rendered `response' XML element of `ob' stored under
+        `key', or None. `key' identifies the request, like the URL of `ob',
+        the properties requested and the current principal.
+        """
+
+    def set(ob, key, data):
+        """
+        Store the rendered `response' XML element `data' of `ob' under
+        `key'.
+        """
+
+    def invalidate(ob):
+        """
+        Forget all the rendered responses of `ob'.
+        """
+
+
+class IResponseCompression(zope.interface.Interface):
+    """
+    Compress the XML bodies of the multistatus responses with the best
+    content coding accepted by the client. Register a utility providing
+    this interface, or use the `webdav:compression' ZCML directive, to
+    enable compression.
+    """
+
+    threshold = schema.Int(
+        title = u"Threshold",
+        description = u"""Bodies smaller then this number of bytes are not
+                          compressed.""",
+        min = 0,
+        default = 1024,
+        required = True)
+
+    level = schema.Int(
+        title = u"Compression level",
+        description = u"""Compression level from 1, the fastest, to 9, the
+                          best compression.""",
+        min = 1,
+        max = 9,
+        default = 6,
+        required = True)
+
+    def compress(request, result):
+        """
+        Return the body `result' of the response to `request' compressed
+        with a content coding accepted by the client, setting the
+        `Content-Encoding' header, or `result' if it can't be compressed.
+        Iterable results are compressed incrementally.
+        """
+
+
 class IDAVLockmanager(zope.interface.Interface):
     """
     Helper adapter for manage locks in an independent manner. Different
@@ -42,7 +42,6 @@ import copy
 import time
 import random
 import datetime
-from xml.etree import ElementTree
 
 import persistent
 import zope.component
@@ -55,6 +54,7 @@ import z3c.dav.interfaces
 import z3c.dav.properties
 from z3c.dav.coreproperties import IDAVLockdiscovery, IDAVSupportedlock
 import z3c.dav.utils
+from z3c.dav.xmlengine import ElementTree
 import ifvalidator
 
 MAXTIMEOUT = (2L ** 32) - 1
@@ -0,0 +1,130 @@
+##############################################################################
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+##############################################################################
+"""ZCML directive handlers for configuring the WebDAV protocol.
+
+  >>> from zope.configuration import xmlconfig
+  >>> context = xmlconfig.file("meta.zcml", z3c.dav)
+  >>> context = xmlconfig.string('''
+  ... <configure xmlns="http://namespaces.zope.org/webdav">
+  ...   <propfind
+  ...      depthInfinity="false"
+  ...      maxResources="1000"
+  ...      timeLimit="2.5"
+  ...      errorSamples="5"
+  ...      />
+  ... </configure>''', context)
+
+  >>> policy = zope.component.getUtility(z3c.dav.interfaces.IPropfindPolicy)
+  >>> policy.depthInfinity
+  False
+  >>> policy.maxResources
+  1000
+  >>> policy.timeLimit
+  2.5
+  >>> policy.truncate
+  True
+  >>> policy.errorSamples
+  5
+
+The `requestlimits' directive configures the limits placed on the XML
+bodies of requests.
+
+  >>> context = xmlconfig.string('''
+  ... <configure xmlns="http://namespaces.zope.org/webdav">
+  ...   <requestlimits
+  ...      maxSize="1048576"
+  ...      maxElements="5000"
+  ...      />
+  ... </configure>''', context)
+
+  >>> limits = zope.component.getUtility(z3c.dav.interfaces.IRequestLimits)
+  >>> limits.maxSize
+  1048576
+  >>> limits.maxElements
+  5000
+  >>> limits.maxDepth
+  100
+
+The `propfindcache' directive enables the caching of the rendered responses.
+
+  >>> context = xmlconfig.string('''
+  ... <configure xmlns="http://namespaces.zope.org/webdav">
+  ...   <propfindcache size="500" />
+  ... </configure>''', context)
+
+  >>> cache = zope.component.getUtility(z3c.dav.interfaces.IPropfindCache)
+  >>> cache.size
+  500
+
+The `compression' directive enables the compression of the multistatus
+responses.
+
+  >>> context = xmlconfig.string('''
+  ... <configure xmlns="http://namespaces.zope.org/webdav">
+  ...   <compression threshold="512" level="9" />
+  ... </configure>''', context)
+
+  >>> compression = zope.component.getUtility(
+  ...     z3c.dav.interfaces.IResponseCompression)
+  >>> compression.threshold
+  512
+  >>> compression.level
+  9
+
+"""
+__docformat__ = 'restructuredtext'
+
+import zope.component
+from zope.component.zcml import utility
+
+import z3c.dav
+import z3c.dav.compression
+import z3c.dav.interfaces
+import z3c.dav.propfind
+import z3c.dav.propfindcache
+import z3c.dav.publisher
+
+def propfind(_context, depthInfinity = True, maxResources = None,
+             timeLimit = None, truncate = True, errorSamples = 1):
+    policy = z3c.dav.propfind.PropfindPolicy(
+        depthInfinity = depthInfinity,
+        maxResources = maxResources,
+        timeLimit = timeLimit,
+        truncate = truncate,
+        errorSamples = errorSamples)
+
+    utility(_context, provides = z3c.dav.interfaces.IPropfindPolicy,
+            component = policy)
+
+
+def requestlimits(_context, maxSize = 10 * 1024 * 1024, maxElements = 100000,
+                  maxDepth = 100):
+    limits = z3c.dav.publisher.RequestLimits(
+        maxSize = maxSize, maxElements = maxElements, maxDepth = maxDepth)
+
+    utility(_context, provides = z3c.dav.interfaces.IRequestLimits,
+            component = limits)
+
+
+def propfindcache(_context, size = 1000):
+    cache = z3c.dav.propfindcache.PropfindCache(size = size)
+
+    utility(_context, provides = z3c.dav.interfaces.IPropfindCache,
+            component = cache)
+
+
+def compression(_context, threshold = 1024, level = 6):
+    compression = z3c.dav.compression.ResponseCompression(
+        threshold = threshold, level = level)
+
+    utility(_context, provides = z3c.dav.interfaces.IResponseCompression,
+            component = compression)
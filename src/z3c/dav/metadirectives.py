@@ -0,0 +1,66 @@
+##############################################################################
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+##############################################################################
+"""ZCML directives for configuring the WebDAV protocol.
+"""
+__docformat__ = 'restructuredtext'
+
+import zope.interface
+from zope import schema
+
+import z3c.dav.interfaces
+
+class IPropfindDirective(z3c.dav.interfaces.IPropfindPolicy):
+    """
+    Configure the limits placed on PROPFIND requests.
+    """
+
+
+class IRequestLimitsDirective(z3c.dav.interfaces.IRequestLimits):
+    """
+    Configure the limits placed on the XML bodies of requests.
+    """
+
+
+class IPropfindCacheDirective(zope.interface.Interface):
+    """
+    Cache the `response' XML elements rendered in reply to PROPFIND
+    requests.
+    """
+
+    size = schema.Int(
+        title = u"Size",
+        description = u"Maximum number of rendered responses to cache.",
+        min = 1,
+        default = 1000,
+        required = False)
+
+
+class ICompressionDirective(zope.interface.Interface):
+    """
+    Compress the XML bodies of the multistatus responses.
+    """
+
+    threshold = schema.Int(
+        title = u"Threshold",
+        description = u"Bodies smaller then this number of bytes are not "
+                      u"compressed.",
+        min = 0,
+        default = 1024,
+        required = False)
+
+    level = schema.Int(
+        title = u"Compression level",
+        description = u"Compression level from 1 to 9.",
+        min = 1,
+        max = 9,
+        default = 6,
+        required = False)
@@ -16,18 +16,25 @@ datamodel.txt
 """
 __docformat__ = 'restructuredtext'
 
-from xml.etree import ElementTree
+import threading
+import types
+from collections import OrderedDict
 
 import zope.component
+import zope.event.classhandler
 import zope.interface
+import zope.interface.interfaces
 from zope import schema
 from zope.schema.interfaces import IField
 from zope.schema.fieldproperty import FieldProperty
 
 from z3c.dav.interfaces import IDAVProperty, IDAVWidget, IDAVInputWidget
 from z3c.dav.interfaces import IOpaquePropertyStorage
+from z3c.dav.interfaces import IBulkOpaquePropertyStorage
 import z3c.dav.widgets
 import z3c.dav.utils
+import z3c.dav.xmlengine
+from z3c.dav.xmlengine import ElementTree
 
 class DAVProperty(object):
     """
@@ -85,12 +92,78 @@ class DeadField(schema.Field):
     pass
 
 
+class SerializedElement(str):
+    """
+    The value of a dead property as stored by `OpaqueInputWidget`. It is
+    serialized by `z3c.dav.xmlengine.tofragment`, so it declares all the
+    namespaces it uses and has no tail, and can be written into any
+    multistatus response as it is.
+
+      >>> value = SerializedElement('<E:a xmlns:E="urn:e">x</E:a>')
+      >>> value == '<E:a xmlns:E="urn:e">x</E:a>'
+      True
+
+    """
+    __slots__ = ()
+
+
 class OpaqueWidget(z3c.dav.widgets.DAVWidget):
+    """
+    Dead properties are stored as serialized XML elements, see
+    `OpaqueInputWidget`.
+
+      >>> from cStringIO import StringIO
+      >>> from z3c.dav.publisher import WebDAVRequest
+      >>> field = OpaqueField(__name__ = 'a', tag = '{urn:e}a', title = u'')
+      >>> widget = OpaqueWidget(field, WebDAVRequest(StringIO(''), {}))
+      >>> widget.setRenderedValue('<E:a xmlns:E="urn:e">x</E:a>')
+      >>> widget.render().tag
+      '{urn:e}a'
+
+    When rendering a multistatus response the values stored by the
+    `OpaqueInputWidget` are written out as they are, without parsing them.
+
+      >>> widget.setRenderedValue(
+      ...     SerializedElement('<E:a xmlns:E="urn:e">x</E:a>'))
+      >>> fragment = widget.renderFragment()
+      >>> fragment.tag, fragment.data
+      ('{urn:e}a', '<E:a xmlns:E="urn:e">x</E:a>')
+
+    Any other value, like the values stored by older versions with the
+    tail of the element, or set by other code, is parsed. So a malformed
+    value fails on its own instead of breaking the whole response.
+
+      >>> widget.setRenderedValue('<E:a xmlns:E="urn:e">x</E:a>\\n')
+      >>> z3c.dav.xmlengine.iselement(widget.renderFragment())
+      True
+      >>> widget.setRenderedValue('<E:a xmlns:E="urn:e">x</E:a> tail')
+      >>> try:
+      ...     widget.renderFragment()
+      ... except Exception:
+      ...     print 'not well-formed'
+      not well-formed
+
+    """
 
     def render(self):
-        el = ElementTree.fromstring(self._value)
+        el = z3c.dav.xmlengine.fromstring(self._value)
         return el
 
+    def renderFragment(self):
+        if isinstance(self._value, SerializedElement):
+            return z3c.dav.utils.XMLFragment(self.context.tag, self._value)
+        return self.render()
+
+
+def renderProperty(widget):
+    """Render the property of `widget` for a multistatus response, avoiding
+    parsing the values of dead properties.
+    """
+    renderFragment = getattr(widget, "renderFragment", None)
+    if renderFragment is not None:
+        return renderFragment()
+    return widget.render()
+
 
 class OpaqueInputWidget(z3c.dav.widgets.DAVInputWidget):
     """
@@ -123,17 +196,20 @@ class OpaqueInputWidget(z3c.dav.widgets.DAVInputWidget):
       >>> prop = OpaqueProperty('{http://webdav.org/neon/litmus/}high-unicode')
       >>> widget = getWidget(prop, storage, request, type = IDAVInputWidget)
 
-      >>> print widget.getInputValue() #doctest:+XMLDATA
+      >>> value = widget.getInputValue()
+      >>> print value #doctest:+XMLDATA
       <ns0:high-unicode xmlns:ns0="http://webdav.org/neon/litmus/">\xf0\x90\x80\x80</ns0:high-unicode>
+      >>> isinstance(value, SerializedElement)
+      True
 
     """
 
     def getInputValue(self):
-        el = self.request.xmlDataSource.findall(
-            "{DAV:}set/{DAV:}prop/%s" % self.context.tag)
+        el = z3c.dav.widgets.getProppatchIndex(self.request)[self.context.tag]
 
-        # XXX - ascii seems a bit wrong here
-        return ElementTree.tostring(el[-1], encoding = "utf-8")
+        # Store the element so that it can be written into any multistatus
+        # response without parsing it again, see OpaqueWidget.
+        return SerializedElement(z3c.dav.xmlengine.tofragment(el))
 
 
 class IOpaqueField(IField):
@@ -222,8 +298,339 @@ class OpaqueProperty(object):
         self.restricted = False
 
 
+_opaqueProperties = OrderedDict() # tag -> OpaqueProperty
+_opaquePropertiesLock = threading.Lock()
+_opaquePropertiesSize = 10000
+
+def getOpaqueProperty(tag):
+    """
+    Return the `OpaqueProperty` called `tag`. The same dead properties turn
+    up on most resources so the properties, which are never modified once
+    created, are shared. Only the most recently used properties are kept.
+
+      >>> prop = getOpaqueProperty('{examplens:}testprop')
+      >>> prop.field.tag
+      '{examplens:}testprop'
+      >>> getOpaqueProperty('{examplens:}testprop') is prop
+      True
+
+      >>> import z3c.dav.properties
+      >>> z3c.dav.properties._opaquePropertiesSize = 2
+      >>> prop2 = getOpaqueProperty('{examplens:}testprop2')
+      >>> prop3 = getOpaqueProperty('{examplens:}testprop3')
+      >>> getOpaqueProperty('{examplens:}testprop') is prop
+      False
+      >>> getOpaqueProperty('{examplens:}testprop3') is prop3
+      True
+      >>> len(_opaqueProperties)
+      2
+      >>> z3c.dav.properties._opaquePropertiesSize = 10000
+
+    """
+    _opaquePropertiesLock.acquire()
+    try:
+        prop = _opaqueProperties.pop(tag, None)
+        if prop is None:
+            prop = OpaqueProperty(tag)
+            while len(_opaqueProperties) >= _opaquePropertiesSize:
+                _opaqueProperties.popitem(last = False)
+        _opaqueProperties[tag] = prop
+        return prop
+    finally:
+        _opaquePropertiesLock.release()
+
+
+class OpaquePropertyValues(object):
+    """
+    Storage for the values of dead properties read from a
+    `IBulkOpaquePropertyStorage` in one call, used in place of the storage
+    when rendering the properties.
+
+      >>> storage = OpaquePropertyValues(None, [('{E:}a', '<a xmlns="E:" />')])
+      >>> storage.tags
+      ['{E:}a']
+      >>> getOpaqueProperty('{E:}a').field.get(storage)
+      '<a xmlns="E:" />'
+
+    """
+
+    def __init__(self, storage, items):
+        self.storage = storage
+        self.tags = []
+        self.values = {}
+        for tag, value in items:
+            self.tags.append(tag)
+            self.values[tag] = value
+
+    def getProperty(self, tag):
+        try:
+            return self.values[tag]
+        except KeyError:
+            return self.storage.getProperty(tag)
+
+
+def getDeadProperties(storage):
+    """
+    Return an iterable of the (property, storage) pairs of all the dead
+    properties in the `IOpaquePropertyStorage` storage, to render them. The
+    values are read in one call when the storage provides
+    `IBulkOpaquePropertyStorage`, and the storage returned is then an
+    `OpaquePropertyValues` that only supports reading them.
+
+      >>> class Storage(object):
+      ...     zope.interface.implements(IBulkOpaquePropertyStorage)
+      ...     def getAllProperties(self):
+      ...         raise NotImplementedError
+      ...     def getProperties(self, tags = None):
+      ...         return [('{E:}a', '<a xmlns="E:">A</a>')]
+      >>> [(prop.field.tag, prop.field.get(values))
+      ...  for prop, values in getDeadProperties(Storage())]
+      [('{E:}a', '<a xmlns="E:">A</a>')]
+
+    """
+    if IBulkOpaquePropertyStorage.providedBy(storage):
+        values = OpaquePropertyValues(storage, storage.getProperties())
+        for tag in values.tags:
+            yield getOpaqueProperty(tag), values
+    else:
+        for tag in storage.getAllProperties():
+            yield getOpaqueProperty(tag), storage
+
+
+class PropertyIndex(object):
+    """
+    Index of the live properties registered with a site manager, so that
+    looking up a property by its tag, or all the properties in a namespace,
+    is a dictionary lookup.
+
+      >>> from z3c.dav.coreproperties import resourcetype, creationdate
+      >>> gsm = zope.component.getGlobalSiteManager()
+      >>> gsm.registerUtility(resourcetype, name = '{DAV:}resourcetype')
+      >>> gsm.registerUtility(creationdate, name = '{DAV:}creationdate')
+
+      >>> index = getPropertyIndex()
+      >>> index.getProperty('{DAV:}resourcetype') is resourcetype
+      True
+      >>> index.getProperty('{DAV:}missing') is None
+      True
+      >>> sorted(index.names)
+      [u'{DAV:}creationdate', u'{DAV:}resourcetype']
+      >>> sorted(index.namespaces['DAV:'])
+      [u'{DAV:}creationdate', u'{DAV:}resourcetype']
+
+    Each tag maps to the property, its interface and its custom widget
+    factories.
+
+      >>> prop, iface, widget, inputwidget = \\
+      ...     index.properties['{DAV:}creationdate']
+      >>> iface is creationdate.iface
+      True
+      >>> widget
+      <class 'z3c.dav.widgets.ISO8601DatetimeDAVWidget'>
+      >>> inputwidget is None
+      True
+
+    The same index is used until the registry changes.
+
+      >>> getPropertyIndex() is index
+      True
+      >>> gsm.unregisterUtility(creationdate, name = '{DAV:}creationdate')
+      True
+      >>> index = getPropertyIndex()
+      >>> index.names
+      [u'{DAV:}resourcetype']
+
+    The widget factories of the properties without custom widgets are
+    looked up once for each type of request.
+
+      >>> from cStringIO import StringIO
+      >>> from z3c.dav.publisher import WebDAVRequest
+      >>> gsm.registerAdapter(z3c.dav.widgets.ListDAVWidget,
+      ...     (schema.interfaces.IList, z3c.dav.interfaces.IWebDAVRequest))
+      >>> request = WebDAVRequest(StringIO(''), {})
+      >>> index.getWidgetFactory(resourcetype, request, IDAVWidget)
+      <class 'z3c.dav.widgets.ListDAVWidget'>
+      >>> index._widgetFactories.values()
+      [<class 'z3c.dav.widgets.ListDAVWidget'>]
+      >>> index.getWidgetFactory(resourcetype, request,
+      ...                        IDAVInputWidget) is None
+      True
+
+    Cleanup
+
+      >>> gsm.unregisterUtility(resourcetype, name = '{DAV:}resourcetype')
+      True
+      >>> gsm.unregisterAdapter(z3c.dav.widgets.ListDAVWidget,
+      ...     (schema.interfaces.IList, z3c.dav.interfaces.IWebDAVRequest))
+      True
+
+    """
+
+    def __init__(self, sitemanager):
+        self.adapters = sitemanager.adapters
+
+        self.names = []
+        self.properties = {} # tag -> (prop, iface, widget, input widget)
+        self.namespaces = {} # namespace -> list of tags
+        for tag, prop in sitemanager.getUtilitiesFor(IDAVProperty):
+            self.names.append(tag)
+            self.properties[tag] = (prop, prop.iface, prop.custom_widget,
+                                    prop.custom_input_widget)
+            self.namespaces.setdefault(prop.namespace, []).append(tag)
+
+        self._widgetFactories = {}
+
+    def getProperty(self, tag):
+        """Return the live property called `tag`, or None."""
+        entry = self.properties.get(tag, None)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def getAllProperties(self):
+        """Return a list of the (tag, property) pairs of all the live
+        properties."""
+        return [(tag, self.properties[tag][0]) for tag in self.names]
+
+    def getWidgetFactory(self, prop, request, type = IDAVWidget):
+        """Return the `type` widget factory registered for the field of
+        `prop` and `request`, or None.
+        """
+        key = (zope.interface.providedBy(prop.field),
+               zope.interface.providedBy(request), type)
+        try:
+            return self._widgetFactories[key]
+        except KeyError:
+            factory = self._widgetFactories[key] = self.adapters.lookup(
+                key[:2], type)
+            return factory
+
+
+_indexAttribute = "_v_z3c_dav_propertyindex"
+_tokenAttribute = "_v_z3c_dav_propertyindextoken"
+_indexLock = threading.Lock()
+
+def _getRegistrations(sitemanager):
+    # Return the utility and adapter registries of `sitemanager` and of all
+    # its bases, as the index depends on all of them.
+    registrations = []
+    seen = []
+    stack = [sitemanager]
+    while stack:
+        components = stack.pop()
+        if components in seen:
+            continue
+        seen.append(components)
+        registrations.append(components.utilities)
+        registrations.append(components.adapters)
+        stack.extend(components.__bases__)
+    return registrations
+
+
+def _isCurrent(index):
+    # Is `index` built from the current registrations?
+    for registrations, token in index.tokens:
+        if getattr(registrations, _tokenAttribute, None) is not token:
+            return False
+    return True
+
+
+def getPropertyIndex():
+    """
+    Return the `PropertyIndex` of the current site manager. It is built
+    the first time it is needed and kept on the site manager's utility
+    registry until a registration event is fired for the site manager, or
+    any of its bases, see `invalidatePropertyIndex`.
+    """
+    sitemanager = zope.component.getSiteManager()
+    index = getattr(sitemanager.utilities, _indexAttribute, None)
+    if index is not None and _isCurrent(index):
+        return index
+
+    _indexLock.acquire()
+    try:
+        index = getattr(sitemanager.utilities, _indexAttribute, None)
+        if index is not None and _isCurrent(index):
+            return index
+
+        tokens = []
+        for registrations in _getRegistrations(sitemanager):
+            token = getattr(registrations, _tokenAttribute, None)
+            if token is None:
+                token = object()
+                setattr(registrations, _tokenAttribute, token)
+            tokens.append((registrations, token))
+
+        index = PropertyIndex(sitemanager)
+        index.tokens = tokens
+        setattr(sitemanager.utilities, _indexAttribute, index)
+        return index
+    finally:
+        _indexLock.release()
+
+
+def invalidatePropertyIndex(event):
+    """
+    Forget the `PropertyIndex` of the registry that a component was
+    registered with, or unregistered from, and of all the site managers
+    based on it.
+
+      >>> from z3c.dav.coreproperties import resourcetype
+      >>> gsm = zope.component.getGlobalSiteManager()
+      >>> index = getPropertyIndex()
+      >>> getPropertyIndex() is index
+      True
+      >>> gsm.registerUtility(resourcetype, name = '{DAV:}resourcetype')
+      >>> getPropertyIndex() is index
+      False
+      >>> getPropertyIndex().names
+      [u'{DAV:}resourcetype']
+
+    Registrations with other registries leave the index alone.
+
+      >>> from zope.interface.registry import Components
+      >>> index = getPropertyIndex()
+      >>> Components().registerUtility(resourcetype, name = '{DAV:}other')
+      >>> getPropertyIndex() is index
+      True
+
+    The index of a local site manager depends on the registrations of its
+    bases.
+
+      >>> local = Components('local', bases = (gsm,))
+      >>> hook = zope.component.getSiteManager.sethook(
+      ...     lambda context = None: local)
+      >>> getPropertyIndex().names
+      [u'{DAV:}resourcetype']
+      >>> gsm.unregisterUtility(resourcetype, name = '{DAV:}resourcetype')
+      True
+      >>> getPropertyIndex().names
+      []
+      >>> ignore = zope.component.getSiteManager.sethook(hook)
+
+    """
+    registry = getattr(event.object, "registry", None)
+    if registry is None:
+        return
+
+    # Hold the lock so that an index being built from the registrations
+    # before this change is discarded once it is stored.
+    _indexLock.acquire()
+    try:
+        for registrations in (registry.utilities, registry.adapters):
+            try:
+                delattr(registrations, _tokenAttribute)
+            except AttributeError:
+                pass
+    finally:
+        _indexLock.release()
+
+zope.event.classhandler.handler(zope.interface.interfaces.RegistrationEvent,
+                                invalidatePropertyIndex)
+
+
 def getAllProperties(context, request):
-    for name, prop in zope.component.getUtilitiesFor(IDAVProperty):
+    for name, prop in getPropertyIndex().getAllProperties():
         adapter = zope.component.queryMultiAdapter((context, request),
                                                    prop.iface,
                                                    default = None)
@@ -237,11 +644,24 @@ def getAllProperties(context, request):
         raise StopIteration
 
     for tag in adapter.getAllProperties():
-        yield OpaqueProperty(tag), adapter
+        yield getOpaqueProperty(tag), adapter
+
+
+def getAllPropertyNames(context, request):
+    """
+    Return the tags of all the properties defined for `context`.
+
+    Unlike `getAllProperties` the storage adapters of the live properties
+    are only created when their factory isn't a class, as these can return
+    None. Otherwise a live property is defined if a storage adapter is
+    registered for `context`. And only the names of the dead properties
+    are read.
+    """
+    return PropertyPlan(request).getAllPropertyNames(context)
 
 
 def hasProperty(context, request, tag):
-    prop = zope.component.queryUtility(IDAVProperty, name = tag, default = None)
+    prop = getPropertyIndex().getProperty(tag)
     if prop is None:
         adapter = IOpaquePropertyStorage(context, None)
         if adapter is not None and adapter.hasProperty(tag):
@@ -256,21 +676,25 @@ def hasProperty(context, request, tag):
     return True
 
 
-def getProperty(context, request, tag, exists = False):
-    prop = zope.component.queryUtility(IDAVProperty, name = tag, default = None)
-    if prop is None:
-        adapter = IOpaquePropertyStorage(context, None)
-        if adapter is None:
-            ## XXX - should we use the zope.publisher.interfaces.NotFound
-            ## exceptin here.
-            raise z3c.dav.interfaces.PropertyNotFound(context, tag, tag)
+def _getOpaqueProperty(context, tag, exists):
+    adapter = IOpaquePropertyStorage(context, None)
+    if adapter is None:
+        ## XXX - should we use the zope.publisher.interfaces.NotFound
+        ## exceptin here.
+        raise z3c.dav.interfaces.PropertyNotFound(context, tag, tag)
+
+    if exists and not adapter.hasProperty(tag):
+        ## XXX - should we use the zope.publisher.interfaces.NotFound
+        ## exceptin here.
+        raise z3c.dav.interfaces.PropertyNotFound(context, tag, tag)
+
+    return getOpaqueProperty(tag), adapter
 
-        if exists and not adapter.hasProperty(tag):
-            ## XXX - should we use the zope.publisher.interfaces.NotFound
-            ## exceptin here.
-            raise z3c.dav.interfaces.PropertyNotFound(context, tag, tag)
 
-        return OpaqueProperty(tag), adapter
+def getProperty(context, request, tag, exists = False):
+    prop = getPropertyIndex().getProperty(tag)
+    if prop is None:
+        return _getOpaqueProperty(context, tag, exists)
 
     adapter = zope.component.queryMultiAdapter((context, request), prop.iface,
                                                default = None)
@@ -282,15 +706,57 @@ def getProperty(context, request, tag, exists = False):
     return prop, adapter
 
 
-def getWidget(prop, adapter, request, type = IDAVWidget):
+def getWidget(prop, adapter, request, type = IDAVWidget, factory = None):
     """prop.field describes the data we want to render.
+
+    `factory` is an optional widget factory that has already been looked up
+    for this property.
+
+    A factory that returns None, like a conditional adapter, is treated as
+    a missing widget.
+
+      >>> from cStringIO import StringIO
+      >>> from z3c.dav.publisher import WebDAVRequest
+      >>> from z3c.dav.coreproperties import resourcetype
+      >>> request = WebDAVRequest(StringIO(''), {})
+      >>> def declined(field, request):
+      ...     return None
+      >>> getWidget(resourcetype, None, request,
+      ...           factory = declined) #doctest:+ELLIPSIS
+      Traceback (most recent call last):
+      ...
+      ComponentLookupError: ((<zope.schema._field.List object at ...>, <z3c.dav.publisher.WebDAVRequest instance URL=http:/>), <InterfaceClass z3c.dav.interfaces.IDAVWidget>)
+
+      >>> gsm = zope.component.getGlobalSiteManager()
+      >>> gsm.registerAdapter(declined,
+      ...     (schema.interfaces.IList, z3c.dav.interfaces.IWebDAVRequest),
+      ...     IDAVWidget)
+      >>> getWidget(resourcetype, None, request) #doctest:+ELLIPSIS
+      Traceback (most recent call last):
+      ...
+      ComponentLookupError: ((<zope.schema._field.List object at ...>, <z3c.dav.publisher.WebDAVRequest instance URL=http:/>), <InterfaceClass z3c.dav.interfaces.IDAVWidget>)
+      >>> gsm.unregisterAdapter(declined,
+      ...     (schema.interfaces.IList, z3c.dav.interfaces.IWebDAVRequest),
+      ...     IDAVWidget)
+      True
+
     """
-    if type is IDAVWidget and prop.custom_widget is not None:
+    if factory is not None:
+        widget = factory(prop.field, request)
+    elif type is IDAVWidget and prop.custom_widget is not None:
         widget = prop.custom_widget(prop.field, request)
     elif type is IDAVInputWidget and prop.custom_input_widget is not None:
         widget = prop.custom_input_widget(prop.field, request)
     else:
-        widget = zope.component.getMultiAdapter((prop.field, request), type)
+        factory = getPropertyIndex().getWidgetFactory(prop, request, type)
+        widget = None
+        if factory is not None:
+            widget = factory(prop.field, request)
+
+    if widget is None:
+        # No factory, or a conditional one that declined, as with
+        # getMultiAdapter.
+        raise zope.component.ComponentLookupError((prop.field, request), type)
 
     if IDAVWidget.providedBy(widget):
         field = prop.field.bind(adapter)
@@ -299,3 +765,242 @@ def getWidget(prop, adapter, request, type = IDAVWidget):
     widget.namespace = prop.namespace
 
     return widget
+
+
+class PropertyValue(object):
+    """
+    Storage for the value of a live property supplied by an
+    `IBulkPropertyProvider`, used in place of the storage adapter of the
+    property when rendering it.
+
+      >>> from z3c.dav.coreproperties import IDAVGetcontentlength
+      >>> prop = DAVProperty('{DAV:}getcontentlength', IDAVGetcontentlength)
+      >>> storage = PropertyValue(prop, 10)
+      >>> prop.field.get(storage)
+      10
+
+    """
+
+    def __init__(self, prop, value):
+        setattr(self, prop.field.__name__, value)
+
+
+class PropertyPlan(object):
+    """
+    All the information about the live properties that is needed to render
+    the properties of a number of resources within the one request.
+
+    Looking up the live properties, their widgets and which properties are
+    included in the response is the same for every resource rendered in
+    response to a PROPFIND request, so we only do this once per request.
+    Only the storage adapters need to be looked up per resource.
+
+      >>> from cStringIO import StringIO
+      >>> from z3c.dav.publisher import WebDAVRequest
+      >>> from z3c.dav.coreproperties import resourcetype, ResourceTypeAdapter
+      >>> gsm = zope.component.getGlobalSiteManager()
+      >>> gsm.registerUtility(resourcetype, name = '{DAV:}resourcetype')
+      >>> gsm.registerAdapter(ResourceTypeAdapter)
+      >>> gsm.registerAdapter(z3c.dav.widgets.ListDAVWidget,
+      ...     (schema.interfaces.IList, z3c.dav.interfaces.IWebDAVRequest))
+
+      >>> request = WebDAVRequest(StringIO(''), {})
+      >>> include = ElementTree.fromstring(
+      ...     '<include xmlns="DAV:"><resourcetype /></include>')
+      >>> plan = PropertyPlan(request, include)
+      >>> plan.properties == [resourcetype]
+      True
+      >>> plan.names
+      [u'{DAV:}resourcetype']
+      >>> plan.isLiveProperty('{DAV:}resourcetype')
+      True
+      >>> plan.isLiveProperty('{DAV:}missing')
+      False
+      >>> plan.included
+      frozenset(['{DAV:}resourcetype'])
+
+      >>> resource = Demo()
+      >>> [(prop, adapter.__class__) for prop, adapter in
+      ...  plan.getAllProperties(resource)] == [
+      ...      (resourcetype, ResourceTypeAdapter)]
+      True
+
+    Only the names of the properties are needed to answer a `propname`
+    request, so we don't need to create the storage adapters.
+
+      >>> list(plan.getAllPropertyNames(resource))
+      [u'{DAV:}resourcetype']
+      >>> list(getAllPropertyNames(resource, request))
+      [u'{DAV:}resourcetype']
+
+      >>> prop, adapter = plan.getProperty(resource, '{DAV:}resourcetype')
+      >>> prop is resourcetype
+      True
+      >>> plan.getProperty(resource, '{DAV:}missing', exists = True)
+      Traceback (most recent call last):
+      ...
+      PropertyNotFound: {DAV:}missing
+
+    The widget factory is looked up in the `PropertyIndex`, so only once.
+
+      >>> widget = plan.getWidget(prop, adapter)
+      >>> widget.__class__
+      <class 'z3c.dav.widgets.ListDAVWidget'>
+      >>> print ElementTree.tostring(widget.render()) #doctest:+XMLDATA
+      <resourcetype xmlns="DAV:" />
+      >>> plan.index._widgetFactories.values()
+      [<class 'z3c.dav.widgets.ListDAVWidget'>]
+
+    The storage adapter factories are remembered for each interface
+    specification, so sibling resources that provide the same interfaces
+    don't search the adapter registry again.
+
+      >>> plan.getProperty(Demo(), '{DAV:}resourcetype')[1].__class__
+      <class 'z3c.dav.coreproperties.ResourceTypeAdapter'>
+      >>> plan._adapterFactories.values()
+      [<class 'z3c.dav.coreproperties.ResourceTypeAdapter'>]
+
+    These factories are forgotten when the adapter registry changes.
+
+      >>> gsm.unregisterUtility(resourcetype, name = '{DAV:}resourcetype')
+      True
+      >>> gsm.unregisterAdapter(ResourceTypeAdapter)
+      True
+      >>> plan.getProperty(resource, '{DAV:}resourcetype')
+      Traceback (most recent call last):
+      ...
+      PropertyNotFound: {DAV:}resourcetype
+
+    Cleanup
+
+      >>> gsm.unregisterAdapter(z3c.dav.widgets.ListDAVWidget,
+      ...     (schema.interfaces.IList, z3c.dav.interfaces.IWebDAVRequest))
+      True
+
+    """
+
+    def __init__(self, request, include = None):
+        self.request = request
+        self.include = include
+
+        self.index = getPropertyIndex()
+        self.names = list(self.index.names)
+        self.properties = [self.index.getProperty(name)
+                           for name in self.names]
+
+        if include is not None:
+            self.included = frozenset([el.tag for el in include])
+        else:
+            self.included = frozenset()
+
+        self._factoriesIndex = self.index
+        self._adapterFactories = {}
+
+    def isLiveProperty(self, tag):
+        """Return True if `tag` is the name of a live property."""
+        return tag in self.index.properties
+
+    def getAllProperties(self, context, values = None):
+        """See the getAllProperties method, except that this is only used to
+        render the properties. So the adapters returned with the properties
+        are not always the storage adapters and only support reading the
+        values of the properties.
+
+        `values` is an optional mapping of property tags to the values
+        supplied by an `IBulkPropertyProvider`, these properties don't need
+        to look up their storage adapters. And the values of the dead
+        properties are read in one call, see `getDeadProperties`.
+        """
+        for name, prop in zip(self.names, self.properties):
+            if values and name in values:
+                yield prop, PropertyValue(prop, values[name])
+                continue
+
+            adapter = self.queryAdapter(context, prop.iface)
+            if adapter is None:
+                continue
+
+            yield prop, adapter
+
+        adapter = IOpaquePropertyStorage(context, None)
+        if adapter is None:
+            return
+
+        for prop, storage in getDeadProperties(adapter):
+            yield prop, storage
+
+    def getAllPropertyNames(self, context):
+        """See the getAllPropertyNames method."""
+        for name, prop in zip(self.names, self.properties):
+            factory = self._lookupFactory(context, prop.iface)
+            if factory is None:
+                continue
+            if not isinstance(factory, (type, types.ClassType)) and \
+                   factory(context, self.request) is None:
+                # Like queryMultiAdapter, any factory other then a class
+                # can return None, in which case the property isn't
+                # defined for context.
+                continue
+            yield name
+
+        adapter = IOpaquePropertyStorage(context, None)
+        if adapter is None:
+            return
+
+        for tag in adapter.getAllProperties():
+            yield tag
+
+    def getProperty(self, context, tag, exists = False, values = None):
+        """See the getProperty method."""
+        prop = self.index.getProperty(tag)
+        if prop is None:
+            return _getOpaqueProperty(context, tag, exists)
+
+        if values and tag in values:
+            return prop, PropertyValue(prop, values[tag])
+
+        adapter = self.queryAdapter(context, prop.iface)
+        if adapter is None:
+            raise z3c.dav.interfaces.PropertyNotFound(context, tag, tag)
+
+        return prop, adapter
+
+    def _getRegistry(self):
+        # Return the adapter registry in use, forgetting all the factories
+        # we have cached if its property index has been replaced since we
+        # last looked.
+        index = getPropertyIndex()
+        if index is not self._factoriesIndex:
+            self._factoriesIndex = index
+            self._adapterFactories.clear()
+        return index.adapters
+
+    def _lookupFactory(self, context, iface):
+        # Return the factory of the iface adapter of context and the
+        # request, which is remembered for each interface specification
+        # that context provides.
+        registry = self._getRegistry()
+        key = (zope.interface.providedBy(context),
+               zope.interface.providedBy(self.request),
+               iface)
+        try:
+            return self._adapterFactories[key]
+        except KeyError:
+            factory = self._adapterFactories[key] = registry.lookup(
+                key[:2], iface)
+            return factory
+
+    def queryAdapter(self, context, iface):
+        """Same as `queryMultiAdapter((context, request), iface)` except that
+        the adapter factory is remembered for each interface specification
+        that context provides.
+        """
+        factory = self._lookupFactory(context, iface)
+        if factory is None:
+            return None
+        # like queryMultiAdapter a factory can return None
+        return factory(context, self.request)
+
+    def getWidget(self, prop, adapter, type = IDAVWidget):
+        """See the getWidget method."""
+        return getWidget(prop, adapter, self.request, type)
@@ -35,20 +35,155 @@ And all these methods return a z3c.dav.utils.IResponse implementation.
 __docformat__ = 'restructuredtext'
 
 import sys
-from xml.etree import ElementTree
+import time
+import inspect
+import logging
+import itertools
 
 import zope.interface
 import zope.component
+from zope.schema.fieldproperty import FieldProperty
 from zope.filerepresentation.interfaces import IReadDirectory
 from zope.error.interfaces import IErrorReportingUtility
 import zope.security.interfaces
+from zope.security.proxy import removeSecurityProxy
 
+import z3c.dav.compression
 import z3c.dav.utils
 import z3c.dav.interfaces
 import z3c.dav.properties
+import z3c.dav.xmlengine
+from z3c.dav.xmlengine import ElementTree
 
 DEFAULT_NS = "DAV:"
 
+logger = logging.getLogger("z3c.dav.propfind")
+
+class PropfindPolicy(object):
+    """
+    Limits placed on PROPFIND requests.
+
+      >>> from zope.interface.verify import verifyObject
+      >>> policy = PropfindPolicy()
+      >>> verifyObject(z3c.dav.interfaces.IPropfindPolicy, policy)
+      True
+      >>> policy.depthInfinity
+      True
+      >>> policy.maxResources is None
+      True
+      >>> policy.timeLimit is None
+      True
+      >>> policy.truncate
+      True
+      >>> policy.errorSamples
+      1
+
+      >>> policy = PropfindPolicy(maxResources = 0)
+      Traceback (most recent call last):
+      ...
+      TooSmall: (0, 1)
+
+    """
+    zope.interface.implements(z3c.dav.interfaces.IPropfindPolicy)
+
+    depthInfinity = FieldProperty(
+        z3c.dav.interfaces.IPropfindPolicy["depthInfinity"])
+    maxResources = FieldProperty(
+        z3c.dav.interfaces.IPropfindPolicy["maxResources"])
+    timeLimit = FieldProperty(z3c.dav.interfaces.IPropfindPolicy["timeLimit"])
+    truncate = FieldProperty(z3c.dav.interfaces.IPropfindPolicy["truncate"])
+    errorSamples = FieldProperty(
+        z3c.dav.interfaces.IPropfindPolicy["errorSamples"])
+
+    def __init__(self, depthInfinity = True, maxResources = None,
+                 timeLimit = None, truncate = True, errorSamples = 1):
+        self.depthInfinity = depthInfinity
+        self.maxResources = maxResources
+        self.timeLimit = timeLimit
+        self.truncate = truncate
+        self.errorSamples = errorSamples
+
+# Used when no IPropfindPolicy utility is registered.
+defaultPolicy = PropfindPolicy()
+
+
+def _getPrefetch(jar):
+    # Return the prefetch method of the ZODB connection `jar', or None if
+    # the connection, before ZODB 5, or its storage, like FileStorage, can't
+    # prefetch. Connection.prefetch silently does nothing in this case.
+    prefetch = getattr(jar, "prefetch", None)
+    if prefetch is None:
+        return None
+    db = getattr(jar, "db", None)
+    if db is not None and not hasattr(db().storage, "prefetch"):
+        return None
+    return prefetch
+
+
+def _prefetch(obs):
+    """
+    Prefetch the state of all the ghosts in `obs', grouped by their ZODB
+    connection, returning the number of objects prefetched. Connections
+    that can't prefetch are skipped.
+    """
+    jars = {}
+    for ob in obs:
+        jar = getattr(ob, "_p_jar", None)
+        if jar is not None and getattr(ob, "_p_changed", False) is None:
+            jars.setdefault(jar, []).append(ob._p_oid)
+
+    count = 0
+    for jar, oids in jars.items():
+        prefetch = _getPrefetch(jar)
+        if prefetch is not None:
+            prefetch(oids)
+            count += len(oids)
+
+    return count
+
+
+def _getKeywords(func):
+    # Return the keyword arguments, added in 1.0b3, that the properties
+    # factory `func' accepts. Methods overridden with the older signature
+    # `(ob, req, extraArg, level = 0)' don't accept any of them.
+    try:
+        args, varargs, varkw, defaults = inspect.getargspec(func)
+    except TypeError:
+        # not a Python function, so we can't tell.
+        return frozenset(["href", "values"])
+    if varkw is not None:
+        return frozenset(["href", "values"])
+    return frozenset(["href", "values"]).intersection(args)
+
+
+def _getTag(el):
+    # Return the tag of the property element `el'.
+    tag = el.tag
+    if isinstance(tag, ElementTree.QName):
+        tag = tag.text
+    return tag
+
+
+def _getFragment(el):
+    # Return the property element `el' serialized so that it can be cached,
+    # and written into any multistatus response.
+    if isinstance(el, z3c.dav.utils.XMLFragment):
+        return el
+    return z3c.dav.utils.XMLFragment(_getTag(el),
+                                     z3c.dav.xmlengine.tofragment(el))
+
+
+def _extendResponse(response, other):
+    # Add the propstats and errors of the response `other' to `response'.
+    for status, propstat in other.getPropstats():
+        extended = response.getPropstat(status)
+        extended.properties.extend(propstat.properties)
+        extended.error.extend(propstat.error)
+        extended.responsedescription += propstat.responsedescription
+    response.error.extend(other.error)
+    response.responsedescription += other.responsedescription
+
+
 class PROPFIND(object):
     """
     PROPFIND handler for all objects.
@@ -57,13 +192,53 @@ class PROPFIND(object):
     zope.component.adapts(
         zope.interface.Interface, z3c.dav.interfaces.IWebDAVRequest)
 
+    # number of members of a collection whose state is prefetched in one go
+    prefetchSize = 100
+
+    # live properties that are stored in the annotations of a resource
+    annotatedProperties = frozenset(["{DAV:}creationdate",
+                                     "{DAV:}displayname",
+                                     "{DAV:}getlastmodified"])
+
     def __init__(self, context, request):
         self.context = context
         self.request = request
 
+        self._plan = None
+        self.prefetched = 0
+        # number of unexpected errors rendering properties
+        self.errors = 0
+        # (property tag, exception type) -> number of errors reported
+        self._errorCounts = {}
+
+        self._cache = None
+        self._cacheKey = None
+        # tags of the requested properties that are never cached
+        self._uncached = frozenset()
+        # properties factory -> keyword arguments it accepts
+        self._factoryKeywords = {}
+
+        # leave the 404 propstats out of the responses, see RFC 8144
+        self.minimal = False
+
     def getDepth(self):
         return self.request.getHeader("depth", "infinity")
 
+    def getPropertyPlan(self, req, include = None):
+        """
+        Return the `z3c.dav.properties.PropertyPlan' used to render the
+        properties of all the resources in this request.
+        """
+        plan = self._plan
+        if plan is None or plan.request is not req or \
+               plan.include is not include:
+            plan = self._plan = z3c.dav.properties.PropertyPlan(req, include)
+        return plan
+
+    def getPolicy(self):
+        return zope.component.queryUtility(
+            z3c.dav.interfaces.IPropfindPolicy, default = defaultPolicy)
+
     def PROPFIND(self):
         if int(self.request.getHeader("content-length", 0)) > 0 and \
                self.request.content_type not in ("text/xml", "application/xml"):
@@ -76,6 +251,13 @@ class PROPFIND(object):
             raise z3c.dav.interfaces.BadRequest(
                 self.request, message = u"Invalid Depth header supplied")
 
+        policy = self.getPolicy()
+        if depth == "infinity" and not policy.depthInfinity:
+            raise z3c.dav.interfaces.PropfindFiniteDepth(
+                self.context,
+                message = u"PROPFIND requests with a Depth of infinity are "
+                           "not supported.")
+
         propertiesFactory = None
         extraArg = None
 
@@ -106,70 +288,453 @@ class PROPFIND(object):
         else:
             propertiesFactory = self.renderAllProperties
 
-        multistatus = z3c.dav.utils.MultiStatus()
+        self.minimal = z3c.dav.utils.preferMinimal(self.request)
+
+        cache = zope.component.queryUtility(
+            z3c.dav.interfaces.IPropfindCache)
+        if cache is not None:
+            self._cacheKey = self.getCacheKey(
+                self.request, cache, propertiesFactory, extraArg)
+            if self._cacheKey is not None:
+                self._cache = cache
+                self._uncached = frozenset(self.getUncachedTags(
+                    self.request, cache, propertiesFactory, extraArg))
+
+        # Render each response has we go so that we never hold the complete
+        # multistatus XML element in memory.
+        multistatus = z3c.dav.utils.StreamingMultiStatus()
         responses = self.handlePropfindResource(
             self.context, self.request, depth, propertiesFactory, extraArg)
-        multistatus.responses.extend(responses)
+
+        # Depth infinity requests are limited by the policy.
+        maxResources = deadline = None
+        if depth == "infinity":
+            maxResources = policy.maxResources
+            if policy.timeLimit is not None:
+                deadline = time.time() + policy.timeLimit
+
+        # The requested resource is always rendered.
+        count = 0
+        for response in responses:
+            if count and \
+                   ((maxResources is not None and count >= maxResources) or
+                    (deadline is not None and time.time() > deadline)):
+                self.handleLimitExceeded(multistatus, policy)
+                break
+            multistatus.append(response)
+            count += 1
+
+        result = multistatus.getResult()
+
+        if self.prefetched:
+            logger.debug("PROPFIND %s: prefetched %d objects",
+                         self.request.getURL(), self.prefetched)
+        self.logErrors(policy)
 
         self.request.response.setStatus(207)
         self.request.response.setHeader("content-type", "application/xml")
-        ## Is UTF-8 encoding ok here or is there a better way of doing this.
-        return ElementTree.tostring(multistatus(), encoding = "utf-8")
+        if propertiesFactory == self.renderSelectedProperties:
+            # The 404 propstats depend on the Prefer header.
+            z3c.dav.utils.addVary(self.request.response, "Prefer")
+        if self.minimal:
+            self.request.response.setHeader(
+                "preference-applied", "return=minimal")
+        result = z3c.dav.compression.compress(self.request, result)
+        if isinstance(result, z3c.dav.utils.SpooledResult):
+            # The publisher doesn't know the length of iterable results.
+            self.request.response.setHeader("content-length", str(len(result)))
+        return result
+
+    def handleLimitExceeded(self, multistatus, policy):
+        """
+        Called when a Depth infinity PROPFIND request exceeds the limits of
+        the policy. Either fail the request with the
+        `DAV:propfind-finite-depth' precondition or finish the truncated
+        multistatus response with a 507 (Insufficient Storage) response on
+        the requested resource, see section 9.1 of RFC 4918.
+        """
+        if not policy.truncate:
+            raise z3c.dav.interfaces.PropfindFiniteDepth(
+                self.context,
+                message = u"PROPFIND request exceeded the limits on the "
+                           "number of resources or time.")
+
+        response = z3c.dav.utils.Response(
+            z3c.dav.utils.getObjectURL(self.context, self.request))
+        response.status = 507
+        response.error.append(
+            z3c.dav.utils.makedavelement("number-of-matches-within-limits"))
+        response.responsedescription = u"The response was truncated " \
+                                        "because it exceeded the limits " \
+                                        "for Depth infinity requests."
+        multistatus.append(response)
 
     def handlePropfindResource(self, ob, req, depth, \
                                propertiesFactory, extraArg,
                                level = 0):
         """
-        Recursive method that collects all the `response' XML elements for
-        the current PROPFIND request.
+        Generator that yields all the `response' XML elements for the
+        current PROPFIND request, one resource at a time.
 
         `propertiesFactory' is the method that is used to generated the
         `response' XML element for one resource. It takes the resource,
         request and `extraArg' used to pass in specific information about
-        the properties we want to return.
-        """
-        responses = [propertiesFactory(ob, req, extraArg, level)]
-        if depth in ("1", "infinity"):
-            subdepth = (depth == "1") and "0" or "infinity"
-
-            readdir = IReadDirectory(ob, None)
-            if readdir is not None:
-                try:
-                    # We catch any Forbidden or Unauthorized exceptions here.
-                    # We have successfully rendered the property on this
-                    # resource and we are as such trying to render a listing
-                    # of the container object. If we do get an Unauthorized
-                    # exception then we only raise this if level == 0.
-                    # Otherwise the user might never have access to the resource
-                    # and they will never get to see the resources that they
-                    # are interested in.
-                    values = readdir.values()
-                except zope.security.interfaces.Forbidden:
-                    # Since we successfully rendered the properties and the
-                    # user is forbidden to access the folder listing then
-                    # we silently ignore this exception. Allowing them to
-                    # continue with there usage of the system.
-                    errUtility = zope.component.getUtility(
-                        IErrorReportingUtility)
-                    errUtility.raising(sys.exc_info(), req)
-                except zope.security.interfaces.Unauthorized:
-                    # Sometimes even the administrator will raise an
-                    # `Unauthorized' exception on the `values' method. If this
-                    # happens on a sub-resource to the requested resource then
-                    # we log the exception and continue - others this request
-                    # fails with the `Unauthorized' exception.
-                    if level == 0:
-                        raise
-                    errUtility = zope.component.getUtility(
-                        IErrorReportingUtility)
-                    errUtility.raising(sys.exc_info(), req)
+        the properties we want to return. The `href' of the members of a
+        collection is built from the URL of the collection, see
+        `z3c.dav.utils.getChildURL'.
+
+        The resources are visited in the same order has a recursive walk of
+        the tree but we keep an explicit stack of the folder listings we
+        are iterating over, so the depth of the tree is not limited by the
+        recursion limit of Python.
+        """
+        response = self.renderResource(
+            ob, req, propertiesFactory, extraArg, level)
+        yield response
+        if depth not in ("1", "infinity"):
+            return
+
+        subdepth = (depth == "1") and "0" or "infinity"
+
+        # Each entry in the stack is the listing of a collection, the
+        # collection, its URL from which we build the URLs of its members and
+        # the property values supplied for its members by an
+        # IBulkPropertyProvider.
+        annotations = self.prefetchAnnotations(req, propertiesFactory,
+                                               extraArg)
+
+        stack = []
+        values = self.listCollection(ob, req, level)
+        if values is not None:
+            values = self.prefetchMembers(values, annotations)
+            stack.append((values, ob, response.href[0],
+                          self.getBulkPropertyValues(
+                              ob, req, propertiesFactory, extraArg)))
+
+        while stack:
+            values, parent, parenturl, bulkvalues = stack[-1]
+            try:
+                subob = values.next()
+            except StopIteration:
+                stack.pop()
+                continue
+
+            sublevel = level + len(stack)
+            href = z3c.dav.utils.getChildURL(subob, req, parent, parenturl)
+            if bulkvalues:
+                propvalues = bulkvalues.get(
+                    getattr(subob, "__name__", None), None)
+            else:
+                propvalues = None
+            yield self.renderResource(subob, req, propertiesFactory,
+                                      extraArg, sublevel, href = href,
+                                      values = propvalues)
+
+            if subdepth == "infinity":
+                values = self.listCollection(subob, req, sublevel)
+                if values is not None:
+                    values = self.prefetchMembers(values, annotations)
+                    stack.append((values, subob, href,
+                                  self.getBulkPropertyValues(
+                                      subob, req, propertiesFactory,
+                                      extraArg)))
+
+    def prefetchAnnotations(self, req, propertiesFactory, extraArg):
+        """
+        Return True if rendering the requested properties will load the
+        annotations of the resources. This is the case for dead properties
+        and the properties stored by zope.dublincore.
+        """
+        if propertiesFactory != self.renderSelectedProperties:
+            # all the dead properties are listed
+            return True
+
+        plan = self.getPropertyPlan(req)
+        for prop in extraArg:
+            if prop.tag in self.annotatedProperties or \
+                   not plan.isLiveProperty(prop.tag):
+                return True
+
+        return False
+
+    def prefetchMembers(self, values, annotations = False):
+        """
+        Generator over the members of a collection that loads the state of
+        the members, in batches of `prefetchSize', with one call to the
+        `prefetch' method of their ZODB connection. With `annotations' the
+        attribute annotations of the members are also prefetched. We only
+        read their oids, the values of the annotations aren't prefetched
+        as listing them would load the annotations, and any buckets they
+        are spread over, one at a time.
+
+        The number of objects prefetched, and thus not loaded one at a time,
+        is counted in `prefetched'. Objects are only counted when their
+        storage supports prefetching.
+        """
+        values = iter(values)
+        while True:
+            batch = list(itertools.islice(values, self.prefetchSize))
+            if not batch:
+                break
+
+            # we only read the persistence attributes of the members.
+            obs = [removeSecurityProxy(ob) for ob in batch]
+            self.prefetched += _prefetch(obs)
+            if annotations:
+                obs = [getattr(ob, "__annotations__", None) for ob in obs]
+                self.prefetched += _prefetch(
+                    [ob for ob in obs if ob is not None])
+
+            for ob in batch:
+                yield ob
+
+    def renderResource(self, ob, req, propertiesFactory, extraArg, level,
+                       href = None, values = None):
+        """
+        Return the `response' XML element for `ob', generated by
+        `propertiesFactory' or from the IPropfindCache utility.
+
+        The properties that are never cached, see `getUncachedTags', are
+        left out of the cached response and rendered again every time.
+        """
+        cache = self._cache
+        if cache is None:
+            return self.callPropertiesFactory(
+                propertiesFactory, ob, req, extraArg, level, href, values)
+
+        if href is None:
+            href = z3c.dav.utils.getObjectURL(ob, req)
+        key = (href,) + self._cacheKey
+
+        cached = cache.get(ob, key)
+        if cached is None:
+            errors = self.errors
+            response = self.callPropertiesFactory(
+                propertiesFactory, ob, req, extraArg, level, href, values)
+            cached, uncached = self.splitResponse(response)
+            if errors == self.errors:
+                # don't keep responses containing unexpected errors
+                cache.set(ob, key, cached)
+        elif self._uncached:
+            uncached = self.renderUncachedProperties(
+                ob, req, propertiesFactory, extraArg, level, href, values)
+        else:
+            uncached = None
+
+        response = z3c.dav.utils.Response(href)
+        _extendResponse(response, cached)
+        if uncached is not None:
+            _extendResponse(response, uncached)
+        return response
+
+    def callPropertiesFactory(self, propertiesFactory, ob, req, extraArg,
+                              level, href = None, values = None):
+        """
+        Call `propertiesFactory', passing the `href' and `values' keyword
+        arguments only when they are set and the factory accepts them, so
+        that subclasses overriding the render methods with the signature
+        they had before 1.0b3 keep working.
+        """
+        kw = {}
+        if href is not None or values is not None:
+            try:
+                keywords = self._factoryKeywords[propertiesFactory]
+            except KeyError:
+                keywords = self._factoryKeywords[propertiesFactory] = \
+                           _getKeywords(propertiesFactory)
+            if href is not None and "href" in keywords:
+                kw["href"] = href
+            if values is not None and "values" in keywords:
+                kw["values"] = values
+        return propertiesFactory(ob, req, extraArg, level, **kw)
+
+    def splitResponse(self, response):
+        """
+        Split the rendered `response' of a resource into the response that
+        is cached, whose properties are serialized once and for all, and a
+        response with the properties that are never cached.
+        """
+        cached = z3c.dav.utils.Response(response.href[0])
+        uncached = z3c.dav.utils.Response(response.href[0])
+        for status, propstat in response.getPropstats():
+            properties = []
+            for prop in propstat.properties:
+                if _getTag(prop) in self._uncached:
+                    uncached.addProperty(status, prop)
                 else:
-                    for subob in values:
-                        responses.extend(self.handlePropfindResource(
-                            subob, req, subdepth,
-                            propertiesFactory, extraArg, level + 1))
+                    properties.append(_getFragment(prop))
+
+            if properties or not propstat.properties or propstat.error or \
+                   propstat.responsedescription:
+                # Only keep the propstats of the uncached properties in the
+                # uncached response. But a minimal response can contain an
+                # empty propstat.
+                cachedpropstat = cached.getPropstat(status)
+                cachedpropstat.properties.extend(properties)
+                cachedpropstat.error.extend(propstat.error)
+                cachedpropstat.responsedescription = \
+                    propstat.responsedescription
+
+        cached.error.extend(response.error)
+        cached.responsedescription = response.responsedescription
+        return cached, uncached
+
+    def renderUncachedProperties(self, ob, req, propertiesFactory, extraArg,
+                                 level, href, values):
+        """
+        Return a `response' XML element with only the requested properties
+        of `ob' that are never cached.
+        """
+        if propertiesFactory == self.renderSelectedProperties:
+            props = [prop for prop in extraArg if prop.tag in self._uncached]
+            return self.callPropertiesFactory(
+                propertiesFactory, ob, req, props, level, href, values)
+
+        response = z3c.dav.utils.Response(href)
+        plan = self.getPropertyPlan(req, extraArg)
+        for tag in plan.names:
+            if tag not in self._uncached:
+                continue
+            try:
+                davprop, adapter = plan.getProperty(ob, tag, values = values)
+            except z3c.dav.interfaces.PropertyNotFound:
+                # not defined for ob, so allprop leaves it out.
+                continue
+            self.renderAllprop(davprop, adapter, plan, req, response)
+
+        return response
+
+    def getCacheKey(self, req, cache, propertiesFactory, extraArg):
+        """
+        Return the part of the key under which the `response' XML elements
+        are cached that identifies the request, or None if the requested
+        properties can't be cached.
+        """
+        tags = self.getRequestedTags(req, propertiesFactory, extraArg)
+        if tags and not [tag for tag in tags if tag not in cache.uncacheable]:
+            # nothing is left to cache
+            return None
+
+        if extraArg is not None:
+            extra = tuple([el.tag for el in extraArg])
+        else:
+            extra = ()
+
+        # The groups of the principal identify the grants, other than the
+        # ones of the principal itself, that apply to it.
+        principal = getattr(req, "principal", None)
+        groups = tuple(sorted(getattr(principal, "groups", None) or ()))
+        return (propertiesFactory.__name__, extra,
+                getattr(principal, "id", None), groups, self.minimal)
+
+    def getUncachedTags(self, req, cache, propertiesFactory, extraArg):
+        """
+        Return the tags of the requested properties that are rendered
+        for every request, see `IPropfindCache.uncacheable'.
+        """
+        tags = self.getRequestedTags(req, propertiesFactory, extraArg)
+        if tags is None:
+            return []
+        return [tag for tag in tags if tag in cache.uncacheable]
+
+    def getRequestedTags(self, req, propertiesFactory, extraArg):
+        """
+        Return the tags of the properties whose values will be rendered, or
+        None if we only render the names of properties.
+        """
+        if propertiesFactory == self.renderSelectedProperties:
+            return [prop.tag for prop in extraArg]
+        elif propertiesFactory == self.renderAllProperties:
+            return self.getPropertyPlan(req, extraArg).names
+
+        return None
+
+    def getBulkPropertyValues(self, ob, req, propertiesFactory, extraArg):
+        """
+        Return the values of the properties we are going to render for
+        the members of the collection `ob', as supplied by the
+        IBulkPropertyProvider for `ob', or None.
+        """
+        tags = self.getRequestedTags(req, propertiesFactory, extraArg)
+        if tags is None:
+            # property names only, no values to render
+            return None
+
+        provider = zope.component.queryMultiAdapter(
+            (ob, req), z3c.dav.interfaces.IBulkPropertyProvider)
+        if provider is None:
+            return None
+
+        return provider.getPropertyValues(tags)
+
+    def listCollection(self, ob, req, level):
+        """
+        Return the members of the collection `ob', or None if `ob' isn't a
+        collection or we silently ignored a security problem listing it.
+        """
+        readdir = IReadDirectory(ob, None)
+        if readdir is None:
+            return None
+
+        try:
+            # We catch any Forbidden or Unauthorized exceptions here.
+            # We have successfully rendered the property on this
+            # resource and we are as such trying to render a listing
+            # of the container object. If we do get an Unauthorized
+            # exception then we only raise this if level == 0.
+            # Otherwise the user might never have access to the resource
+            # and they will never get to see the resources that they
+            # are interested in.
+            return readdir.values()
+        except zope.security.interfaces.Forbidden:
+            # Since we successfully rendered the properties and the
+            # user is forbidden to access the folder listing then
+            # we silently ignore this exception. Allowing them to
+            # continue with there usage of the system.
+            self.reportError(sys.exc_info(), req)
+        except zope.security.interfaces.Unauthorized:
+            # Sometimes even the administrator will raise an
+            # `Unauthorized' exception on the `values' method. If this
+            # happens on a sub-resource to the requested resource then
+            # we log the exception and continue - others this request
+            # fails with the `Unauthorized' exception.
+            if level == 0:
+                raise
+            self.reportError(sys.exc_info(), req)
+
+        return None
+
+    def reportError(self, exc_info, request, proptag = None):
+        """
+        Report an error that occurred while rendering the property `proptag'
+        of a resource, or listing a collection.
+
+        The same property usually fails in the same way on all the resources
+        in a collection, so only the first `errorSamples' errors of each
+        type for each property are logged with the IErrorReportingUtility.
+        The rest are only counted, see `logErrors'.
+        """
+        key = (proptag, exc_info[0])
+        count = self._errorCounts.get(key, 0) + 1
+        self._errorCounts[key] = count
 
-        return responses
+        if count <= self.getPolicy().errorSamples:
+            errUtility = zope.component.getUtility(IErrorReportingUtility)
+            errUtility.raising(exc_info, request)
+
+    def logErrors(self, policy):
+        """
+        Log a summary of each type of error reported for each property while
+        rendering this request.
+        """
+        errors = [(proptag or "", exctype.__name__, count)
+                  for (proptag, exctype), count in self._errorCounts.items()]
+        errors.sort()
+        for proptag, excname, count in errors:
+            logger.info("PROPFIND %s: %s raised %d times rendering %s, "
+                        "%d reported", self.request.getURL(),
+                        excname, count, proptag or "collection listings",
+                        min(count, policy.errorSamples))
 
     def handleException(self, proptag, exc_info, request, response):
         error_view = zope.component.queryMultiAdapter(
@@ -177,6 +742,7 @@ class PROPFIND(object):
         if error_view is None:
             # An unexpected error occured here and should be fixed.
             propstat = response.getPropstat(500) # Internal Server Error
+            self.errors += 1
         else:
             propstat = response.getPropstat(error_view.status)
             # XXX - needs testing
@@ -185,31 +751,30 @@ class PROPFIND(object):
 
         # In order to easily debug the problem we will log the error with
         # the ErrorReportingUtility.
-        errUtility = zope.component.getUtility(IErrorReportingUtility)
-        errUtility.raising(exc_info, request)
+        self.reportError(exc_info, request, proptag)
 
         propstat.properties.append(ElementTree.Element(proptag))
 
-    def renderPropnames(self, ob, req, ignoreExtraArg, ignorelevel = 0):
+    def renderPropnames(self, ob, req, ignoreExtraArg, ignorelevel = 0,
+                        href = None, values = None):
         """
         See doc string for the renderAllProperties method. Note that we don't
         need to worry about the security in this method has the permissions on
         the storage adapters should be enough to hide any properties that users
         don't have permission to see.
         """
-        response = z3c.dav.utils.Response(
-            z3c.dav.utils.getObjectURL(ob, req))
+        if href is None:
+            href = z3c.dav.utils.getObjectURL(ob, req)
+        response = z3c.dav.utils.Response(href)
 
-        for davprop, adapter in \
-                z3c.dav.properties.getAllProperties(ob, req):
-            rendered_name = ElementTree.Element(
-                ElementTree.QName(davprop.namespace, davprop.__name__)
-                )
-            response.addProperty(200, rendered_name)
+        plan = self.getPropertyPlan(req)
+        for tag in plan.getAllPropertyNames(ob):
+            response.addProperty(200, ElementTree.Element(tag))
 
         return response
 
-    def renderAllProperties(self, ob, req, include, level = 0):
+    def renderAllProperties(self, ob, req, include, level = 0,
+                            href = None, values = None):
         """
         The specification says:
         
@@ -219,53 +784,62 @@ class PROPFIND(object):
           MAY be silently excluded from the response.
 
         """
-        response = z3c.dav.utils.Response(
-            z3c.dav.utils.getObjectURL(ob, req))
-
-        for davprop, adapter in \
-                z3c.dav.properties.getAllProperties(ob, req):
-            isIncluded = False
-            if include is not None and \
-                   include.find("{%s}%s" %(davprop.namespace,
-                                           davprop.__name__)) is not None:
-                isIncluded = True
-            elif davprop.restricted:
-                continue
+        if href is None:
+            href = z3c.dav.utils.getObjectURL(ob, req)
+        response = z3c.dav.utils.Response(href)
 
-            try:
-                # getWidget and render are two possible areas where the
-                # property is silently ignored because of security concerns.
-                davwidget = z3c.dav.properties.getWidget(
-                    davprop, adapter, req)
-                response.addProperty(200, davwidget.render())
-            except zope.security.interfaces.Unauthorized:
-                # Users don't have the permission to view this property and
-                # if they didn't explicitly ask for the named property
-                # we can silently ignore this property, pretending that it
-                # is a restricted property.
-                if isIncluded:
-                    self.handleException(
-                        "{%s}%s" %(davprop.namespace, davprop.__name__),
-                        sys.exc_info(), req, response)
-                else:
-                    # Considering that we just silently ignored this property
-                    # - log this exception with the error reporting utility
-                    # just in case this is a problem that needs sorting out.
-                    errUtility = zope.component.getUtility(
-                        IErrorReportingUtility)
-                    errUtility.raising(sys.exc_info(), req)
-            except:
-                self.handleException(
-                    "{%s}%s" %(davprop.namespace, davprop.__name__),
-                    sys.exc_info(), req,
-                    response)
+        plan = self.getPropertyPlan(req, include)
+        for davprop, adapter in plan.getAllProperties(ob, values):
+            self.renderAllprop(davprop, adapter, plan, req, response)
 
         return response
 
-    def renderSelectedProperties(self, ob, req, props, level = 0):
-        response = z3c.dav.utils.Response(
-            z3c.dav.utils.getObjectURL(ob, req))
-
+    def renderAllprop(self, davprop, adapter, plan, req, response):
+        """
+        Add the property `davprop' to `response' the way the
+        renderAllProperties method does.
+        """
+        isIncluded = False
+        if "{%s}%s" %(davprop.namespace, davprop.__name__) in plan.included:
+            isIncluded = True
+        elif davprop.restricted:
+            return
+
+        try:
+            # getWidget and render are two possible areas where the
+            # property is silently ignored because of security concerns.
+            davwidget = plan.getWidget(davprop, adapter)
+            response.addProperty(
+                200, z3c.dav.properties.renderProperty(davwidget))
+        except zope.security.interfaces.Unauthorized:
+            # Users don't have the permission to view this property and
+            # if they didn't explicitly ask for the named property
+            # we can silently ignore this property, pretending that it
+            # is a restricted property.
+            if isIncluded:
+                self.handleException(
+                    "{%s}%s" %(davprop.namespace, davprop.__name__),
+                    sys.exc_info(), req, response)
+            else:
+                # Considering that we just silently ignored this property
+                # - log this exception with the error reporting utility
+                # just in case this is a problem that needs sorting out.
+                self.reportError(
+                    sys.exc_info(), req,
+                    "{%s}%s" %(davprop.namespace, davprop.__name__))
+        except:
+            self.handleException(
+                "{%s}%s" %(davprop.namespace, davprop.__name__),
+                sys.exc_info(), req,
+                response)
+
+    def renderSelectedProperties(self, ob, req, props, level = 0,
+                                 href = None, values = None):
+        if href is None:
+            href = z3c.dav.utils.getObjectURL(ob, req)
+        response = z3c.dav.utils.Response(href)
+
+        plan = self.getPropertyPlan(req)
         for prop in props:
             if z3c.dav.utils.parseEtreeTag(prop.tag)[0] == "":
                 # XXX - A namespace which is None corresponds to when no
@@ -275,12 +849,12 @@ class PROPFIND(object):
                     u"PROPFIND with invalid namespace declaration in body")
 
             try:
-                davprop, adapter = z3c.dav.properties.getProperty(
-                    ob, req, prop.tag, exists = True)
-                davwidget = z3c.dav.properties.getWidget(
-                    davprop, adapter, req)
+                davprop, adapter = plan.getProperty(
+                    ob, prop.tag, exists = True, values = values)
+                davwidget = plan.getWidget(davprop, adapter)
                 propstat = response.getPropstat(200)
-                propstat.properties.append(davwidget.render())
+                propstat.properties.append(
+                    z3c.dav.properties.renderProperty(davwidget))
             except zope.security.interfaces.Unauthorized:
                 if level == 0:
                     # When we are rendering properties on the requested
@@ -293,4 +867,11 @@ class PROPFIND(object):
             except:
                 self.handleException(prop.tag, sys.exc_info(), req, response)
 
+        if self.minimal:
+            notfound = response.getPropstat(404)
+            response.removePropstat(404)
+            if len(notfound.properties) == len(props):
+                # a response needs at least one propstat element.
+                response.getPropstat(200)
+
         return response
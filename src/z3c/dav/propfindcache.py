@@ -0,0 +1,330 @@
+##############################################################################
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+##############################################################################
+"""Cache of the `response' XML elements rendered by PROPFIND requests.
+
+Clients that synchronize a folder repeatedly request the same properties of
+the same resources, which rarely change. With a `IPropfindCache' utility
+registered the `response' element of a resource is only rendered again
+once the resource is modified.
+
+Only persistent objects are cached. A response is stored under the serial
+number of the committed state of the object, so it is no longer used once
+a transaction modifying the object itself is committed. The data kept
+outside of the object's own record, like the dead and Dublin Core
+properties stored in its annotations, is covered by the
+`IObjectModifiedEvent' and `IObjectMovedEvent' subscribers, which forget
+the responses of the object when the event is fired and again once the
+transaction is committed. Changes made without firing these events, or in
+another process, to data outside of the object's record aren't noticed.
+Neither are changes to the grants of a principal, so the cache should be
+sized so that the responses are reused by a client synchronizing a folder
+but don't outlive them for long.
+"""
+__docformat__ = 'restructuredtext'
+
+import threading
+from collections import OrderedDict
+
+import transaction
+import zope.component
+import zope.interface
+import zope.lifecycleevent.interfaces
+import zope.location.interfaces
+from zope.schema.fieldproperty import FieldProperty
+from zope.security.proxy import removeSecurityProxy
+
+import z3c.dav.interfaces
+
+def _getToken(ob):
+    # Return the token identifing `ob' and the stamp of its current state.
+    # The token is None if `ob' isn't persistent, and the stamp is None if
+    # `ob' has uncommitted changes.
+    ob = removeSecurityProxy(ob)
+    oid = getattr(ob, "_p_oid", None)
+    if oid is None or ob._p_jar is None:
+        return None, None
+
+    if ob._p_changed is None:
+        # the serial number of a ghost isn't loaded.
+        ob._p_activate()
+    if ob._p_changed:
+        return oid, None
+
+    return oid, ob._p_serial
+
+
+class PropfindCache(object):
+    """
+    Bounded LRU cache of rendered `response' XML elements.
+
+      >>> from zope.interface.verify import verifyObject
+      >>> cache = PropfindCache(size = 2)
+      >>> verifyObject(z3c.dav.interfaces.IPropfindCache, cache)
+      True
+
+    Only the responses of persistent objects stored in a database are
+    cached.
+
+      >>> import transaction, ZODB
+      >>> from persistent.mapping import PersistentMapping
+      >>> from BTrees.OOBTree import OOBTree
+      >>> db = ZODB.DB(None)
+      >>> conn = db.open()
+      >>> root = conn.root()
+      >>> for name in ('r1', 'r2', 'r3'):
+      ...     root[name] = PersistentMapping()
+      ...     root[name].__annotations__ = OOBTree()
+      >>> transaction.commit()
+      >>> r1, r2, r3 = root['r1'], root['r2'], root['r3']
+
+      >>> cache.get(r1, ('/r1', 'allprop')) is None
+      True
+      >>> cache.set(r1, ('/r1', 'allprop'), '<response>r1</response>')
+      >>> cache.get(r1, ('/r1', 'allprop'))
+      '<response>r1</response>'
+      >>> cache.hits, cache.misses
+      (1, 1)
+
+      >>> notstored = PersistentMapping()
+      >>> cache.set(notstored, ('/new', 'allprop'), '<response />')
+      >>> cache.get(notstored, ('/new', 'allprop')) is None
+      True
+      >>> cache.set(object(), ('/ob', 'allprop'), '<response />')
+      >>> len(cache), cache.misses
+      (1, 1)
+
+    The least recently used responses are discarded first.
+
+      >>> cache.set(r2, ('/r2', 'allprop'), '<response>r2</response>')
+      >>> cache.get(r1, ('/r1', 'allprop'))
+      '<response>r1</response>'
+      >>> cache.set(r3, ('/r3', 'allprop'), '<response>r3</response>')
+      >>> cache.get(r2, ('/r2', 'allprop')) is None
+      True
+      >>> cache.get(r1, ('/r1', 'allprop'))
+      '<response>r1</response>'
+      >>> len(cache)
+      2
+
+    All the responses of a resource are forgotten when it is invalidated.
+
+      >>> cache.set(r1, ('/r1', 'propname'), '<response>names</response>')
+      >>> cache.invalidate(r1)
+      >>> cache.get(r1, ('/r1', 'allprop')) is None
+      True
+      >>> cache.get(r1, ('/r1', 'propname')) is None
+      True
+      >>> len(cache)
+      0
+
+    A response is only returned for the same committed state of the object.
+    Objects with uncommitted changes aren't cached.
+
+      >>> cache.set(r1, ('/r1', 'allprop'), '<response>r1</response>')
+      >>> r1['title'] = u'modified'
+      >>> cache.get(r1, ('/r1', 'allprop')) is None
+      True
+      >>> cache.set(r1, ('/r1', 'allprop'), '<response>modified</response>')
+      >>> cache.get(r1, ('/r1', 'allprop')) is None
+      True
+      >>> transaction.commit()
+      >>> cache.get(r1, ('/r1', 'allprop')) is None
+      True
+      >>> cache.set(r1, ('/r1', 'allprop'), '<response>modified</response>')
+      >>> cache.get(r1, ('/r1', 'allprop'))
+      '<response>modified</response>'
+
+    Only the object's own record is looked at, the modification of its
+    annotations is signaled by an event, see `invalidateModified'. So
+    ghosts are loaded, but nothing else is.
+
+      >>> cache.set(r2, ('/r2', 'allprop'), '<response>r2</response>')
+      >>> conn.cacheMinimize()
+      >>> cache.get(r2, ('/r2', 'allprop'))
+      '<response>r2</response>'
+      >>> r2._p_changed, r2.__annotations__._p_changed
+      (False, None)
+
+      >>> conn.close()
+      >>> db.close()
+
+    """
+    zope.interface.implements(z3c.dav.interfaces.IPropfindCache)
+
+    size = FieldProperty(z3c.dav.interfaces.IPropfindCache["size"])
+
+    uncacheable = frozenset(["{DAV:}lockdiscovery"])
+
+    def __init__(self, size = 1000):
+        self.size = size
+        self.hits = self.misses = 0
+
+        self._lock = threading.Lock()
+        self._data = OrderedDict() # (token, stamp, key) -> data
+        self._keys = {} # token -> set of (token, stamp, key)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, ob, key):
+        token, stamp = _getToken(ob)
+        if stamp is None:
+            return None
+        key = (token, stamp, key)
+
+        self._lock.acquire()
+        try:
+            data = self._data.pop(key, None)
+            if data is None:
+                self.misses += 1
+                return None
+            self._data[key] = data
+            self.hits += 1
+            return data
+        finally:
+            self._lock.release()
+
+    def set(self, ob, key, data):
+        token, stamp = _getToken(ob)
+        if stamp is None:
+            return
+        key = (token, stamp, key)
+
+        self._lock.acquire()
+        try:
+            self._data.pop(key, None)
+            self._data[key] = data
+            self._keys.setdefault(token, set()).add(key)
+
+            while len(self._data) > self.size:
+                oldkey, ignore = self._data.popitem(last = False)
+                keys = self._keys[oldkey[0]]
+                keys.discard(oldkey)
+                if not keys:
+                    del self._keys[oldkey[0]]
+        finally:
+            self._lock.release()
+
+    def invalidate(self, ob):
+        token = getattr(removeSecurityProxy(ob), "_p_oid", None)
+        if token is None:
+            return
+
+        self._lock.acquire()
+        try:
+            for key in self._keys.pop(token, ()):
+                self._data.pop(key, None)
+        finally:
+            self._lock.release()
+
+
+def _invalidated(status, cache, ob):
+    # After commit hook, see _invalidate.
+    if status:
+        cache.invalidate(ob)
+
+
+def _invalidate(ob):
+    # Forget the responses of `ob' now, and once the current transaction is
+    # committed.
+    cache = zope.component.queryUtility(z3c.dav.interfaces.IPropfindCache)
+    if cache is None:
+        return
+
+    cache.invalidate(ob)
+    jar = getattr(removeSecurityProxy(ob), "_p_jar", None)
+    manager = getattr(jar, "transaction_manager", None) or transaction.manager
+    manager.get().addAfterCommitHook(_invalidated, (cache, ob))
+
+
+@zope.component.adapter(zope.lifecycleevent.interfaces.IObjectModifiedEvent)
+def invalidateModified(event):
+    """
+    Forget the rendered responses of modified objects. The modification of
+    the annotations of an object, like its dead properties, doesn't change
+    its serial number so this event is the only way we know about it.
+
+      >>> import transaction, ZODB
+      >>> from persistent.mapping import PersistentMapping
+      >>> from zope.lifecycleevent import ObjectModifiedEvent
+      >>> db = ZODB.DB(None)
+      >>> conn = db.open()
+      >>> conn.root()['r'] = resource = PersistentMapping()
+      >>> transaction.commit()
+
+      >>> cache = PropfindCache()
+      >>> zope.component.getGlobalSiteManager().registerUtility(cache)
+      >>> cache.set(resource, ('/r', 'allprop'), '<response />')
+      >>> len(cache)
+      1
+
+      >>> invalidateModified(ObjectModifiedEvent(resource))
+      >>> len(cache)
+      0
+
+    Another request can render the resource from the state before the
+    modification until it is committed, so the responses are forgotten
+    again when the transaction commits.
+
+      >>> cache.set(resource, ('/r', 'allprop'), '<response>old</response>')
+      >>> len(cache)
+      1
+      >>> transaction.commit()
+      >>> len(cache)
+      0
+
+    Nothing happens if there is no cache.
+
+      >>> zope.component.getGlobalSiteManager().unregisterUtility(cache)
+      True
+      >>> invalidateModified(ObjectModifiedEvent(resource))
+
+      >>> conn.close()
+      >>> db.close()
+
+    """
+    _invalidate(event.object)
+
+
+@zope.component.adapter(zope.location.interfaces.ILocation,
+                        zope.lifecycleevent.interfaces.IObjectMovedEvent)
+def invalidateMoved(ob, event):
+    """
+    Forget the rendered responses of moved objects, including the objects
+    contained within them. This also handles objects that are added to, or
+    removed from, a container.
+
+      >>> import transaction, ZODB
+      >>> from persistent.mapping import PersistentMapping
+      >>> from zope.lifecycleevent import ObjectMovedEvent
+      >>> db = ZODB.DB(None)
+      >>> conn = db.open()
+      >>> conn.root()['r'] = resource = PersistentMapping()
+      >>> transaction.commit()
+
+      >>> cache = PropfindCache()
+      >>> zope.component.getGlobalSiteManager().registerUtility(cache)
+      >>> cache.set(resource, ('/r', 'allprop'), '<response />')
+
+      >>> invalidateMoved(resource,
+      ...     ObjectMovedEvent(resource, None, 'r', None, 's'))
+      >>> len(cache)
+      0
+
+      >>> zope.component.getGlobalSiteManager().unregisterUtility(cache)
+      True
+      >>> transaction.abort()
+      >>> conn.close()
+      >>> db.close()
+
+    """
+    _invalidate(ob)
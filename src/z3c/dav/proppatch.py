@@ -18,8 +18,6 @@
 """
 __docformat__ = 'restructuredtext'
 
-from xml.etree import ElementTree
-
 import zope.event
 import zope.interface
 import zope.component
@@ -27,9 +25,12 @@ import zope.lifecycleevent
 
 from zope.security.interfaces import Unauthorized
 
+import z3c.dav.compression
 import z3c.dav.utils
 import z3c.dav.interfaces
 import z3c.dav.properties
+import z3c.dav.widgets
+from z3c.dav.xmlengine import ElementTree
 
 class PROPPATCH(object):
     """PROPPATCH handler for all objects"""
@@ -54,14 +55,23 @@ class PROPPATCH(object):
                 message = u"PROPPATCH request body must be a "
                            "`propertyupdate' XML element.")
 
+        # Index the properties being set once, the input widgets read their
+        # values from this index.
+        z3c.dav.widgets.getProppatchIndex(self.request)
+
+        # The properties are updated in two phases. First every update is
+        # validated without modifying anything, and only if all of them are
+        # valid are the updates applied. So a failed PROPPATCH request
+        # doesn't write to the database, only to roll the writes back.
+
         # propErrors - list of (property tag, error). error is None if no
         #              error occurred in setting / removing the property.
         propErrors = []
         # properties - list of all the properties that we handled correctly.
         properties = []
-        # changedAttributes - list of IModificationDescription objects
-        #                     indicting what as changed during this request
-        changedAttributes = []
+        # changes - list of (property tag, change) for the updates that
+        #           validated and need to be applied.
+        changes = []
         for update in xmldata:
             if update.tag not in ("{DAV:}set", "{DAV:}remove"):
                 continue
@@ -82,9 +92,9 @@ class PROPPATCH(object):
 
                 try:
                     if update.tag == "{DAV:}set":
-                        changedAttributes.extend(self.handleSet(prop))
+                        change = self.validateSet(prop)
                     else: # update.tag == "{DAV:}remove"
-                        changedAttributes.extend(self.handleRemove(prop))
+                        change = self.validateRemove(prop)
                 except Unauthorized:
                     # If the use doesn't have the correct permission to modify
                     # a property then we need to re-raise the Unauthorized
@@ -94,6 +104,22 @@ class PROPPATCH(object):
                     propErrors.append((prop.tag, error))
                 else:
                     properties.append(prop.tag)
+                    if change is not None:
+                        changes.append((prop.tag, change))
+
+        # changedAttributes - list of IModificationDescription objects
+        #                     indicting what as changed during this request
+        changedAttributes = []
+        if not propErrors:
+            for proptag, change in changes:
+                try:
+                    changedAttributes.extend(change())
+                except Unauthorized:
+                    raise
+                except Exception, error:
+                    propErrors.append((proptag, error))
+                    properties.remove(proptag)
+                    break
 
         if propErrors:
             errors = z3c.dav.interfaces.WebDAVPropstatErrors(self.context)
@@ -112,6 +138,16 @@ class PROPPATCH(object):
                 zope.lifecycleevent.ObjectModifiedEvent(
                     self.context, *changedAttributes))
 
+        # The body depends on the Prefer header.
+        z3c.dav.utils.addVary(self.request.response, "Prefer")
+        if z3c.dav.utils.preferMinimal(self.request):
+            # All the properties were updated so the client doesn't need
+            # the multistatus response, see section 3.3 of RFC 8144.
+            self.request.response.setStatus(200)
+            self.request.response.setHeader(
+                "preference-applied", "return=minimal")
+            return ""
+
         url = z3c.dav.utils.getObjectURL(self.context, self.request)
         response = z3c.dav.utils.Response(url)
         propstat = response.getPropstat(200)
@@ -125,9 +161,21 @@ class PROPPATCH(object):
         self.request.response.setStatus(207)
         self.request.response.setHeader("content-type", "application/xml")
         ## Is UTF-8 encoding ok here or is there a better way of doing this.
-        return ElementTree.tostring(multistatus(), encoding = "utf-8")
-
-    def handleSet(self, prop):
+        return z3c.dav.compression.compress(
+            self.request,
+            multistatus.serialize())
+
+    def validateSet(self, prop):
+        """
+        Check that the property `prop` can be set to the value in the
+        request without modifying it. Return a callable that sets the
+        property and returns a list of the modification descriptions.
+
+        The updates are applied in the order of the request, so the callable
+        compares the value with the current one only once the previous
+        updates are applied. A set following a remove of the same property
+        then still sets it.
+        """
         davprop, adapter = z3c.dav.properties.getProperty(
             self.context, self.request, prop.tag)
 
@@ -144,15 +192,26 @@ class PROPPATCH(object):
         value = widget.getInputValue()
         field.validate(value)
 
-        if field.get(adapter) != value:
+        def change():
+            if field.get(adapter) == value:
+                return []
             field.set(adapter, value)
             return [
                 zope.lifecycleevent.Attributes(davprop.iface, davprop.__name__)]
-        return []
+        return change
 
-    def handleRemove(self, prop):
-        davprop = zope.component.queryUtility(
-            z3c.dav.interfaces.IDAVProperty, prop.tag, None)
+    def validateRemove(self, prop):
+        """
+        Check that the property `prop` can be removed without modifying it.
+        Return a callable that removes the property and returns a list of
+        the modification descriptions, or None if the resource has no dead
+        properties.
+
+        Like for `validateSet` the callable only checks that the property
+        exists once the previous updates are applied, so that removing a
+        property set earlier in the same request removes it.
+        """
+        davprop = z3c.dav.properties.getPropertyIndex().getProperty(prop.tag)
 
         if davprop is not None:
             raise z3c.dav.interfaces.ConflictError(
@@ -162,9 +221,25 @@ class PROPPATCH(object):
         deadproperties = z3c.dav.interfaces.IOpaquePropertyStorage(
             self.context, None)
 
-        if deadproperties is not None and deadproperties.hasProperty(prop.tag):
+        if deadproperties is None:
+            return None
+
+        def change():
+            if not deadproperties.hasProperty(prop.tag):
+                return []
             deadproperties.removeProperty(prop.tag)
             return [zope.lifecycleevent.Sequence(
                 z3c.dav.interfaces.IOpaquePropertyStorage, prop.tag)]
+        return change
 
-        return []
+    def handleSet(self, prop):
+        change = self.validateSet(prop)
+        if change is None:
+            return []
+        return change()
+
+    def handleRemove(self, prop):
+        change = self.validateRemove(prop)
+        if change is None:
+            return []
+        return change()
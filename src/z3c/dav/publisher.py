@@ -13,18 +13,55 @@
 """
 __docformat__ = 'restructuredtext'
 
-from xml.etree import ElementTree
-
 import zope.component
 from zope.interface import implements
+from zope.schema.fieldproperty import FieldProperty
 from zope.publisher.http import HTTPResponse, HTTPRequest
 from zope.app.publication.http import HTTPPublication
 from zope.app.publication.interfaces import IRequestPublicationFactory
 
 import z3c.conditionalviews
+import z3c.dav.xmlengine
 import interfaces
 
 
+class RequestLimits(object):
+    """
+    Limits placed on the XML bodies of requests.
+
+      >>> from zope.interface.verify import verifyObject
+      >>> limits = RequestLimits()
+      >>> verifyObject(interfaces.IRequestLimits, limits)
+      True
+      >>> limits.maxSize
+      10485760
+      >>> limits.maxElements
+      100000
+      >>> limits.maxDepth
+      100
+
+      >>> limits = RequestLimits(maxDepth = 0)
+      Traceback (most recent call last):
+      ...
+      TooSmall: (0, 1)
+
+    """
+    implements(interfaces.IRequestLimits)
+
+    maxSize = FieldProperty(interfaces.IRequestLimits["maxSize"])
+    maxElements = FieldProperty(interfaces.IRequestLimits["maxElements"])
+    maxDepth = FieldProperty(interfaces.IRequestLimits["maxDepth"])
+
+    def __init__(self, maxSize = 10 * 1024 * 1024, maxElements = 100000,
+                 maxDepth = 100):
+        self.maxSize = maxSize
+        self.maxElements = maxElements
+        self.maxDepth = maxDepth
+
+
+defaultLimits = RequestLimits()
+
+
 class WebDAVResponse(HTTPResponse):
     implements(interfaces.IWebDAVResponse)
 
@@ -42,11 +79,21 @@ class WebDAVRequest(z3c.conditionalviews.ConditionalHTTPRequest):
                  positional = None, outstream = None):
         super(WebDAVRequest, self).__init__(body_instream, environ)
 
-        self.xmlDataSource = None
-        self.content_type = None
+        self._xmlDataSource = None
+        self._content_type = None
+        # the declared content type of a XML body that hasn't been parsed
+        # yet, see `_parseBody'.
+        self._unparsed = False
+        self._declared_content_type = None
 
     def processInputs(self):
-        """See IPublisherRequest."""
+        """See IPublisherRequest.
+
+        The XML body isn't parsed until the `xmlDataSource' or
+        `content_type' attributes are first used, so requests that are
+        refused before they reach the view, i.e. on a failed precondition
+        or an authentication challenge, don't pay for the parsing.
+        """
         content_type = self.getHeader("content-type", None)
         content_type_params = None
         if content_type and ";" in content_type:
@@ -60,19 +107,62 @@ class WebDAVRequest(z3c.conditionalviews.ConditionalHTTPRequest):
 
         if content_type in ("text/xml", "application/xml", None, "") and \
                content_length > 0:
-            try:
-                self.xmlDataSource = \
-                                   ElementTree.parse(self.bodyStream).getroot()
-            except:
-                # There was an error parsing the body stream so this is a
-                # bad request if the content was declared as xml
-                if content_type is not None:
-                    raise interfaces.BadRequest(
-                        self, u"Invalid xml data passed")
-            else:
-                self.content_type = content_type or "application/xml"
+            limits = zope.component.queryUtility(
+                interfaces.IRequestLimits, default = defaultLimits)
+            if limits.maxSize is not None and content_length > limits.maxSize:
+                raise interfaces.RequestEntityTooLarge(
+                    self, u"Request body is too large")
+
+            self._unparsed = True
+            self._declared_content_type = content_type
+        else:
+            self._content_type = content_type
+
+    def _parseBody(self):
+        self._unparsed = False
+        content_type = self._declared_content_type
+
+        limits = zope.component.queryUtility(
+            interfaces.IRequestLimits, default = defaultLimits)
+        try:
+            self._xmlDataSource = z3c.dav.xmlengine.parse(
+                self.bodyStream,
+                maxSize = limits.maxSize,
+                maxElements = limits.maxElements,
+                maxDepth = limits.maxDepth)
+        except z3c.dav.xmlengine.BodyTooLarge:
+            raise interfaces.RequestEntityTooLarge(
+                self, u"Request body is too large")
+        except:
+            # There was an error parsing the body stream so this is a
+            # bad request if the content was declared as xml
+            if content_type is not None:
+                raise interfaces.BadRequest(
+                    self, u"Invalid xml data passed")
         else:
-            self.content_type = content_type
+            self._content_type = content_type or "application/xml"
+
+    def _getXMLDataSource(self):
+        if self._unparsed:
+            self._parseBody()
+        return self._xmlDataSource
+
+    def _setXMLDataSource(self, value):
+        self._unparsed = False
+        self._xmlDataSource = value
+
+    xmlDataSource = property(_getXMLDataSource, _setXMLDataSource)
+
+    def _getContentType(self):
+        if self._unparsed:
+            self._parseBody()
+        return self._content_type
+
+    def _setContentType(self, value):
+        self._unparsed = False
+        self._content_type = value
+
+    content_type = property(_getContentType, _setContentType)
 
     def _createResponse(self):
         """Create a specific WebDAV response object."""
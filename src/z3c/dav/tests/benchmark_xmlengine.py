@@ -0,0 +1,101 @@
+##############################################################################
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+##############################################################################
+"""Compare the XML engines supported by `z3c.dav.xmlengine`.
+
+Parses large PROPFIND and PROPPATCH request bodies, and renders a large
+multistatus response, with xml.etree.ElementTree and, if it is installed,
+lxml. Run it with:
+
+  python -m z3c.dav.tests.benchmark_xmlengine [number of properties]
+
+This isn't run as part of the test suite.
+"""
+
+import sys
+import time
+from cStringIO import StringIO
+
+def propfindBody(count):
+    props = "".join(["<E:prop%d />" % i for i in range(count)])
+    return """<?xml version="1.0" encoding="utf-8" ?>
+<D:propfind xmlns:D="DAV:" xmlns:E="http://example.com/ns">
+  <D:prop>%s</D:prop>
+</D:propfind>""" % props
+
+
+def proppatchBody(count):
+    props = "".join(["<E:prop%d><E:value lang='en'>Value %d &amp; more" \
+                     "</E:value></E:prop%d>" %(i, i, i) for i in range(count)])
+    return """<?xml version="1.0" encoding="utf-8" ?>
+<D:propertyupdate xmlns:D="DAV:" xmlns:E="http://example.com/ns">
+  <D:set><D:prop>%s</D:prop></D:set>
+</D:propertyupdate>""" % props
+
+
+def multistatus(etree, count):
+    # Render a multistatus with count responses of 10 properties each.
+    ms = etree.Element("{DAV:}multistatus")
+    for i in range(count):
+        response = etree.SubElement(ms, "{DAV:}response")
+        etree.SubElement(response, "{DAV:}href").text = "/folder/r%d" % i
+        propstat = etree.SubElement(response, "{DAV:}propstat")
+        prop = etree.SubElement(propstat, "{DAV:}prop")
+        for j in range(10):
+            etree.SubElement(
+                prop, "{http://example.com/ns}prop%d" % j).text = u"value"
+        etree.SubElement(propstat, "{DAV:}status").text = "HTTP/1.1 200 Ok"
+    return etree.tostring(ms, encoding = "utf-8")
+
+
+def timeit(func, *args):
+    best = None
+    for i in range(5):
+        start = time.time()
+        func(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def getEngines():
+    from xml.etree import ElementTree
+    engines = [("xml.etree", ElementTree)]
+    try:
+        from lxml import etree
+    except ImportError:
+        pass
+    else:
+        engines.append(("lxml", etree))
+    return engines
+
+
+def main(count = 5000):
+    bodies = (("PROPFIND", propfindBody(count)),
+              ("PROPPATCH", proppatchBody(count)))
+
+    print "%d properties / responses" % count
+    for name, etree in getEngines():
+        for method, body in bodies:
+            print "%-10s parse %-10s %8.2f ms (%d bytes)" %(
+                name, method,
+                timeit(lambda: etree.parse(StringIO(body)).getroot()) * 1000,
+                len(body))
+        print "%-10s render multistatus %8.2f ms" %(
+            name, timeit(multistatus, etree, count) * 1000)
+
+
+if __name__ == "__main__":
+    count = 5000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    main(count)
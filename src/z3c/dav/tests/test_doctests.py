@@ -20,10 +20,12 @@ import doctest
 
 from zope import component
 from zope import interface
+import zope.component.testing
 from zope.annotation.interfaces import IAttributeAnnotatable
 from zope.container.interfaces import IContained, IContainer
 
 import z3c.etree.testing
+import z3c.dav.xmlengine
 
 
 class IDemo(IContained):
@@ -57,7 +59,7 @@ class DemoFolder(UserDict.UserDict):
 
 
 def etreeSetup(test):
-    z3c.etree.testing.etreeSetup(test, key = "py25")
+    z3c.etree.testing.etreeSetup(test, key = z3c.dav.xmlengine.engine)
 
 
 def contentSetup(test):
@@ -100,6 +102,17 @@ def test_suite():
                              setUp = etreeSetup,
                              tearDown = z3c.etree.testing.etreeTearDown),
         doctest.DocTestSuite("z3c.dav.mkcol"),
+        doctest.DocTestSuite("z3c.dav.publisher"),
+        doctest.DocTestSuite("z3c.dav.propfind"),
+        doctest.DocTestSuite("z3c.dav.propfindcache"),
+        doctest.DocTestSuite("z3c.dav.compression"),
+        doctest.DocTestSuite("z3c.dav.xmlengine",
+                             checker = z3c.etree.testing.xmlOutputChecker,
+                             setUp = etreeSetup,
+                             tearDown = z3c.etree.testing.etreeTearDown),
+        doctest.DocTestSuite("z3c.dav.metaconfigure",
+                             setUp = zope.component.testing.setUp,
+                             tearDown = zope.component.testing.tearDown),
         doctest.DocTestSuite("z3c.dav.testing",
                              checker = z3c.etree.testing.xmlOutputChecker,
                              setUp = etreeSetup,
@@ -17,7 +17,6 @@
 import unittest
 import datetime
 from cStringIO import StringIO
-from xml.etree import ElementTree
 
 from zope import component
 from zope import schema
@@ -28,10 +27,13 @@ from zope.formlib.interfaces import ConversionError, MissingInputError
 from zope.datetime import tzinfo
 
 from z3c.dav import widgets
+from z3c.dav.publisher import WebDAVRequest
 from z3c.dav.interfaces import IDAVInputWidget
 import z3c.etree.testing
 
 from test_widgets import TestWebDAVRequest
+import z3c.dav.xmlengine
+from z3c.dav.xmlengine import ElementTree
 
 class _WebDAVWidgetTest(unittest.TestCase):
 
@@ -50,7 +52,7 @@ class _WebDAVWidgetTest(unittest.TestCase):
         z3c.etree.testing.etreeTearDown()
 
     def setUp(self):
-        z3c.etree.testing.etreeSetup(key = "py25")
+        z3c.etree.testing.etreeSetup(key = z3c.dav.xmlengine.engine)
 
     def setUpContent(self, desc = u'', title = u'Foo Title', element = None):
         ## setup the field first to stop some really weird errors
@@ -239,8 +241,53 @@ class DateWebDAVInputWidgetTest(DatetimeWebDAVInputWidgetTest):
     field_content = datetime.date(2006, 5, 24)
 
 
+class ProppatchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        z3c.etree.testing.etreeSetup(key = z3c.dav.xmlengine.engine)
+
+    def tearDown(self):
+        z3c.etree.testing.etreeTearDown()
+
+    def test_index(self):
+        body = """<D:propertyupdate xmlns:D="DAV:" xmlns:E="example:">
+  <D:set><D:prop><E:a>1</E:a><E:b>2</E:b></D:prop></D:set>
+  <D:remove><D:prop><E:c /></D:prop></D:remove>
+  <D:set><D:prop><E:a>3</E:a></D:prop></D:set>
+</D:propertyupdate>"""
+        request = WebDAVRequest(StringIO(body), {"CONTENT_TYPE": "text/xml",
+                                                 "CONTENT_LENGTH": len(body)})
+        request.processInputs()
+
+        index = widgets.getProppatchIndex(request)
+        self.assertEqual(index.keys(), ["{example:}a", "{example:}b"])
+        self.assertEqual(index["{example:}a"].text, "3")
+        self.assert_(widgets.getProppatchIndex(request) is index)
+
+        field = schema.Text(__name__ = "a")
+        widget = widgets.TextDAVInputWidget(field, request)
+        widget.namespace = "example:"
+        self.assertEqual(widget.getInputValue(), u"3")
+
+    def test_noBody(self):
+        request = TestWebDAVRequest()
+        self.assertEqual(widgets.getProppatchIndex(request).keys(), [])
+
+    def test_newBody(self):
+        # The index is rebuilt if the xmlDataSource is replaced.
+        request = TestWebDAVRequest()
+        widgets.getProppatchIndex(request)
+        request.xmlDataSource = ElementTree.fromstring(
+            """<D:propertyupdate xmlns:D="DAV:" xmlns:E="example:">
+  <D:set><D:prop><E:a>1</E:a></D:prop></D:set>
+</D:propertyupdate>""")
+        self.assertEqual(widgets.getProppatchIndex(request).keys(),
+                         ["{example:}a"])
+
+
 def test_suite():
     return unittest.TestSuite((
+        unittest.makeSuite(ProppatchIndexTest),
         unittest.makeSuite(WebDAVBaseInputWidgetTest),
         unittest.makeSuite(TextWebDAVInputWidgetTest),
         unittest.makeSuite(IntWebDAVInputWidgetTest),
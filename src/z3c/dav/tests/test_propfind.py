@@ -17,16 +17,29 @@ It is easier to do this has a unit test has we have complete control over
 what properties are defined or not.
 """
 
+import sys
+import time
+import logging
+import zlib
 import unittest
 from cStringIO import StringIO
 import UserDict
-from xml.etree import ElementTree
 
 from zope import interface
 from zope import component
 from zope import schema
+import transaction
+import persistent
+import ZODB
+import zope.event
+import zope.component.event # dispatch the events to the registered handlers
+from zope.lifecycleevent import ObjectModifiedEvent
+from zope.annotation.interfaces import IAttributeAnnotatable, IAnnotations
+from zope.annotation.attribute import AttributeAnnotations
 import zope.schema.interfaces
 from zope.traversing.browser.interfaces import IAbsoluteURL
+from zope.traversing.browser.absoluteurl import AbsoluteURL, SiteAbsoluteURL
+from zope.location.interfaces import IRoot
 from zope.filerepresentation.interfaces import IReadDirectory
 from zope.container.interfaces import IReadContainer
 from zope.error.interfaces import IErrorReportingUtility
@@ -34,18 +47,26 @@ from zope.security.interfaces import Unauthorized, IUnauthorized
 import zope.security.checker
 import zope.security.interfaces
 
+import z3c.dav.interfaces
+import z3c.dav.adapters
 import z3c.dav.properties
 import z3c.dav.publisher
 import z3c.dav.widgets
 import z3c.dav.exceptions
 import z3c.dav.coreproperties
+import z3c.dav.propfind
+import z3c.dav.propfindcache
+import z3c.dav.compression
+import z3c.dav.utils
+import z3c.dav.xmlengine
+from z3c.dav.xmlengine import ElementTree
 from z3c.dav.propfind import PROPFIND
 from z3c.etree.testing import etreeSetup, etreeTearDown
 from z3c.etree.testing import assertXMLEqual
 from z3c.etree.testing import assertXMLEqualIgnoreOrdering
 
 from test_proppatch import unauthProperty, UnauthorizedPropertyStorage, \
-     IUnauthorizedPropertyStorage
+     IUnauthorizedPropertyStorage, DEADProperties
 
 class TestRequest(z3c.dav.publisher.WebDAVRequest):
 
@@ -88,7 +109,7 @@ class PROPFINDBodyTestCase(unittest.TestCase):
     # get set up.
 
     def setUp(self):
-        etreeSetup(key = "py25")
+        etreeSetup(key = z3c.dav.xmlengine.engine)
 
     def tearDown(self):
         etreeTearDown()
@@ -327,7 +348,7 @@ class DummyResourceURL(object):
 
 
 def propfindSetUp():
-    etreeSetup(key = "py25")
+    etreeSetup(key = z3c.dav.xmlengine.engine)
 
     gsm = component.getGlobalSiteManager()
 
@@ -493,6 +514,211 @@ class PROPFINDTestRender(unittest.TestCase):
   <D:status>HTTP/1.1 200 Ok</D:status>
 </D:propstat></D:response>""")
 
+    def test_renderPropnames_noStorageAdapters(self):
+        # Only the names of the properties are rendered, so none of the
+        # storage adapters created by a class are created.
+        created = []
+        class Storage(BrokenPropertyStorage):
+            def __init__(self, context, request):
+                created.append(context)
+                super(Storage, self).__init__(context, request)
+        gsm = component.getGlobalSiteManager()
+        gsm.registerAdapter(Storage, (IResource, None),
+                            IBrokenPropertyStorage)
+        try:
+            resource = Resource("some text", 10)
+            request = z3c.dav.publisher.WebDAVRequest(StringIO(""), {})
+
+            propf = PROPFIND(None, None)
+            response = propf.renderPropnames(resource, request, None)
+        finally:
+            gsm.unregisterAdapter(Storage, (IResource, None),
+                                  IBrokenPropertyStorage)
+
+        self.assertEqual(created, [])
+        self.assert_("{DAVtest:}brokenprop" in [
+            prop.tag for prop in response.getPropstat(200).properties])
+
+    def test_renderPropnames_conditionalAdapter(self):
+        # A storage adapter factory that isn't a class, like the one of the
+        # `{DAV:}getetag' property, can return None. The properties are
+        # then listed neither by a propname nor by an allprop request.
+        class IConditionalResource(IResource):
+            pass
+
+        def factory(context, request):
+            if context.intprop > 10:
+                return ExamplePropertyStorage(context, request)
+            return None
+        gsm = component.getGlobalSiteManager()
+        gsm.registerAdapter(factory, (IConditionalResource, None),
+                            IExamplePropertyStorage)
+        try:
+            request = z3c.dav.publisher.WebDAVRequest(StringIO(""), {})
+            propf = PROPFIND(None, None)
+
+            names = {}
+            for intprop in (10, 20):
+                resource = Resource("some text", intprop)
+                interface.alsoProvides(resource, IConditionalResource)
+                propnames = propf.renderPropnames(resource, request, None)
+                allprop = propf.renderAllProperties(resource, request, None)
+                names[intprop] = (
+                    sorted([prop.tag for prop in
+                            propnames.getPropstat(200).properties]),
+                    sorted([prop.tag for prop in
+                            allprop.getPropstat(200).properties]))
+        finally:
+            gsm.unregisterAdapter(factory, (IConditionalResource, None),
+                                  IExamplePropertyStorage)
+
+        self.assert_("{DAVtest:}exampletextprop" not in names[10][0])
+        self.assert_("{DAVtest:}exampletextprop" in names[20][0])
+        # allprop leaves out the restricted properties
+        restricted = ["{DAVtest:}brokenprop", "{DAVtest:}unauthprop"]
+        for propnames, allprop in names.values():
+            self.assertEqual(
+                [tag for tag in propnames if tag not in restricted], allprop)
+
+    def test_renderDeadProperties(self):
+        # The stored values of the dead properties are written into the
+        # response without being parsed.
+        gsm = component.getGlobalSiteManager()
+        gsm.registerAdapter(DEADProperties, (IResource,))
+        try:
+            resource = Resource("some text", 10)
+            DEADProperties(resource).setProperty(
+                "{example:}deadprop",
+                z3c.dav.properties.SerializedElement(
+                    """<E:deadprop xmlns:E="example:">dead &amp; stored</E:deadprop>"""))
+            request = z3c.dav.publisher.WebDAVRequest(StringIO(""), {})
+
+            propf = PROPFIND(None, None)
+            allprops = propf.renderAllProperties(resource, request, None)
+            props = ElementTree.fromstring("""<prop xmlns="DAV:" xmlns:E="example:">
+<E:deadprop />
+</prop>""")
+            selected = propf.renderSelectedProperties(resource, request, props)
+        finally:
+            gsm.unregisterAdapter(DEADProperties, (IResource,))
+
+        for response in (allprops, selected):
+            fragments = [
+                prop for prop in response.getPropstat(200).properties
+                if isinstance(prop, z3c.dav.utils.XMLFragment)]
+            self.assertEqual([prop.tag for prop in fragments],
+                             ["{example:}deadprop"])
+            self.assert_("""<E:deadprop xmlns:E="example:">dead &amp; stored</E:deadprop>""" in response.serialize())
+
+        assertXMLEqualIgnoreOrdering(selected(), """<D:response xmlns:D="DAV:">
+<D:href>/resource</D:href>
+<D:propstat>
+  <D:prop>
+    <E:deadprop xmlns:E="example:">dead &amp; stored</E:deadprop>
+  </D:prop>
+  <D:status>HTTP/1.1 200 Ok</D:status>
+</D:propstat></D:response>""")
+
+    def test_renderDeadProperties_notSerialized(self):
+        # Values that weren't stored by the OpaqueInputWidget are parsed, so
+        # a malformed value only fails to render its own property.
+        gsm = component.getGlobalSiteManager()
+        gsm.registerAdapter(DEADProperties, (IResource,))
+        try:
+            resource = Resource("some text", 10)
+            resource.props = {
+                "{example:}tail": """<E:tail xmlns:E="example:">T</E:tail>
+""",
+                "{example:}broken": """<E:broken xmlns:E="example:">"""}
+            request = z3c.dav.publisher.WebDAVRequest(StringIO(""), {})
+
+            propf = PROPFIND(None, None)
+            response = propf.renderAllProperties(resource, request, None)
+        finally:
+            gsm.unregisterAdapter(DEADProperties, (IResource,))
+
+        for prop in response.getPropstat(200).properties:
+            self.assert_(not isinstance(prop, z3c.dav.utils.XMLFragment))
+        self.assertEqual(
+            [prop.tag for prop in response.getPropstat(500).properties],
+            ["{example:}broken"])
+
+        data = response.serialize()
+        el = ElementTree.fromstring(data)
+        self.assertEqual(
+            el.findtext("{DAV:}propstat/{DAV:}prop/{example:}tail"), "T")
+
+    def test_renderAllProperties_bulkDeadProperties(self):
+        # All the dead properties are read with one call to getProperties.
+        class BulkDEADProperties(DEADProperties):
+            interface.implements(
+                z3c.dav.interfaces.IBulkOpaquePropertyStorage)
+
+            calls = []
+
+            def getProperty(self, tag):
+                raise AssertionError("getProperty called")
+
+            def getProperties(self, tags = None):
+                self.calls.append(tags)
+                return self.data.items()
+
+        gsm = component.getGlobalSiteManager()
+        gsm.registerAdapter(BulkDEADProperties, (IResource,),
+                            z3c.dav.interfaces.IOpaquePropertyStorage)
+        try:
+            resource = Resource("some text", 10)
+            SerializedElement = z3c.dav.properties.SerializedElement
+            resource.props = {
+                "{example:}a": SerializedElement(
+                    """<E:a xmlns:E="example:">A</E:a>"""),
+                "{example:}b": SerializedElement(
+                    """<E:b xmlns:E="example:">B</E:b>""")}
+            request = z3c.dav.publisher.WebDAVRequest(StringIO(""), {})
+
+            propf = PROPFIND(None, None)
+            response = propf.renderAllProperties(resource, request, None)
+        finally:
+            gsm.unregisterAdapter(BulkDEADProperties, (IResource,),
+                                  z3c.dav.interfaces.IOpaquePropertyStorage)
+
+        self.assertEqual(BulkDEADProperties.calls, [None])
+        data = response.serialize()
+        self.assert_("""<E:a xmlns:E="example:">A</E:a>""" in data)
+        self.assert_("""<E:b xmlns:E="example:">B</E:b>""" in data)
+
+    def test_getAllProperties_deadPropertyStorage(self):
+        # The public getAllProperties function returns the storage of the
+        # dead properties, even if it supports reading them in one call.
+        class BulkDEADProperties(DEADProperties):
+            interface.implements(
+                z3c.dav.interfaces.IBulkOpaquePropertyStorage)
+
+            def getProperties(self, tags = None):
+                return self.data.items()
+
+        gsm = component.getGlobalSiteManager()
+        gsm.registerAdapter(BulkDEADProperties, (IResource,),
+                            z3c.dav.interfaces.IOpaquePropertyStorage)
+        try:
+            resource = Resource("some text", 10)
+            resource.props = {
+                "{example:}a": """<E:a xmlns:E="example:">A</E:a>"""}
+            request = z3c.dav.publisher.WebDAVRequest(StringIO(""), {})
+
+            adapters = [
+                adapter for prop, adapter in
+                z3c.dav.properties.getAllProperties(resource, request)
+                if prop.iface is z3c.dav.interfaces.IOpaquePropertyStorage]
+        finally:
+            gsm.unregisterAdapter(BulkDEADProperties, (IResource,),
+                                  z3c.dav.interfaces.IOpaquePropertyStorage)
+
+        self.assertEqual(len(adapters), 1)
+        self.assert_(isinstance(adapters[0], BulkDEADProperties))
+        adapters[0].removeProperty("{example:}a")
+        self.assertEqual(resource.props, {})
+
     def test_renderSelected(self):
         resource = Resource("some text", 10)
         request = z3c.dav.publisher.WebDAVRequest(StringIO(""), {})
@@ -576,6 +802,123 @@ class PROPFINDTestRender(unittest.TestCase):
 </D:propstat>
 </D:response>""")
 
+    def test_renderSelected_notfound_minimal(self):
+        resource = Resource("some text", 10)
+        request = z3c.dav.publisher.WebDAVRequest(StringIO(""), {})
+        propf = PROPFIND(None, None)
+        propf.minimal = True
+
+        props = ElementTree.fromstring("""<prop xmlns="DAV:" xmlns:D="DAVtest:">
+<D:exampletextprop />
+<D:extratextprop />
+</prop>""")
+        response = propf.renderSelectedProperties(resource, request, props)
+
+        assertXMLEqualIgnoreOrdering(response(), """<D:response xmlns:D="DAV:">
+<D:href>/resource</D:href>
+<D:propstat>
+  <D:prop>
+    <D1:exampletextprop xmlns:D1="DAVtest:">some text</D1:exampletextprop>
+  </D:prop>
+  <D:status>HTTP/1.1 200 Ok</D:status>
+</D:propstat>
+</D:response>""")
+
+    def test_renderSelected_allnotfound_minimal(self):
+        # A response always contains at least one propstat element.
+        resource = Resource("some text", 10)
+        request = z3c.dav.publisher.WebDAVRequest(StringIO(""), {})
+        propf = PROPFIND(None, None)
+        propf.minimal = True
+
+        props = ElementTree.fromstring("""<prop xmlns="DAV:" xmlns:D="DAVtest:">
+<D:extratextprop />
+</prop>""")
+        response = propf.renderSelectedProperties(resource, request, props)
+
+        assertXMLEqualIgnoreOrdering(response(), """<D:response xmlns:D="DAV:">
+<D:href>/resource</D:href>
+<D:propstat>
+  <D:prop />
+  <D:status>HTTP/1.1 200 Ok</D:status>
+</D:propstat>
+</D:response>""")
+
+    def test_PROPFIND_minimal(self):
+        resource = Resource("some text", 10)
+        request = TestRequest(
+            properties = "<prop xmlns:D1='DAVtest:'><D1:exampletextprop />" \
+                         "<D1:extratextprop /></prop>",
+            environ = {"DEPTH": "0", "HTTP_PREFER": "return=minimal"})
+        propf = PROPFIND(resource, request)
+        result = propf.PROPFIND()
+
+        self.assertEqual(request.response.getHeader("Preference-Applied"),
+                         "return=minimal")
+        self.assertEqual(request.response.getHeader("Vary"), "Prefer")
+        assertXMLEqualIgnoreOrdering(result, """<D:multistatus xmlns:D="DAV:">
+<D:response>
+<D:href>/resource</D:href>
+<D:propstat>
+  <D:prop>
+    <D1:exampletextprop xmlns:D1="DAVtest:">some text</D1:exampletextprop>
+  </D:prop>
+  <D:status>HTTP/1.1 200 Ok</D:status>
+</D:propstat>
+</D:response></D:multistatus>""")
+
+        request = TestRequest(properties = "<prop><resourcetype /></prop>",
+                              environ = {"DEPTH": "0"})
+        request.response.setHeader("Vary", "Accept-Language")
+        PROPFIND(resource, request).PROPFIND()
+        self.assertEqual(request.response.getHeader("Preference-Applied"),
+                         None)
+        # The response would change with a Prefer header.
+        self.assertEqual(request.response.getHeader("Vary"),
+                         "Accept-Language, Prefer")
+
+        request = TestRequest(properties = "<propname />",
+                              environ = {"DEPTH": "0"})
+        PROPFIND(resource, request).PROPFIND()
+        self.assertEqual(request.response.getHeader("Vary"), None)
+
+    def test_PROPFIND_compressed(self):
+        compression = z3c.dav.compression.ResponseCompression(threshold = 0)
+        component.getGlobalSiteManager().registerUtility(compression)
+        spoolsize = z3c.dav.utils.StreamingMultiStatus.spoolsize
+        z3c.dav.utils.StreamingMultiStatus.spoolsize = 10
+        try:
+            resource = Resource("some text", 10)
+            request = TestRequest(
+                properties = "<prop xmlns:D1='DAVtest:'>" \
+                             "<D1:exampletextprop /></prop>",
+                environ = {"DEPTH": "0", "HTTP_ACCEPT_ENCODING": "gzip"})
+            result = PROPFIND(resource, request).PROPFIND()
+        finally:
+            z3c.dav.utils.StreamingMultiStatus.spoolsize = spoolsize
+            component.getGlobalSiteManager().unregisterUtility(compression)
+
+        # The spooled response is compressed on the fly so we don't know
+        # its length.
+        self.assert_(isinstance(result, z3c.dav.compression.CompressedResult))
+        self.assertEqual(request.response.getHeader("content-length"), None)
+        self.assertEqual(request.response.getHeader("content-encoding"),
+                         "gzip")
+        self.assertEqual(request.response.getHeader("vary"),
+                         "Prefer, Accept-Encoding")
+        assertXMLEqualIgnoreOrdering(
+            zlib.decompress("".join(result), 16 + zlib.MAX_WBITS),
+            """<D:multistatus xmlns:D="DAV:">
+<D:response>
+<D:href>/resource</D:href>
+<D:propstat>
+  <D:prop>
+    <D1:exampletextprop xmlns:D1="DAVtest:">some text</D1:exampletextprop>
+  </D:prop>
+  <D:status>HTTP/1.1 200 Ok</D:status>
+</D:propstat>
+</D:response></D:multistatus>""")
+
     def test_renderAllProperties(self):
         resource = Resource("some text", 10)
         request = z3c.dav.publisher.WebDAVRequest(StringIO(""), {})
@@ -1050,6 +1393,83 @@ class PROPFINDSecurityTestCase(unittest.TestCase):
 
         self.assertEqual(len(self.errUtility.errors), 0)
 
+    def test_handlePropfindResource_spooled(self):
+        # Large responses are spooled to disk and returned has an iterable
+        # result with the content-length header set.
+        self.addChecker(
+            self.collection["r1"], zope.security.checker.Checker({
+                "text": zope.security.checker.CheckerPublic,
+                "intprop": zope.security.checker.CheckerPublic}))
+        collection = self.addChecker(
+            self.collection, zope.security.checker.Checker({
+                "values": zope.security.checker.CheckerPublic}))
+
+        request = z3c.dav.publisher.WebDAVRequest(StringIO(""), {})
+        request.processInputs()
+        propf = PROPFIND(collection, request)
+
+        spoolsize = z3c.dav.utils.StreamingMultiStatus.spoolsize
+        z3c.dav.utils.StreamingMultiStatus.spoolsize = 10
+        try:
+            result = propf.PROPFIND()
+        finally:
+            z3c.dav.utils.StreamingMultiStatus.spoolsize = spoolsize
+
+        self.assertEqual(isinstance(result, str), False)
+        self.assertEqual(request.response.getStatus(), 207)
+        length = len(result)
+        self.assertEqual(request.response.getHeader("content-length"),
+                         str(length))
+
+        result = "".join(result)
+        self.assertEqual(len(result), length)
+        assertXMLEqualIgnoreOrdering(result, """<D:multistatus xmlns:D="DAV:">
+<D:response>
+  <D:href>/collection/</D:href>
+  <D:propstat>
+    <D:prop>
+      <D:resourcetype>
+        <D:collection />
+      </D:resourcetype>
+    </D:prop>
+    <D:status>HTTP/1.1 200 Ok</D:status>
+  </D:propstat>
+</D:response>
+<D:response>
+  <D:href>/collection/c/</D:href>
+  <D:propstat>
+    <D:prop>
+      <D:resourcetype>
+        <D:collection />
+      </D:resourcetype>
+    </D:prop>
+    <D:status>HTTP/1.1 200 Ok</D:status>
+  </D:propstat>
+</D:response>
+<D:response>
+  <D:href>/collection/c/r2</D:href>
+  <D:propstat>
+    <D:prop>
+      <D1:exampletextprop xmlns:D1="DAVtest:">some text - r2</D1:exampletextprop>
+      <D:resourcetype />
+      <D1:exampleintprop xmlns:D1="DAVtest:">4</D1:exampleintprop>
+    </D:prop>
+    <D:status>HTTP/1.1 200 Ok</D:status>
+  </D:propstat>
+</D:response>
+<D:response>
+  <D:href>/collection/r1</D:href>
+  <D:propstat>
+    <D:prop>
+      <D1:exampletextprop xmlns:D1="DAVtest:">some text - r1</D1:exampletextprop>
+      <D:resourcetype />
+      <D1:exampleintprop xmlns:D1="DAVtest:">2</D1:exampleintprop>
+    </D:prop>
+    <D:status>HTTP/1.1 200 Ok</D:status>
+  </D:propstat>
+</D:response></D:multistatus>
+        """)
+
     def test_handlePropfind_forbiddenResourceProperty(self):
         # Remove access to the `exampleintprop' on the collection['r1']
         # resource. Since this not the requested resource we render the
@@ -1455,9 +1875,929 @@ class PROPFINDSecurityTestCase(unittest.TestCase):
         self.assertEqual(len(self.errUtility.errors), 0)
 
 
+class PROPFINDPolicyTestCase(unittest.TestCase):
+    # Test the limits placed on Depth infinity requests.
+
+    def setUp(self):
+        propfindSetUp()
+        unauthProperty.restricted = True
+
+        gsm = component.getGlobalSiteManager()
+        gsm.registerAdapter(
+            readDirectoryNoOp, (IReadContainer,), provided = IReadDirectory)
+        self.errUtility = ErrorReportingUtility()
+        gsm.registerUtility(self.errUtility)
+
+        self.collection = Collection()
+        self.collection["r1"] = Resource("some text - r1", 2)
+        self.collection["c"] = Collection()
+        self.collection["c"]["r2"] = Resource("some text - r2", 4)
+
+        self.policy = None
+
+    def tearDown(self):
+        propfindTearDown()
+
+        gsm = component.getGlobalSiteManager()
+        gsm.unregisterAdapter(
+            readDirectoryNoOp, (IReadContainer,), provided = IReadDirectory)
+        gsm.unregisterUtility(self.errUtility)
+        del self.errUtility
+
+        if self.policy is not None:
+            gsm.unregisterUtility(
+                self.policy, z3c.dav.interfaces.IPropfindPolicy)
+
+    def setPolicy(self, **kw):
+        self.policy = z3c.dav.propfind.PropfindPolicy(**kw)
+        component.getGlobalSiteManager().registerUtility(
+            self.policy, z3c.dav.interfaces.IPropfindPolicy)
+
+    def propfind(self, depth = "infinity"):
+        request = TestRequest(properties = "<prop><resourcetype /></prop>",
+                              environ = {"DEPTH": depth})
+        propf = PROPFIND(self.collection, request)
+        return request, propf.PROPFIND()
+
+    def test_default_policy(self):
+        request, result = self.propfind()
+        self.assertEqual(request.response.getStatus(), 207)
+        self.assertEqual(
+            len(ElementTree.fromstring(result).findall("{DAV:}response")), 4)
+
+    def test_depth_infinity_disabled(self):
+        self.setPolicy(depthInfinity = False)
+        self.assertRaises(z3c.dav.interfaces.PropfindFiniteDepth,
+                          self.propfind)
+
+    def test_depth_one_allowed(self):
+        self.setPolicy(depthInfinity = False, maxResources = 1)
+        request, result = self.propfind(depth = "1")
+        self.assertEqual(request.response.getStatus(), 207)
+        self.assertEqual(
+            len(ElementTree.fromstring(result).findall("{DAV:}response")), 3)
+
+    def test_max_resources_truncated(self):
+        self.setPolicy(maxResources = 2)
+        request, result = self.propfind()
+
+        self.assertEqual(request.response.getStatus(), 207)
+        responses = ElementTree.fromstring(result).findall("{DAV:}response")
+        self.assertEqual(len(responses), 3)
+
+        # The last response marks the requested resource has truncated.
+        self.assertEqual(responses[0].findtext("{DAV:}href"), "/collection/")
+        last = responses[-1]
+        self.assertEqual(last.findtext("{DAV:}href"), "/collection/")
+        self.assertEqual(last.findtext("{DAV:}status"),
+                         "HTTP/1.1 507 Insufficient Storage")
+        self.assertEqual(
+            [el.tag for el in last.find("{DAV:}error")],
+            ["{DAV:}number-of-matches-within-limits"])
+
+    def test_max_resources_not_exceeded(self):
+        self.setPolicy(maxResources = 4)
+        request, result = self.propfind()
+        responses = ElementTree.fromstring(result).findall("{DAV:}response")
+        self.assertEqual(len(responses), 4)
+        self.assertEqual(
+            [response.findtext("{DAV:}status") for response in responses],
+            [None, None, None, None])
+
+    def test_max_resources_forbidden(self):
+        self.setPolicy(maxResources = 2, truncate = False)
+        self.assertRaises(z3c.dav.interfaces.PropfindFiniteDepth,
+                          self.propfind)
+
+    def test_time_limit(self):
+        # The requested resource is always rendered.
+        self.setPolicy(timeLimit = 0.5)
+
+        class Clock(object):
+            now = 0
+            def time(self):
+                self.now += 1
+                return self.now
+
+        z3c.dav.propfind.time = Clock()
+        try:
+            request, result = self.propfind()
+        finally:
+            z3c.dav.propfind.time = time
+
+        responses = ElementTree.fromstring(result).findall("{DAV:}response")
+        self.assertEqual(len(responses), 2)
+        self.assertEqual(responses[-1].findtext("{DAV:}status"),
+                         "HTTP/1.1 507 Insufficient Storage")
+
+
+class BulkPropertyProvider(object):
+    interface.implements(z3c.dav.interfaces.IBulkPropertyProvider)
+
+    calls = []
+
+    def __init__(self, context, request):
+        self.context = context
+
+    def getPropertyValues(self, tags):
+        self.calls.append((self.context, tags))
+        return {"r1": {"{DAVtest:}exampletextprop": u"bulk text - r1"},
+                "c": {"{DAVtest:}exampletextprop": u"bulk text - c"}}
+
+
+class PROPFINDBulkPropertyTestCase(unittest.TestCase):
+    # Test that the property values supplied by an IBulkPropertyProvider
+    # for the members of a collection are used.
+
+    def setUp(self):
+        propfindSetUp()
+
+        gsm = component.getGlobalSiteManager()
+        gsm.registerAdapter(
+            readDirectoryNoOp, (IReadContainer,), provided = IReadDirectory)
+        gsm.registerAdapter(BulkPropertyProvider,
+                            (ICollection, z3c.dav.interfaces.IWebDAVRequest))
+        self.errUtility = ErrorReportingUtility()
+        gsm.registerUtility(self.errUtility)
+        BulkPropertyProvider.calls = []
+
+        self.collection = Collection()
+        self.collection["r1"] = Resource("some text - r1", 2)
+        self.collection["r2"] = Resource("some text - r2", 4)
+        self.collection["c"] = Collection()
+
+    def tearDown(self):
+        propfindTearDown()
+
+        gsm = component.getGlobalSiteManager()
+        gsm.unregisterAdapter(
+            readDirectoryNoOp, (IReadContainer,), provided = IReadDirectory)
+        gsm.unregisterAdapter(BulkPropertyProvider,
+                              (ICollection,
+                               z3c.dav.interfaces.IWebDAVRequest))
+        gsm.unregisterUtility(self.errUtility)
+        del self.errUtility
+
+    def propfind(self, properties, depth = "1", factory = PROPFIND):
+        request = TestRequest(properties = properties,
+                              environ = {"DEPTH": depth})
+        propf = factory(self.collection, request)
+        result = ElementTree.fromstring(propf.PROPFIND())
+        responses = {}
+        for response in result.findall("{DAV:}response"):
+            responses[response.findtext("{DAV:}href")] = response
+        return responses
+
+    def getValue(self, response, tag):
+        for propstat in response.findall("{DAV:}propstat"):
+            el = propstat.find("{DAV:}prop/" + tag)
+            if el is not None:
+                return propstat.findtext("{DAV:}status"), el.text
+        return None
+
+    def test_selected_properties(self):
+        responses = self.propfind(
+            "<prop xmlns:D1='DAVtest:'><D1:exampletextprop />" \
+            "<D1:exampleintprop /></prop>")
+
+        self.assertEqual(BulkPropertyProvider.calls,
+                         [(self.collection, ["{DAVtest:}exampletextprop",
+                                             "{DAVtest:}exampleintprop"])])
+
+        ok = "HTTP/1.1 200 Ok"
+        # Properties not supplied by the provider use the storage adapter.
+        self.assertEqual(
+            self.getValue(responses["/collection/r1"],
+                          "{DAVtest:}exampletextprop"),
+            (ok, "bulk text - r1"))
+        self.assertEqual(
+            self.getValue(responses["/collection/r1"],
+                          "{DAVtest:}exampleintprop"),
+            (ok, "2"))
+        self.assertEqual(
+            self.getValue(responses["/collection/r2"],
+                          "{DAVtest:}exampletextprop"),
+            (ok, "some text - r2"))
+        # The collection has no storage adapter for the example properties.
+        self.assertEqual(
+            self.getValue(responses["/collection/c/"],
+                          "{DAVtest:}exampletextprop"),
+            (ok, "bulk text - c"))
+        self.assertEqual(
+            self.getValue(responses["/collection/c/"],
+                          "{DAVtest:}exampleintprop"),
+            ("HTTP/1.1 404 Not Found", None))
+
+    def test_all_properties(self):
+        responses = self.propfind("<allprop />")
+
+        self.assertEqual(len(BulkPropertyProvider.calls), 1)
+        self.assert_("{DAVtest:}exampletextprop" in
+                     BulkPropertyProvider.calls[0][1])
+        self.assertEqual(
+            self.getValue(responses["/collection/r1"],
+                          "{DAVtest:}exampletextprop"),
+            ("HTTP/1.1 200 Ok", "bulk text - r1"))
+        self.assertEqual(
+            self.getValue(responses["/collection/r2"],
+                          "{DAVtest:}exampletextprop"),
+            ("HTTP/1.1 200 Ok", "some text - r2"))
+
+    def test_property_names(self):
+        responses = self.propfind("<propname />")
+        self.assertEqual(BulkPropertyProvider.calls, [])
+        self.assertEqual(len(responses), 4)
+
+    def test_depth_zero(self):
+        responses = self.propfind("<allprop />", depth = "0")
+        self.assertEqual(BulkPropertyProvider.calls, [])
+        self.assertEqual(len(responses), 1)
+
+    def test_old_signature(self):
+        # Render methods overridden with the signature they had before the
+        # href and values arguments were added are still called.
+        class PROPFINDOld(PROPFIND):
+            def renderPropnames(self, ob, req, ignoreExtraArg,
+                                ignorelevel = 0):
+                return PROPFIND.renderPropnames(
+                    self, ob, req, ignoreExtraArg, ignorelevel)
+
+            def renderAllProperties(self, ob, req, include, level = 0):
+                return PROPFIND.renderAllProperties(
+                    self, ob, req, include, level)
+
+            def renderSelectedProperties(self, ob, req, props, level = 0):
+                return PROPFIND.renderSelectedProperties(
+                    self, ob, req, props, level)
+
+        responses = self.propfind("<propname />", factory = PROPFINDOld)
+        self.assertEqual(len(responses), 4)
+
+        responses = self.propfind("<allprop />", factory = PROPFINDOld)
+        self.assertEqual(len(responses), 4)
+        self.assertEqual(
+            self.getValue(responses["/collection/r1"],
+                          "{DAVtest:}exampletextprop"),
+            ("HTTP/1.1 200 Ok", "some text - r1"))
+
+        responses = self.propfind(
+            "<prop xmlns:D1='DAVtest:'><D1:exampletextprop /></prop>",
+            factory = PROPFINDOld)
+        self.assertEqual(
+            self.getValue(responses["/collection/r1"],
+                          "{DAVtest:}exampletextprop"),
+            ("HTTP/1.1 200 Ok", "some text - r1"))
+
+
+class PrefetchStorage(object):
+
+    def prefetch(self, oids, tid):
+        pass
+
+
+class DB(object):
+
+    def __init__(self, storage):
+        self.storage = storage
+
+
+class Jar(object):
+    # Fake ZODB connection
+
+    def __init__(self, storage = PrefetchStorage()):
+        self.prefetched = []
+        self._db = DB(storage)
+
+    def db(self):
+        return self._db
+
+    def prefetch(self, oids):
+        self.prefetched.append(oids)
+
+
+class Ghost(object):
+    # Fake persistent object whose state is not loaded
+
+    _p_changed = None
+
+    def __init__(self, jar, oid, annotations = None):
+        self._p_jar = jar
+        self._p_oid = oid
+        if annotations is not None:
+            self.__annotations__ = annotations
+
+
+class PROPFINDPrefetchTestCase(unittest.TestCase):
+    # Test the prefetching of the state of the members of a collection.
+
+    def setUp(self):
+        propfindSetUp()
+        self.jar = Jar()
+
+    def tearDown(self):
+        propfindTearDown()
+        del self.jar
+
+    def test_prefetch_batches(self):
+        propf = PROPFIND(None, None)
+        propf.prefetchSize = 2
+        obs = [Ghost(self.jar, oid) for oid in range(5)]
+
+        members = propf.prefetchMembers(obs)
+        self.assertEqual(members.next(), obs[0])
+        self.assertEqual(self.jar.prefetched, [[0, 1]])
+
+        self.assertEqual(list(members), obs[1:])
+        self.assertEqual(self.jar.prefetched, [[0, 1], [2, 3], [4]])
+        self.assertEqual(propf.prefetched, 5)
+
+    def test_prefetch_only_ghosts(self):
+        propf = PROPFIND(None, None)
+        loaded = Ghost(self.jar, 1)
+        loaded._p_changed = False
+        obs = [Resource(), loaded, Ghost(self.jar, 2), Ghost(Jar(), 3)]
+
+        self.assertEqual(list(propf.prefetchMembers(obs)), obs)
+        self.assertEqual(self.jar.prefetched, [[2]])
+        self.assertEqual(propf.prefetched, 2)
+
+    def test_prefetch_not_supported(self):
+        propf = PROPFIND(None, None)
+        obs = [Ghost(object(), 1)]
+
+        self.assertEqual(list(propf.prefetchMembers(obs)), obs)
+        self.assertEqual(propf.prefetched, 0)
+
+    def test_prefetch_not_supported_by_storage(self):
+        # Connection.prefetch does nothing when the storage can't prefetch,
+        # these objects aren't counted.
+        propf = PROPFIND(None, None)
+        jar = Jar(storage = object())
+        obs = [Ghost(jar, 1)]
+
+        self.assertEqual(list(propf.prefetchMembers(obs)), obs)
+        self.assertEqual(jar.prefetched, [])
+        self.assertEqual(propf.prefetched, 0)
+
+    def test_prefetch_mappingstorage(self):
+        db = ZODB.DB(None)
+        tm = transaction.TransactionManager()
+        conn = db.open(tm)
+        try:
+            conn.root()["r1"] = PersistentResource("some text - r1", 2)
+            tm.commit()
+            conn.cacheMinimize()
+
+            propf = PROPFIND(None, None)
+            obs = [conn.root()["r1"]]
+            self.assertEqual(obs[0]._p_changed, None)
+            self.assertEqual(list(propf.prefetchMembers(obs)), obs)
+            self.assertEqual(propf.prefetched, 0)
+        finally:
+            conn.close()
+            db.close()
+
+    def test_prefetch_annotations(self):
+        propf = PROPFIND(None, None)
+        annotations = Ghost(self.jar, 2)
+        obs = [Ghost(self.jar, 1, annotations), Ghost(self.jar, 4)]
+
+        self.assertEqual(list(propf.prefetchMembers(obs)), obs)
+        self.assertEqual(self.jar.prefetched, [[1, 4]])
+
+        # Only the oids of the annotations are read, the ghosts aren't
+        # activated to list their values.
+        self.jar.prefetched = []
+        self.assertEqual(
+            list(propf.prefetchMembers(obs, annotations = True)), obs)
+        self.assertEqual(self.jar.prefetched, [[1, 4], [2]])
+        self.assertEqual(propf.prefetched, 5)
+
+    def test_prefetchAnnotations(self):
+        request = TestRequest()
+        propf = PROPFIND(None, request)
+
+        def props(*tags):
+            return [ElementTree.Element(tag) for tag in tags]
+
+        self.assertEqual(
+            propf.prefetchAnnotations(request, propf.renderAllProperties,
+                                      None),
+            True)
+        self.assertEqual(
+            propf.prefetchAnnotations(request, propf.renderPropnames, None),
+            True)
+        self.assertEqual(
+            propf.prefetchAnnotations(
+                request, propf.renderSelectedProperties,
+                props("{DAV:}resourcetype", "{DAVtest:}exampleintprop")),
+            False)
+        self.assertEqual(
+            propf.prefetchAnnotations(
+                request, propf.renderSelectedProperties,
+                props("{DAV:}resourcetype", "{DAV:}getlastmodified")),
+            True)
+        self.assertEqual(
+            propf.prefetchAnnotations(
+                request, propf.renderSelectedProperties,
+                props("{DAVtest:}deadprop")),
+            True)
+
+
+class PersistentResource(persistent.Persistent, Resource):
+    interface.implements(IAttributeAnnotatable)
+
+
+class PersistentCollection(persistent.Persistent, Collection):
+    interface.implements(IAttributeAnnotatable)
+
+    def __init__(self):
+        Collection.__init__(self)
+
+
+class ICounterStorage(interface.Interface):
+
+    counterprop = schema.Int(
+        title = u"Property which changes without the resource")
+
+counterProperty = z3c.dav.properties.DAVProperty(
+    "{DAVtest:}counterprop", ICounterStorage)
+
+
+class CounterStorage(object):
+    interface.implements(ICounterStorage)
+
+    value = 0
+
+    def __init__(self, context, request):
+        pass
+
+    @property
+    def counterprop(self):
+        return CounterStorage.value
+
+
+class PROPFINDCacheTestCase(unittest.TestCase):
+    # Test that the rendered responses are cached.
+
+    def setUp(self):
+        propfindSetUp()
+
+        gsm = component.getGlobalSiteManager()
+        gsm.registerUtility(counterProperty, name = "{DAVtest:}counterprop")
+        gsm.registerAdapter(CounterStorage,
+                            (IResource, z3c.dav.interfaces.IWebDAVRequest))
+        gsm.registerAdapter(
+            readDirectoryNoOp, (IReadContainer,), provided = IReadDirectory)
+        gsm.registerAdapter(AttributeAnnotations)
+        gsm.registerAdapter(z3c.dav.adapters.OpaqueProperties,
+                            (IAttributeAnnotatable,),
+                            z3c.dav.interfaces.IOpaquePropertyStorage)
+        self.errUtility = ErrorReportingUtility()
+        gsm.registerUtility(self.errUtility)
+        self.cache = z3c.dav.propfindcache.PropfindCache()
+        self.cache.uncacheable = frozenset(["{DAVtest:}counterprop"])
+        gsm.registerUtility(self.cache)
+        gsm.registerHandler(z3c.dav.propfindcache.invalidateModified)
+
+        self.db = ZODB.DB(None)
+        self.tm = transaction.TransactionManager()
+        self.conn = self.db.open(self.tm)
+        collection = PersistentCollection()
+        collection["r1"] = PersistentResource("some text - r1", 2)
+        collection["r2"] = PersistentResource("some text - r2", 4)
+        self.conn.root()["collection"] = self.collection = collection
+        self.tm.commit()
+
+    def tearDown(self):
+        propfindTearDown()
+
+        self.tm.abort()
+        self.conn.close()
+        self.db.close()
+
+        gsm = component.getGlobalSiteManager()
+        gsm.unregisterAdapter(
+            readDirectoryNoOp, (IReadContainer,), provided = IReadDirectory)
+        gsm.unregisterAdapter(AttributeAnnotations)
+        gsm.unregisterAdapter(z3c.dav.adapters.OpaqueProperties,
+                              (IAttributeAnnotatable,),
+                              z3c.dav.interfaces.IOpaquePropertyStorage)
+        gsm.unregisterUtility(self.errUtility)
+        gsm.unregisterUtility(self.cache)
+        gsm.unregisterHandler(z3c.dav.propfindcache.invalidateModified)
+        gsm.unregisterUtility(counterProperty, name = "{DAVtest:}counterprop")
+        gsm.unregisterAdapter(CounterStorage,
+                              (IResource, z3c.dav.interfaces.IWebDAVRequest))
+        del self.errUtility
+        del self.cache
+
+    def propfind(self, properties, depth = "1"):
+        request = TestRequest(properties = properties,
+                              environ = {"DEPTH": depth})
+        propf = PROPFIND(self.collection, request)
+        return propf.PROPFIND()
+
+    def test_cached(self):
+        properties = "<prop xmlns:D1='DAVtest:'><D1:exampletextprop /></prop>"
+        result = self.propfind(properties)
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.hits, 0)
+
+        self.assertEqual(self.propfind(properties), result)
+        self.assertEqual(self.cache.hits, 3)
+
+        # Uncommitted changes are rendered but not cached.
+        self.collection["r1"].text = u"modified text - r1"
+        result = self.propfind(properties)
+        self.assert_("modified text - r1" in result)
+        self.assertEqual(self.cache.hits, 5)
+        self.assertEqual(len(self.cache), 3)
+
+        # The committed changes are cached under the new revision.
+        self.tm.commit()
+        self.assertEqual(self.propfind(properties), result)
+        self.assertEqual(self.propfind(properties), result)
+        self.assertEqual(self.cache.hits, 10)
+        self.assertEqual(len(self.cache), 4)
+
+        # The modified event forgets all the revisions of r1.
+        zope.event.notify(ObjectModifiedEvent(self.collection["r1"]))
+        self.assertEqual(len(self.cache), 2)
+
+    def test_not_persistent(self):
+        self.collection = Collection()
+        self.collection["r1"] = Resource("some text - r1", 2)
+        self.propfind("<prop xmlns:D1='DAVtest:'><D1:exampletextprop /></prop>")
+        self.assertEqual(len(self.cache), 0)
+
+    def test_deadproperty_modified(self):
+        # The dead properties are stored in the annotations of the resource,
+        # the modified event refreshes the response.
+        properties = "<prop xmlns:E='example:'><E:deadprop /></prop>"
+        props = z3c.dav.adapters.OpaqueProperties(self.collection["r1"])
+        props.setProperty("{example:}deadprop",
+                          "<E:deadprop xmlns:E='example:'>first</E:deadprop>")
+        self.tm.commit()
+
+        self.assert_("first" in self.propfind(properties))
+        self.assert_("first" in self.propfind(properties))
+        self.assertEqual(self.cache.hits, 3)
+
+        props.setProperty("{example:}deadprop",
+                          "<E:deadprop xmlns:E='example:'>second</E:deadprop>")
+        zope.event.notify(ObjectModifiedEvent(self.collection["r1"]))
+        self.tm.commit()
+
+        result = self.propfind(properties)
+        self.assert_("second" in result)
+        self.assert_("first" not in result)
+        self.assertEqual(self.cache.hits, 5)
+
+    def test_annotations_not_loaded(self):
+        # Only the state of the resources is loaded to find their cached
+        # responses, not their annotations.
+        properties = "<prop xmlns:E='example:'><E:deadprop /></prop>"
+        z3c.dav.adapters.OpaqueProperties(self.collection["r1"]).setProperty(
+            "{example:}deadprop", "<E:deadprop xmlns:E='example:' />")
+        self.tm.commit()
+        result = self.propfind(properties)
+
+        self.conn.cacheMinimize()
+        self.assertEqual(self.propfind(properties), result)
+        self.assertEqual(self.cache.hits, 3)
+        self.assertEqual(self.collection["r1"]._p_changed, False)
+        self.assertEqual(
+            self.collection["r1"].__annotations__._p_changed, None)
+
+    def test_allprop_cached(self):
+        # allprop requests are cached, except for the uncacheable
+        # properties which are rendered every time.
+        CounterStorage.value = 1
+        result = self.propfind("<allprop />")
+        self.assert_("<ns1:counterprop>1</ns1:counterprop>" in result)
+        self.assertEqual(len(self.cache), 3)
+
+        CounterStorage.value = 2
+        result = self.propfind("<allprop />")
+        self.assertEqual(self.cache.hits, 3)
+        self.assert_("<ns1:counterprop>2</ns1:counterprop>" in result)
+        self.assert_("<ns1:counterprop>1</ns1:counterprop>" not in result)
+        self.assertEqual(result.count("counterprop>2<"), 2)
+        self.assert_("some text - r1" in result)
+
+        # The uncached properties are added after the cached ones.
+        response = ElementTree.fromstring(result)[1]
+        tags = [el.tag
+                for el in response.findall("{DAV:}propstat/{DAV:}prop/*")]
+        self.assertEqual(tags[-1], "{DAVtest:}counterprop")
+        self.assertEqual(sorted(tags[:-1]),
+                         ["{DAV:}resourcetype", "{DAVtest:}exampleintprop",
+                          "{DAVtest:}exampletextprop"])
+
+    def test_selected_uncacheable(self):
+        properties = "<prop xmlns:D1='DAVtest:'><D1:exampletextprop />" \
+                     "<D1:counterprop /></prop>"
+        CounterStorage.value = 1
+        self.propfind(properties)
+        CounterStorage.value = 2
+        result = self.propfind(properties)
+        self.assertEqual(self.cache.hits, 3)
+        self.assertEqual(result.count("counterprop>2<"), 2)
+        self.assert_("counterprop>1<" not in result)
+
+        # The collection has no counterprop.
+        response = ElementTree.fromstring(result)[0]
+        propstats = dict([
+            (propstat.findtext("{DAV:}status"),
+             [el.tag for el in propstat.findall("{DAV:}prop/*")])
+            for propstat in response.findall("{DAV:}propstat")])
+        self.assertEqual(propstats, {
+            "HTTP/1.1 404 Not Found": ["{DAVtest:}exampletextprop",
+                                       "{DAVtest:}counterprop"]})
+
+    def test_principal_groups(self):
+        # The groups of the principal are part of the key.
+        class Principal(object):
+            id = "principal"
+            groups = ["group2", "group1"]
+
+        request = TestRequest(
+            properties = "<prop><resourcetype /></prop>")
+        request.setPrincipal(Principal())
+        propf = PROPFIND(self.collection, request)
+        extraArg = request.xmlDataSource[0]
+        key = propf.getCacheKey(request, self.cache,
+                                propf.renderSelectedProperties, extraArg)
+        self.assertEqual(key, ("renderSelectedProperties",
+                               ("{DAV:}resourcetype",), "principal",
+                               ("group1", "group2"), False))
+
+    def test_different_properties(self):
+        self.propfind("<prop xmlns:D1='DAVtest:'><D1:exampletextprop /></prop>")
+        result = self.propfind(
+            "<prop xmlns:D1='DAVtest:'><D1:exampleintprop /></prop>")
+        self.assertEqual(self.cache.hits, 0)
+        self.assertEqual(len(self.cache), 6)
+        self.assert_("exampleintprop" in result)
+
+    def test_uncacheable(self):
+        # Nothing is cached when only uncacheable properties are requested.
+        self.propfind("<prop xmlns:D1='DAVtest:'><D1:counterprop /></prop>")
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.misses, 0)
+
+    def test_errors_not_cached(self):
+        brokenProperty.restricted = False
+        try:
+            self.propfind(
+                "<prop xmlns:D1='DAVtest:'><D1:brokenprop /></prop>")
+        finally:
+            brokenProperty.restricted = True
+
+        # The collection has no broken property adapter and so it has
+        # a 404 Not Found status for this property which is cached.
+        self.assertEqual(len(self.cache), 1)
+        # one sample of each type of error is reported
+        self.assertEqual(len(self.errUtility.errors), 2)
+
+
+class LogHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class PROPFINDErrorReportingTestCase(unittest.TestCase):
+    # Test that the errors raised rendering the same property on many
+    # resources are aggregated.
+
+    def setUp(self):
+        propfindSetUp()
+        brokenProperty.restricted = False
+
+        gsm = component.getGlobalSiteManager()
+        gsm.registerAdapter(
+            readDirectoryNoOp, (IReadContainer,), provided = IReadDirectory)
+        self.errUtility = ErrorReportingUtility()
+        gsm.registerUtility(self.errUtility)
+        self.policy = None
+
+        self.collection = Collection()
+        for i in range(3):
+            self.collection["r%d" % i] = Resource("some text", i)
+
+        self.logger = logging.getLogger("z3c.dav.propfind")
+        self.loglevel = self.logger.level
+        self.logger.setLevel(logging.INFO)
+        self.handler = LogHandler()
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        propfindTearDown()
+        brokenProperty.restricted = True
+
+        gsm = component.getGlobalSiteManager()
+        gsm.unregisterAdapter(
+            readDirectoryNoOp, (IReadContainer,), provided = IReadDirectory)
+        gsm.unregisterUtility(self.errUtility)
+        del self.errUtility
+        if self.policy is not None:
+            gsm.unregisterUtility(
+                self.policy, z3c.dav.interfaces.IPropfindPolicy)
+
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.loglevel)
+
+    def propfind(self, **kw):
+        if kw:
+            self.policy = z3c.dav.propfind.PropfindPolicy(**kw)
+            component.getGlobalSiteManager().registerUtility(
+                self.policy, z3c.dav.interfaces.IPropfindPolicy)
+
+        request = TestRequest(
+            properties = "<prop xmlns:D1='DAVtest:'><D1:brokenprop /></prop>",
+            environ = {"DEPTH": "1", "HTTP_HOST": "localhost"})
+        propf = PROPFIND(self.collection, request)
+        propf.PROPFIND()
+
+    def test_sampled(self):
+        self.propfind()
+
+        # The missing property on the collection, and the first broken
+        # property, are reported.
+        self.assertEqual(
+            [exc_info[0] for exc_info, request in self.errUtility.errors],
+            [z3c.dav.interfaces.PropertyNotFound, NotImplementedError])
+
+        messages = [record.getMessage() for record in self.handler.records]
+        self.assertEqual(
+            messages,
+            ["PROPFIND http://localhost: NotImplementedError raised 3 times "
+             "rendering {DAVtest:}brokenprop, 1 reported",
+             "PROPFIND http://localhost: PropertyNotFound raised 1 times "
+             "rendering {DAVtest:}brokenprop, 1 reported"])
+
+    def test_more_samples(self):
+        self.propfind(errorSamples = 2)
+        self.assertEqual(
+            [exc_info[0] for exc_info, request in self.errUtility.errors],
+            [z3c.dav.interfaces.PropertyNotFound,
+             NotImplementedError, NotImplementedError])
+
+    def test_no_samples(self):
+        self.propfind(errorSamples = 0)
+        self.assertEqual(self.errUtility.errors, [])
+        self.assertEqual(len(self.handler.records), 2)
+
+
+class PROPFINDTraversalTestCase(unittest.TestCase):
+    # Test the order in which `handlePropfindResource' visits the resources
+    # and that it isn't limited by the recursion limit.
+
+    def setUp(self):
+        gsm = component.getGlobalSiteManager()
+        gsm.registerAdapter(
+            readDirectoryNoOp, (IReadContainer,), provided = IReadDirectory)
+        gsm.registerAdapter(AbsoluteURL,
+                            (interface.Interface, interface.Interface),
+                            IAbsoluteURL)
+        gsm.registerAdapter(SiteAbsoluteURL,
+                            (IRoot, interface.Interface), IAbsoluteURL)
+        self.request = TestRequest(
+            environ = {"HTTP_HOST": "localhost:8080"})
+
+    def tearDown(self):
+        gsm = component.getGlobalSiteManager()
+        gsm.unregisterAdapter(
+            readDirectoryNoOp, (IReadContainer,), provided = IReadDirectory)
+        gsm.unregisterAdapter(AbsoluteURL,
+                              (interface.Interface, interface.Interface),
+                              IAbsoluteURL)
+        gsm.unregisterAdapter(SiteAbsoluteURL,
+                              (IRoot, interface.Interface), IAbsoluteURL)
+        del self.request
+
+    def renderName(self, ob, req, extraArg, level = 0, href = None,
+                   values = None):
+        if href is None:
+            href = z3c.dav.utils.getObjectURL(ob, req)
+        response = z3c.dav.utils.Response(href)
+        response.name = ob.__name__
+        response.level = level
+        return response
+
+    def names(self, responses):
+        return [(response.name, response.level) for response in responses]
+
+    def buildTree(self):
+        collection = Collection()
+        collection.__name__ = "collection"
+        interface.alsoProvides(collection, IRoot)
+        collection["a"] = Collection()
+        collection["a"]["a1"] = Resource()
+        collection["a"]["a2"] = Collection()
+        collection["a"]["a2"]["a21 b"] = Resource()
+        collection["b"] = Resource()
+        return collection
+
+    def test_depth_zero(self):
+        propf = PROPFIND(None, None)
+        responses = propf.handlePropfindResource(
+            self.buildTree(), self.request, "0", self.renderName, None)
+        self.assertEqual(self.names(responses), [("collection", 0)])
+
+    def test_depth_one(self):
+        propf = PROPFIND(None, None)
+        responses = propf.handlePropfindResource(
+            self.buildTree(), self.request, "1", self.renderName, None)
+        self.assertEqual(sorted(self.names(responses)),
+                         [("a", 1), ("b", 1), ("collection", 0)])
+
+    def test_depth_infinity_order(self):
+        # Every resource follows its parent and all the members of a
+        # collection are rendered before the next sibling of the collection.
+        propf = PROPFIND(None, None)
+        responses = self.names(propf.handlePropfindResource(
+            self.buildTree(), self.request, "infinity", self.renderName,
+            None))
+
+        self.assertEqual(len(responses), 6)
+        self.assertEqual(responses[0], ("collection", 0))
+        names = [name for name, level in responses]
+        a = names.index("a")
+        self.assertEqual(sorted(names[a:a + 4]), ["a", "a1", "a2", "a21 b"])
+        self.assertEqual(names.index("a21 b"), names.index("a2") + 1)
+        self.assertEqual(dict(responses)["a21 b"], 3)
+
+    def test_depth_infinity_deep_tree(self):
+        depth = sys.getrecursionlimit() + 100
+        root = collection = Collection()
+        root.__name__ = "c0"
+        interface.alsoProvides(root, IRoot)
+        for i in range(1, depth):
+            collection["c%d" % i] = Collection()
+            collection = collection["c%d" % i]
+
+        propf = PROPFIND(None, None)
+        responses = propf.handlePropfindResource(
+            root, self.request, "infinity", self.renderName, None)
+
+        # The responses are generated lazily.
+        self.assertEqual(responses.next().name, "c0")
+        self.assertEqual(len(list(responses)), depth - 1)
+
+    def test_hrefs(self):
+        # The URLs of the members of a collection are built from the URL
+        # of the collection.
+        propf = PROPFIND(None, None)
+        responses = propf.handlePropfindResource(
+            self.buildTree(), self.request, "infinity", self.renderName,
+            None)
+        hrefs = [response.href[0] for response in responses]
+
+        self.assertEqual(sorted(hrefs),
+                         ["http://localhost:8080/collection/",
+                          "http://localhost:8080/collection/a/",
+                          "http://localhost:8080/collection/a/a1",
+                          "http://localhost:8080/collection/a/a2/",
+                          "http://localhost:8080/collection/a/a2/a21%20b",
+                          "http://localhost:8080/collection/b"])
+
+    def test_hrefs_custom_url(self):
+        # Resources with a custom IAbsoluteURL adapter still use it.
+        gsm = component.getGlobalSiteManager()
+        gsm.registerAdapter(DummyResourceURL,
+                            (IResource, interface.Interface), IAbsoluteURL)
+        try:
+            propf = PROPFIND(None, None)
+            responses = propf.handlePropfindResource(
+                self.buildTree(), self.request, "infinity", self.renderName,
+                None)
+            hrefs = dict([(response.name, response.href[0])
+                          for response in responses])
+        finally:
+            gsm.unregisterAdapter(DummyResourceURL,
+                                  (IResource, interface.Interface),
+                                  IAbsoluteURL)
+
+        self.assertEqual(hrefs["a1"], "/collection/a/a1")
+        self.assertEqual(hrefs["a2"], "http://localhost:8080/collection/a/a2/")
+
+
 def test_suite():
     return unittest.TestSuite((
         unittest.makeSuite(PROPFINDBodyTestCase),
         unittest.makeSuite(PROPFINDTestRender),
         unittest.makeSuite(PROPFINDSecurityTestCase),
+        unittest.makeSuite(PROPFINDPolicyTestCase),
+        unittest.makeSuite(PROPFINDBulkPropertyTestCase),
+        unittest.makeSuite(PROPFINDPrefetchTestCase),
+        unittest.makeSuite(PROPFINDCacheTestCase),
+        unittest.makeSuite(PROPFINDErrorReportingTestCase),
+        unittest.makeSuite(PROPFINDTraversalTestCase),
         ))
@@ -19,7 +19,6 @@ what properties are defined or not.
 
 import unittest
 from cStringIO import StringIO
-from xml.etree import ElementTree
 
 from zope import event
 from zope import interface
@@ -38,6 +37,8 @@ import z3c.dav.publisher
 import z3c.dav.interfaces
 
 from z3c.etree.testing import etreeSetup, etreeTearDown, assertXMLEqual
+import z3c.dav.xmlengine
+from z3c.dav.xmlengine import ElementTree
 
 class TestRequest(z3c.dav.publisher.WebDAVRequest):
 
@@ -118,21 +119,25 @@ class PROPPATCHHandler(z3c.dav.proppatch.PROPPATCH):
         self.setprops = []
         self.removeprops = []
 
-    def handleSet(self, prop):
-        self.setprops.append(prop.tag)
-        # The unit tests have no idea where the property lives.
-        return [zope.lifecycleevent.Attributes(interface.Interface)]
+    def validateSet(self, prop):
+        def change():
+            self.setprops.append(prop.tag)
+            # The unit tests have no idea where the property lives.
+            return [zope.lifecycleevent.Attributes(interface.Interface)]
+        return change
 
-    def handleRemove(self, prop):
-        self.removeprops.append(prop.tag)
-        # The unit tests have no idea where the property lives.
-        return [zope.lifecycleevent.Attributes(interface.Interface)]
+    def validateRemove(self, prop):
+        def change():
+            self.removeprops.append(prop.tag)
+            # The unit tests have no idea where the property lives.
+            return [zope.lifecycleevent.Attributes(interface.Interface)]
+        return change
 
 
 class PROPPATCHXmlParsing(unittest.TestCase):
 
     def setUp(self):
-        etreeSetup(key = "py25")
+        etreeSetup(key = z3c.dav.xmlengine.engine)
 
         gsm = component.getGlobalSiteManager()
 
@@ -355,7 +360,7 @@ class PROPPATCHXmlParsing(unittest.TestCase):
 
     def test_error_set_prop(self):
         class PROPPATCHHandlerError(PROPPATCHHandler):
-            def handleSet(self, prop):
+            def validateSet(self, prop):
                 raise z3c.dav.interfaces.PropertyNotFound(
                     self.context, "getcontenttype", u"property is missing")
 
@@ -370,7 +375,7 @@ class PROPPATCHXmlParsing(unittest.TestCase):
 
     def test_error_set_prop_with_remove(self):
         class PROPPATCHHandlerError(PROPPATCHHandler):
-            def handleSet(self, prop):
+            def validateSet(self, prop):
                 raise z3c.dav.interfaces.PropertyNotFound(
                     self.context, "getcontenttype", u"property is missing")
 
@@ -381,16 +386,70 @@ class PROPPATCHXmlParsing(unittest.TestCase):
         self.assertRaises(z3c.dav.interfaces.WebDAVPropstatErrors,
                           propp.PROPPATCH)
 
+        # The remove validated but isn't applied.
         self.assertEqual(propp.setprops, [])
-        self.assertEqual(propp.removeprops, ['{DAV:}displayname'])
+        self.assertEqual(propp.removeprops, [])
+
+    def test_error_nothing_applied(self):
+        # An error in any update means that none of the updates are
+        # applied, even those earlier in the request.
+        class PROPPATCHHandlerError(PROPPATCHHandler):
+            def validateRemove(self, prop):
+                raise z3c.dav.interfaces.ConflictError(
+                    self.context, prop.tag, u"cannot remove")
+
+        request = TestRequest(
+            set_properties = "<getcontenttype>text/plain</getcontenttype>",
+            remove_properties = "<displayname>Test Name</displayname>")
+        propp = PROPPATCHHandlerError(Resource(), request)
+        try:
+            propp.PROPPATCH()
+        except z3c.dav.interfaces.WebDAVPropstatErrors, errors:
+            pass
+        else:
+            self.fail("PROPPATCH didn't fail")
+
+        self.assertEqual(propp.setprops, [])
+        self.assert_(isinstance(errors["{DAV:}getcontenttype"],
+                                z3c.dav.interfaces.FailedDependency))
+        self.assert_(isinstance(errors["{DAV:}displayname"],
+                                z3c.dav.interfaces.ConflictError))
+
+    def test_error_applying(self):
+        # An update can still fail when it is applied.
+        class PROPPATCHHandlerError(PROPPATCHHandler):
+            def validateRemove(self, prop):
+                def change():
+                    raise z3c.dav.interfaces.ConflictError(
+                        self.context, prop.tag, u"cannot remove")
+                return change
+
+        request = TestRequest(
+            set_properties = "<getcontenttype>text/plain</getcontenttype>",
+            remove_properties = "<displayname>Test Name</displayname>")
+        propp = PROPPATCHHandlerError(Resource(), request)
+        try:
+            propp.PROPPATCH()
+        except z3c.dav.interfaces.WebDAVPropstatErrors, errors:
+            pass
+        else:
+            self.fail("PROPPATCH didn't fail")
+
+        self.assert_(isinstance(errors["{DAV:}getcontenttype"],
+                                z3c.dav.interfaces.FailedDependency))
+        self.assert_(isinstance(errors["{DAV:}displayname"],
+                                z3c.dav.interfaces.ConflictError))
 
     def test_response(self):
         request = TestRequest(
             remove_properties = "<displayname>Display name</displayname>",
             set_properties = "<getcontenttype>text/plain</getcontenttype>")
+        request.response.setHeader("Vary", "Accept-Language")
         propp = PROPPATCHHandler(Resource(), request)
         result = propp.PROPPATCH()
 
+        self.assertEqual(request.response.getHeader("Vary"),
+                         "Accept-Language, Prefer")
         assertXMLEqual(result, """<multistatus xmlns="DAV:">
 <response>
   <href>/resource</href>
@@ -403,6 +462,33 @@ class PROPPATCHXmlParsing(unittest.TestCase):
   </propstat>
 </response></multistatus>""")
 
+    def test_response_minimal(self):
+        request = TestRequest(
+            set_properties = "<getcontenttype>text/plain</getcontenttype>",
+            environ = {"HTTP_PREFER": "return=minimal"})
+        propp = PROPPATCHHandler(Resource(), request)
+        result = propp.PROPPATCH()
+
+        self.assertEqual(result, "")
+        self.assertEqual(request.response.getStatus(), 200)
+        self.assertEqual(request.response.getHeader("Preference-Applied"),
+                         "return=minimal")
+        self.assertEqual(request.response.getHeader("Vary"), "Prefer")
+
+    def test_error_minimal(self):
+        # Errors are still reported in full.
+        class PROPPATCHHandlerError(PROPPATCHHandler):
+            def validateSet(self, prop):
+                raise z3c.dav.interfaces.PropertyNotFound(
+                    self.context, "getcontenttype", u"property is missing")
+
+        request = TestRequest(
+            set_properties = "<getcontenttype>text/plain</getcontenttype>",
+            environ = {"HTTP_PREFER": "return=minimal"})
+        propp = PROPPATCHHandlerError(Resource(), request)
+        self.assertRaises(z3c.dav.interfaces.WebDAVPropstatErrors,
+                          propp.PROPPATCH)
+
 
 class IExamplePropertyStorage(interface.Interface):
 
@@ -466,7 +552,7 @@ class PROPPATCHHandlePropertyModification(unittest.TestCase):
         self.events.append(event)
 
     def setUp(self):
-        etreeSetup(key = "py25")
+        etreeSetup(key = z3c.dav.xmlengine.engine)
 
         gsm = component.getGlobalSiteManager()
 
@@ -678,6 +764,22 @@ class PROPPATCHHandlePropertyModification(unittest.TestCase):
         self.assertEqual(IObjectModifiedEvent.providedBy(self.events[0]), True)
         self.assertEqual(self.events[0].object, resource)
 
+    def test_failed_proppatch_modifies_nothing(self):
+        request = TestRequest(
+            set_properties = """
+<Dt:exampletextprop xmlns:Dt="DAVtest:">New Text Prop</Dt:exampletextprop>
+<Dt:exampleintprop xmlns:Dt="DAVtest:">not an integer</Dt:exampleintprop>
+""")
+        resource = Resource("Text Prop", 10)
+
+        propp = z3c.dav.proppatch.PROPPATCH(resource, request)
+        self.assertRaises(z3c.dav.interfaces.WebDAVPropstatErrors,
+                          propp.PROPPATCH)
+
+        self.assertEqual(resource.text, "Text Prop")
+        self.assertEqual(resource.intprop, 10)
+        self.assertEqual(len(self.events), 0)
+
     def test_unauthorized_proppatch(self):
         request = TestRequest(
             set_properties = """<Dt:unauthprop xmlns:Dt="DAVtest:">Example Text Prop</Dt:unauthprop>""")
@@ -725,7 +827,8 @@ class DEADProperties(object):
         return tag in self.data
 
     def getProperty(self, tag):
-        return self.data[tag]
+        # like OpaqueProperties, None for properties that aren't set.
+        return self.data.get(tag, None)
 
     def setProperty(self, tag, value):
         self.data[tag] = value
@@ -740,7 +843,7 @@ class PROPPATCHHandlePropertyRemoveDead(unittest.TestCase):
         self.events.append(event)
 
     def setUp(self):
-        etreeSetup(key = "py25")
+        etreeSetup(key = z3c.dav.xmlengine.engine)
 
         gsm = component.getGlobalSiteManager()
 
@@ -833,6 +936,49 @@ class PROPPATCHHandlePropertyRemoveDead(unittest.TestCase):
         self.assertEqual(IObjectModifiedEvent.providedBy(self.events[0]), True)
         self.assertEqual(self.events[0].object, resource)
 
+    def proppatchRequest(self, updates):
+        body = """<?xml version="1.0" encoding="utf-8" ?>
+<D:propertyupdate xmlns:D="DAV:" xmlns="DAV:" xmlns:E="example:">%s
+</D:propertyupdate>""" % updates
+        request = z3c.dav.publisher.WebDAVRequest(
+            StringIO(body), {"REQUEST_METHOD": "PROPPATCH",
+                             "CONTENT_TYPE": "text/xml",
+                             "CONTENT_LENGTH": len(body)})
+        request.processInputs()
+        return request
+
+    def test_set_then_remove(self):
+        # The updates are applied in the order of the request.
+        request = self.proppatchRequest("""
+<set><prop><E:deadprop>value</E:deadprop></prop></set>
+<remove><prop><E:deadprop /></prop></remove>""")
+        resource = Resource("Text Prop", 10)
+
+        propp = z3c.dav.proppatch.PROPPATCH(resource, request)
+        propp.PROPPATCH()
+
+        self.assertEqual(
+            DEADProperties(resource).hasProperty("{example:}deadprop"), False)
+
+    def test_remove_then_set(self):
+        # Setting a property to its current value after removing it
+        # keeps it.
+        request = self.proppatchRequest("""
+<remove><prop><E:deadprop /></prop></remove>
+<set><prop><E:deadprop>value</E:deadprop></prop></set>""")
+        value = z3c.dav.xmlengine.tofragment(
+            z3c.dav.widgets.getProppatchIndex(request)["{example:}deadprop"])
+        resource = Resource("Text Prop", 10)
+        deadprops = DEADProperties(resource)
+        deadprops.setProperty("{example:}deadprop", value)
+
+        propp = z3c.dav.proppatch.PROPPATCH(resource, request)
+        propp.PROPPATCH()
+
+        self.assertEqual(deadprops.hasProperty("{example:}deadprop"), True)
+        self.assertEqual(
+            deadprops.getProperty("{example:}deadprop"), value)
+
 
 def test_suite():
     return unittest.TestSuite((
@@ -19,11 +19,14 @@ import types
 from cStringIO import StringIO
 
 from zope.interface.verify import verifyObject
+import zope.component
 
-from z3c.dav.publisher import WebDAVRequest
+from z3c.dav.publisher import WebDAVRequest, RequestLimits
 from z3c.dav.interfaces import IWebDAVRequest, IWebDAVResponse, BadRequest
+from z3c.dav.interfaces import IRequestLimits, RequestEntityTooLarge
 
 import z3c.etree.testing
+import z3c.dav.xmlengine
 
 def create_request(body = None, env = {}):
     if isinstance(body, types.StringTypes):
@@ -36,7 +39,8 @@ def create_request(body = None, env = {}):
 class TestWebDAVPublisher(unittest.TestCase):
 
     def setUp(self):
-        self.etree = z3c.etree.testing.etreeSetup(key = "py25")
+        self.etree = z3c.etree.testing.etreeSetup(
+            key = z3c.dav.xmlengine.engine)
 
     def tearDown(self):
         z3c.etree.testing.etreeTearDown()
@@ -112,9 +116,42 @@ class TestWebDAVPublisher(unittest.TestCase):
         """
         request = create_request(body, {"CONTENT_TYPE": "application/xml",
                                         "CONTENT_LENGTH": len(body)})
-        self.assertRaises(BadRequest, request.processInputs)
+        request.processInputs()
+        self.assertRaises(BadRequest, getattr, request, "xmlDataSource")
         self.assertEqual(request.content_type, None)
 
+    def test_lazyParsing(self):
+        body = StringIO("""<?xml version="1.0" encoding="utf-8" ?>
+        <somedoc>This is some xml document</somedoc>
+        """)
+        request = create_request(body, {"CONTENT_TYPE": "text/xml",
+                                        "CONTENT_LENGTH": len(body.getvalue())})
+        request.processInputs()
+        self.assertEqual(body.tell(), 0)
+
+        xmlDataSource = request.xmlDataSource
+        self.assertEqual(xmlDataSource.tag, "somedoc")
+        self.assert_(request.xmlDataSource is xmlDataSource)
+        self.assertEqual(request.content_type, "text/xml")
+
+    def test_lazyParsing_noContentType(self):
+        body = "<somedoc>This is some xml document</somedoc>"
+        request = create_request(body, {"CONTENT_LENGTH": len(body)})
+        request.processInputs()
+
+        self.assertEqual(request.content_type, "application/xml")
+        self.assertEqual(request.xmlDataSource.tag, "somedoc")
+
+    def test_lazyParsing_assigned(self):
+        body = StringIO("<somedoc>This is some xml document</somedoc>")
+        request = create_request(body, {"CONTENT_TYPE": "text/xml",
+                                        "CONTENT_LENGTH": len(body.getvalue())})
+        request.processInputs()
+        request.xmlDataSource = None
+
+        self.assertEqual(request.xmlDataSource, None)
+        self.assertEqual(body.tell(), 0)
+
     def test_contentLength(self):
         request = create_request("", {"CONTENT_TYPE": "text/xml",
                                       "CONTENT_LENGTH": "0"})
@@ -135,7 +172,83 @@ class TestWebDAVPublisher(unittest.TestCase):
         self.assert_(request.xmlDataSource is not None)
 
 
+class TestRequestLimits(unittest.TestCase):
+
+    def setUp(self):
+        self.etree = z3c.etree.testing.etreeSetup(
+            key = z3c.dav.xmlengine.engine)
+        self.limits = RequestLimits(maxSize = 200, maxElements = 10,
+                                    maxDepth = 3)
+        zope.component.getGlobalSiteManager().registerUtility(self.limits)
+
+    def tearDown(self):
+        z3c.etree.testing.etreeTearDown()
+        zope.component.getGlobalSiteManager().unregisterUtility(self.limits)
+
+    def test_withinLimits(self):
+        body = """<?xml version="1.0" encoding="utf-8" ?>
+<D:propfind xmlns:D="DAV:"><D:prop><D:getetag /></D:prop></D:propfind>"""
+        request = create_request(body, {"CONTENT_TYPE": "text/xml",
+                                        "CONTENT_LENGTH": str(len(body))})
+        request.processInputs()
+
+        self.assertEqual(request.xmlDataSource.tag, "{DAV:}propfind")
+
+    def test_contentLengthTooLarge(self):
+        # The body isn't read when the content-length is too large.
+        body = StringIO("<a />")
+        request = create_request(body, {"CONTENT_TYPE": "text/xml",
+                                        "CONTENT_LENGTH": "201"})
+        self.assertRaises(RequestEntityTooLarge, request.processInputs)
+        self.assertEqual(body.tell(), 0)
+
+    def test_bodyTooLarge(self):
+        # The content-length header understates the size of the body.
+        body = "<a>%s</a>" %("<b />" * 100)
+        request = create_request(body, {"CONTENT_LENGTH": "10"})
+        request.processInputs()
+        self.assertRaises(RequestEntityTooLarge,
+                          getattr, request, "xmlDataSource")
+
+    def test_tooManyElements(self):
+        body = "<a>%s</a>" %("<b />" * 10)
+        request = create_request(body, {"CONTENT_TYPE": "text/xml",
+                                        "CONTENT_LENGTH": str(len(body))})
+        request.processInputs()
+        self.assertRaises(BadRequest, getattr, request, "xmlDataSource")
+
+    def test_tooDeep(self):
+        body = "<a><b><c><d /></c></b></a>"
+        request = create_request(body, {"CONTENT_TYPE": "text/xml",
+                                        "CONTENT_LENGTH": str(len(body))})
+        request.processInputs()
+        self.assertRaises(BadRequest, getattr, request, "xmlDataSource")
+
+    def test_entityExpansion(self):
+        body = """<?xml version="1.0"?>
+<!DOCTYPE a [<!ENTITY b "bbbbbbbbbb"><!ENTITY c "&b;&b;&b;&b;&b;&b;&b;">]>
+<a>&c;</a>"""
+        request = create_request(body, {"CONTENT_TYPE": "text/xml",
+                                        "CONTENT_LENGTH": str(len(body))})
+        request.processInputs()
+        self.assertRaises(BadRequest, getattr, request, "xmlDataSource")
+
+    def test_noLimits(self):
+        self.limits.maxSize = self.limits.maxElements = None
+        self.limits.maxDepth = None
+        body = "<a>%s</a>" %("<b><c><d /></c></b>" * 100)
+        request = create_request(body, {"CONTENT_TYPE": "text/xml",
+                                        "CONTENT_LENGTH": str(len(body))})
+        request.processInputs()
+
+        self.assertEqual(len(request.xmlDataSource), 100)
+
+    def test_verifyLimits(self):
+        self.assert_(verifyObject(IRequestLimits, self.limits))
+
+
 def test_suite():
     return unittest.TestSuite((
         unittest.makeSuite(TestWebDAVPublisher),
+        unittest.makeSuite(TestRequestLimits),
         ))
@@ -29,6 +29,7 @@ from z3c.dav import widgets
 import z3c.dav.interfaces
 from z3c.dav.publisher import WebDAVRequest
 from z3c.etree.testing import etreeSetup, etreeTearDown, assertXMLEqual
+import z3c.dav.xmlengine
 
 
 class TestWebDAVRequest(WebDAVRequest):
@@ -75,7 +76,7 @@ class _WebDAVWidgetTest(unittest.TestCase):
         etreeTearDown()
 
     def setUp(self):
-        self.etree = etreeSetup(key = "py25")
+        self.etree = etreeSetup(key = z3c.dav.xmlengine.engine)
 
     def setUpContent(self, desc = u'', title = u'Foo Title', element = None):
         ## setup the field first to stop some really weird errors
@@ -263,7 +264,7 @@ class ListTextWebDAVWidgetTest(WebDAVWidgetTest):
     rendered_content = "<ns0:name>firstitem</ns0:name><ns0:name>seconditem</ns0:name>"
 
     def setUp(self):
-        self.etree = etreeSetup(key = "py25")
+        self.etree = etreeSetup(key = z3c.dav.xmlengine.engine)
         component.getGlobalSiteManager().registerAdapter(
             widgets.TextDAVWidget,
             (zope.schema.interfaces.ITextLine,
@@ -324,7 +325,7 @@ class ObjectDAVWidgetTest(WebDAVWidgetTest):
                           <ns0:age>26</ns0:age>"""
 
     def setUp(self):
-        self.etree = etreeSetup(key = "py25")
+        self.etree = etreeSetup(key = z3c.dav.xmlengine.engine)
 
         foofield = schema.Object(__name__ = self.name,
                                  title = u"Foo Title",
@@ -0,0 +1,86 @@
+##############################################################################
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+##############################################################################
+"""Run the XML sensitive tests with the XML engine not used by this process.
+
+`z3c.dav.xmlengine` picks its engine once, when it is imported, so the
+tests of each module are run again in a new Python process with the
+`Z3C_DAV_XMLENGINE` environment variable set to the other engine.
+"""
+
+import os
+import sys
+import unittest
+import subprocess
+
+import z3c.dav.xmlengine
+
+# modules whose tests depend on the XML engine
+modules = ["z3c.dav.tests.test_doctests",
+           "z3c.dav.tests.test_widgets",
+           "z3c.dav.tests.test_inputwidgets",
+           "z3c.dav.tests.test_publisher",
+           "z3c.dav.tests.test_propfind",
+           "z3c.dav.tests.test_proppatch",
+           "z3c.dav.exceptions.tests.test_multiviews",
+           ]
+
+script = """import sys, unittest
+module = __import__(sys.argv[1], {}, {}, ["test_suite"])
+result = unittest.TextTestRunner().run(module.test_suite())
+sys.exit(not result.wasSuccessful())
+"""
+
+
+def otherEngine():
+    # Return the key of the XML engine not in use, or None if it isn't
+    # installed.
+    if z3c.dav.xmlengine.lxml:
+        return "py25"
+    try:
+        import lxml.etree
+    except ImportError:
+        return None
+    return "lxml"
+
+
+class XMLEngineTestCase(unittest.TestCase):
+
+    def __init__(self, engine, module):
+        unittest.TestCase.__init__(self)
+        self.engine = engine
+        self.module = module
+
+    def __str__(self):
+        return "%s (%s engine)" %(self.module, self.engine)
+
+    def id(self):
+        return "%s.%s.%s" %(__name__, self.engine, self.module)
+
+    def runTest(self):
+        env = dict(os.environ)
+        env[z3c.dav.xmlengine.engine_env_key] = self.engine
+        env["PYTHONPATH"] = os.pathsep.join(sys.path)
+        process = subprocess.Popen(
+            [sys.executable, "-c", script, self.module], env = env,
+            stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+        output = process.communicate()[0]
+        if process.returncode != 0:
+            self.fail("Tests failed with the %s engine:\n%s" %(self.engine,
+                                                               output))
+
+
+def test_suite():
+    engine = otherEngine()
+    if engine is None:
+        return unittest.TestSuite()
+    return unittest.TestSuite(
+        [XMLEngineTestCase(engine, module) for module in modules])
@@ -28,23 +28,36 @@ MultiStatus
 Also contains some usefully methods like
 
 + getObjectURL
+
++ getChildURL
+
++ preferMinimal
 """
 __docformat__ = 'restructuredtext'
 
-from xml.etree import ElementTree
+import tempfile
+import urllib
+from cStringIO import StringIO
+from xml.sax.saxutils import escape, quoteattr
 
 import zope.component
 import zope.interface
 from zope.publisher.http import status_reasons
+from zope.proxy import sameProxiedObjects
+from zope.publisher.interfaces.http import IResult
 from zope.traversing.browser.interfaces import IAbsoluteURL
+from zope.traversing.browser.absoluteurl import AbsoluteURL
 from zope.container.interfaces import IReadContainer
 
+import z3c.dav.xmlengine
+from z3c.dav.xmlengine import ElementTree
+
 class IPropstat(zope.interface.Interface):
     """Helper interface to render a response XML element. 
     """
 
-    properties = zope.interface.Attribute("""List of etree elements that make
-    up the prop element.
+    properties = zope.interface.Attribute("""List of etree elements, or
+    `XMLFragment` objects, that make up the prop element.
     """)
 
     status = zope.interface.Attribute("""Integer status code of all the
@@ -64,6 +77,12 @@ class IPropstat(zope.interface.Interface):
         """Render this propstat object to a etree XML element.
         """
 
+    def serialize(nsmap = None):
+        """Render this propstat object directly to an UTF-8 encoded string.
+        The namespace prefixes are taken from the `NamespaceMap` `nsmap` if
+        given, otherwise the namespaces are declared on the element.
+        """
+
 
 class IResponse(zope.interface.Interface):
     """Helper object to render a response XML element.
@@ -103,10 +122,24 @@ class IResponse(zope.interface.Interface):
         status code.
         """
 
+    def removePropstat(status):
+        """Remove the propstat registered under the status code, if any.
+        """
+
+    def getPropstats():
+        """Return a list of the (status, IPropstat) pairs of this response.
+        """
+
     def __call__():
         """Render this response object to an etree element.
         """
 
+    def serialize(nsmap = None):
+        """Render this response object directly to an UTF-8 encoded string.
+        The namespace prefixes are taken from the `NamespaceMap` `nsmap` if
+        given, otherwise the namespaces are declared on the element.
+        """
+
 
 class IMultiStatus(zope.interface.Interface):
 
@@ -123,6 +156,12 @@ class IMultiStatus(zope.interface.Interface):
         """Render this multistatus object to an etree element.
         """
 
+    def serialize():
+        """Render this multistatus object directly to an UTF-8 encoded
+        string. All the namespaces used are declared once on the
+        multistatus element.
+        """
+
 ################################################################################
 #
 # Some helper methods. Which includes:
@@ -177,6 +216,251 @@ def makestatuselement(status):
     return makedavelement('status', status)
 
 
+# The serialize methods of the Propstat, Response and MultiStatus objects
+# write the multistatus grammar straight out as UTF-8 encoded strings
+# instead of building an etree element first. Only the text nodes and the
+# contents of the prop and error elements need to be serialized.
+
+_statuslines = {} # status -> rendered status element
+
+def serializetext(text):
+    """Escape and encode the text node `text`.
+
+      >>> serializetext(u'a < b & \u20ac')
+      'a &lt; b &amp; \\xe2\\x82\\xac'
+      >>> serializetext('/a b')
+      '/a b'
+    """
+    if isinstance(text, unicode):
+        text = text.encode("utf-8")
+    return escape(text)
+
+
+def serializestatus(status):
+    """
+      >>> serializestatus(200)
+      '<D:status>HTTP/1.1 200 Ok</D:status>'
+      >>> serializestatus('GREAT')
+      '<D:status>GREAT</D:status>'
+    """
+    try:
+        return _statuslines[status]
+    except KeyError:
+        pass
+
+    line = status
+    if isinstance(status, (int, long)):
+        line = 'HTTP/1.1 %d %s' %(status, status_reasons[status])
+    line = _statuslines[status] = "<D:status>%s</D:status>" %(
+        serializetext(line))
+    return line
+
+
+XML_NAMESPACE = "http://www.w3.org/XML/1998/namespace"
+
+class NamespaceMap(object):
+    """Prefixes of the namespaces used in a multistatus XML element.
+
+    Instead of ElementTree declaring the namespace of every property over
+    and over again we give each namespace a short prefix that is declared
+    once on the multistatus element. Well known namespaces always get the
+    same prefix, other namespaces are numbered in the order they are used.
+
+      >>> nsmap = NamespaceMap()
+      >>> nsmap.getPrefix('DAV:')
+      'D'
+      >>> nsmap.getPrefix('http://example.com/ns')
+      'ns1'
+      >>> nsmap.getPrefix('urn:schemas-microsoft-com:')
+      'Z'
+      >>> nsmap.getPrefix('http://example.com/ns')
+      'ns1'
+      >>> nsmap.getPrefix(u'http://example.com/\u20ac')
+      'ns2'
+
+    Only the namespaces used need to be declared.
+
+      >>> print nsmap.declarations()
+       xmlns:D="DAV:" xmlns:ns1="http://example.com/ns" xmlns:Z="urn:schemas-microsoft-com:" xmlns:ns2="http://example.com/\xe2\x82\xac"
+
+    The XML namespace is bound to the `xml` prefix by definition, it can't
+    be bound to any other prefix or declared.
+
+      >>> nsmap.getPrefix('http://www.w3.org/XML/1998/namespace')
+      'xml'
+      >>> 'XML/1998' in nsmap.declarations()
+      False
+
+    So properties with an `xml:lang` attribute can be read back.
+
+      >>> el = ElementTree.Element('{http://example.com/ns}title')
+      >>> el.set('{http://www.w3.org/XML/1998/namespace}lang', 'en')
+      >>> el.text = 'Title'
+      >>> ms = MultiStatus()
+      >>> ms.responses.append(Response('/container'))
+      >>> ms.responses[0].addProperty(200, el)
+      >>> data = ms.serialize()
+      >>> 'xml:lang="en"' in data
+      True
+      >>> title = z3c.dav.xmlengine.fromstring(data).find(
+      ...     '{DAV:}response/{DAV:}propstat/{DAV:}prop/'
+      ...     '{http://example.com/ns}title')
+      >>> title.get('{http://www.w3.org/XML/1998/namespace}lang')
+      'en'
+
+    """
+
+    # prefixes of well known namespaces
+    prefixes = {"DAV:": "D",
+                "urn:schemas-microsoft-com:": "Z",
+                "http://apache.org/dav/props/": "A",
+                "http://apple.com/ns/ical/": "I",
+                "http://calendarserver.org/ns/": "CS",
+                "urn:ietf:params:xml:ns:caldav": "C",
+                "urn:ietf:params:xml:ns:carddav": "CR",
+                }
+
+    def __init__(self):
+        # The DAV: namespace is always used. The XML namespace is declared
+        # implicitly.
+        self._prefixes = {"DAV:": "D", XML_NAMESPACE: "xml"}
+        self._namespaces = ["DAV:"]
+        self._count = 0
+
+    def getPrefix(self, namespace):
+        try:
+            return self._prefixes[namespace]
+        except KeyError:
+            pass
+
+        prefix = self.prefixes.get(namespace, None)
+        if prefix is None:
+            self._count += 1
+            prefix = "ns%d" % self._count
+        self._prefixes[namespace] = prefix
+        self._namespaces.append(namespace)
+        return prefix
+
+    def declarations(self):
+        """Return the attributes declaring the namespaces used."""
+        return "".join([' xmlns:%s=%s' %(self._prefixes[namespace],
+                                         quoteattr(serializetext(namespace)))
+                        for namespace in self._namespaces])
+
+
+def _serializename(tag, nsmap):
+    if isinstance(tag, ElementTree.QName):
+        tag = tag.text
+    if tag[:1] == "{":
+        namespace, tag = tag[1:].split("}", 1)
+        tag = "%s:%s" %(nsmap.getPrefix(namespace), tag)
+    if isinstance(tag, unicode):
+        tag = tag.encode("utf-8")
+    return tag
+
+
+def _serializeelement(el, nsmap, data):
+    if el.tag is ElementTree.Comment:
+        data.append("<!--%s-->" % serializetext(el.text))
+    elif el.tag is ElementTree.ProcessingInstruction:
+        data.append("<?%s?>" % serializetext(el.text))
+    else:
+        tag = _serializename(el.tag, nsmap)
+        data.append("<" + tag)
+        for name, value in el.items():
+            if isinstance(value, ElementTree.QName):
+                value = value.text
+            if isinstance(value, unicode):
+                value = value.encode("utf-8")
+            data.append(" %s=%s" %(_serializename(name, nsmap),
+                                   quoteattr(value)))
+        if el.text or len(el):
+            data.append(">")
+            if el.text:
+                data.append(serializetext(el.text))
+            for child in el:
+                _serializeelement(child, nsmap, data)
+            data.append("</%s>" % tag)
+        else:
+            data.append(" />")
+
+    if el.tail:
+        data.append(serializetext(el.tail))
+
+
+def serializeelement(el, nsmap = None):
+    """Serialize the etree element `el`.
+
+    Without a `NamespaceMap` the element declares the namespaces it uses
+    itself, so the result can go anywhere in the document.
+
+      >>> el = ElementTree.Element('{http://example.com/ns}prop')
+      >>> el.set('lang', 'en & fr')
+      >>> sub = ElementTree.SubElement(el, ElementTree.QName('DAV:', 'href'))
+      >>> sub.text = u'/a & b'
+      >>> sub.tail = 'tail'
+      >>> sub = ElementTree.SubElement(el, 'empty', {'{DAV:}x': '1'})
+
+      >>> print serializeelement(el) #doctest:+XMLDATA
+      <E:prop xmlns:E="http://example.com/ns" xmlns:D="DAV:"
+              lang="en &amp; fr">
+        <D:href>/a &amp; b</D:href>tail
+        <empty D:x="1" />
+      </E:prop>
+
+    Otherwise the prefixes of the namespaces are taken from the map, and
+    are declared by the enclosing multistatus element.
+
+      >>> nsmap = NamespaceMap()
+      >>> print serializeelement(el, nsmap)
+      <ns1:prop lang="en &amp; fr"><D:href>/a &amp; b</D:href>tail<empty D:x="1" /></ns1:prop>
+
+    """
+    if isinstance(el, XMLFragment):
+        return el.data
+
+    if nsmap is None:
+        return ElementTree.tostring(el, encoding = "utf-8")
+
+    data = []
+    _serializeelement(el, nsmap, data)
+    return "".join(data)
+
+
+class XMLFragment(object):
+    """An element that has already been serialized, and declares all the
+    namespaces it uses. It can be added to a `Propstat` in place of an etree
+    element and is written out as it is.
+
+      >>> fragment = XMLFragment('{urn:e}a', '<E:a xmlns:E="urn:e">x</E:a>')
+      >>> pstat = Propstat()
+      >>> pstat.status = 200
+      >>> pstat.properties.append(fragment)
+      >>> pstat.properties.append(makedavelement(u'b'))
+      >>> print pstat.serialize(NamespaceMap())
+      <D:propstat><D:prop><E:a xmlns:E="urn:e">x</E:a><D:b /></D:prop><D:status>HTTP/1.1 200 Ok</D:status></D:propstat>
+
+    The fragment is only parsed when an etree element is needed.
+
+      >>> print ElementTree.tostring(pstat()) #doctest:+XMLDATA
+      <propstat xmlns="DAV:">
+        <prop>
+          <a xmlns="urn:e">x</a>
+          <b />
+        </prop>
+        <status>HTTP/1.1 200 Ok</status>
+      </propstat>
+
+    """
+
+    def __init__(self, tag, data):
+        self.tag = tag
+        self.data = data
+
+    def element(self):
+        return z3c.dav.xmlengine.fromstring(self.data)
+
+
 def parseEtreeTag(tag):
     """Return namespace, tagname pair.
 
@@ -261,6 +545,21 @@ class Propstat(object):
       ...
       ValueError: Must set status before rendering a propstat.
 
+    A propstat can be written straight to an UTF-8 encoded string, without
+    building the etree element.
+
+      >>> pstat.status = 404
+      >>> pstat.properties.append(makedavelement(u'test3'))
+      >>> pstat.responsedescription = u'Missing <test3>'
+      >>> print pstat.serialize() #doctest:+XMLDATA
+      <propstat xmlns="DAV:">
+        <prop>
+          <test3 />
+        </prop>
+        <status>HTTP/1.1 404 Not Found</status>
+        <responsedescription>Missing &lt;test3&gt;</responsedescription>
+      </propstat>
+
     """
     zope.interface.implements(IPropstat)
 
@@ -284,6 +583,8 @@ class Propstat(object):
         propstatel.append(propel)
 
         for prop in self.properties:
+            if isinstance(prop, XMLFragment):
+                prop = prop.element()
             propel.append(prop)
 
         propstatel.append(makestatuselement(self.status))
@@ -297,6 +598,32 @@ class Propstat(object):
 
         return propstatel
 
+    def serialize(self, nsmap = None):
+        if self.status is None:
+            raise ValueError("Must set status before rendering a propstat.")
+
+        declare = nsmap is None
+        if declare:
+            nsmap = NamespaceMap()
+
+        data = [None, "<D:prop>"]
+        for prop in self.properties:
+            data.append(serializeelement(prop, nsmap))
+        data.append("</D:prop>")
+        data.append(serializestatus(self.status))
+
+        for error in self.error:
+            data.append("<D:error>%s</D:error>" %
+                        serializeelement(error, nsmap))
+
+        if self.responsedescription:
+            data.append("<D:responsedescription>%s</D:responsedescription>" %
+                        serializetext(self.responsedescription))
+
+        data.append("</D:propstat>")
+        data[0] = "<D:propstat%s>" %(declare and nsmap.declarations() or "")
+        return "".join(data)
+
 
 class Response(object):
     """WebDAV response XML element
@@ -486,6 +813,70 @@ class Response(object):
          </propstat>
        </response>
 
+    The propstats are listed with their status.
+
+      >>> [(status, len(propstat.properties))
+      ...  for status, propstat in sorted(resp.getPropstats())]
+      [(200, 2), (404, 1)]
+
+    Clients can ask for the propstat of the missing properties to be left
+    out of the response.
+
+      >>> resp.removePropstat(404)
+      >>> resp.removePropstat(404)
+      >>> print etree.tostring(resp()) #doctest:+XMLDATA
+      <response xmlns="DAV:">
+        <href>/container</href>
+        <propstat>
+          <prop>
+            <testprop>Test Property</testprop>
+            <testprop2>Test Property Two</testprop2>
+          </prop>
+          <status>HTTP/1.1 200 Ok</status>
+        </propstat>
+      </response>
+
+    The serialize method writes the same response straight to an UTF-8
+    encoded string.
+
+      >>> resp.error = [makedavelement(u'precondition-failed')]
+      >>> resp.location = '/container?a=1&b=2'
+      >>> print resp.serialize() #doctest:+XMLDATA
+      <response xmlns="DAV:">
+        <href>/container</href>
+        <propstat>
+          <prop>
+            <testprop>Test Property</testprop>
+            <testprop2>Test Property Two</testprop2>
+          </prop>
+          <status>HTTP/1.1 200 Ok</status>
+        </propstat>
+        <error>
+          <precondition-failed />
+        </error>
+        <location>
+          <href>/container?a=1&amp;b=2</href>
+        </location>
+      </response>
+
+      >>> resp = Response(u'/container/\u20ac')
+      >>> resp.href.append('/container2')
+      >>> resp.status = 423
+      >>> resp.responsedescription = u'locked'
+      >>> print resp.serialize() #doctest:+XMLDATA
+      <response xmlns="DAV:">
+        <href>/container/\xe2\x82\xac</href>
+        <href>/container2</href>
+        <status>HTTP/1.1 423 Locked</status>
+        <responsedescription>locked</responsedescription>
+      </response>
+
+      >>> resp.addProperty(200, makedavelement(u'testprop'))
+      >>> resp.serialize()
+      Traceback (most recent call last):
+      ...
+      ValueError: Response object is in an invalid state.
+
     """
     zope.interface.implements(IResponse)
 
@@ -514,6 +905,12 @@ class Response(object):
 
         propstat.properties.append(element)
 
+    def removePropstat(self, status):
+        self._propstats.pop(status, None)
+
+    def getPropstats(self):
+        return self._propstats.items()
+
     def __call__(self):
         if (len(self.href) > 1 or self.status is not None) and self._propstats:
             raise ValueError, "Response object is in an invalid state."
@@ -544,6 +941,42 @@ class Response(object):
 
         return respel
 
+    def serialize(self, nsmap = None):
+        if (len(self.href) > 1 or self.status is not None) and self._propstats:
+            raise ValueError, "Response object is in an invalid state."
+
+        declare = nsmap is None
+        if declare:
+            nsmap = NamespaceMap()
+
+        data = [None, "<D:href>%s</D:href>" % serializetext(self.href[0])]
+
+        if self.status is not None:
+            for href in self.href[1:]:
+                data.append("<D:href>%s</D:href>" % serializetext(href))
+
+            data.append(serializestatus(self.status))
+        else:
+            for status, propstat in self._propstats.items():
+                propstat.status = status
+                data.append(propstat.serialize(nsmap))
+
+        for error in self.error:
+            data.append("<D:error>%s</D:error>" %
+                        serializeelement(error, nsmap))
+
+        if self.responsedescription:
+            data.append("<D:responsedescription>%s</D:responsedescription>" %
+                        serializetext(self.responsedescription))
+
+        if self.location is not None:
+            data.append("<D:location><D:href>%s</D:href></D:location>" %
+                        serializetext(self.location))
+
+        data.append("</D:response>")
+        data[0] = "<D:response%s>" %(declare and nsmap.declarations() or "")
+        return "".join(data)
+
 
 class MultiStatus(object):
     """Multistatus element generation
@@ -619,6 +1052,29 @@ class MultiStatus(object):
         <responsedescription>simple description</responsedescription>
       </multistatus>
 
+      >>> print ms.serialize() #doctest:+XMLDATA
+      <multistatus xmlns="DAV:">
+        <response>
+          <href>/container</href>
+          <propstat>
+            <prop>
+              <test1>test one</test1>
+            </prop>
+            <status>HTTP/1.1 200 Ok</status>
+          </propstat>
+        </response>
+        <response>
+          <href>/container2</href>
+          <propstat>
+            <prop>
+              <test2 />
+            </prop>
+            <status>HTTP/1.1 404 Not Found</status>
+          </propstat>
+        </response>
+        <responsedescription>simple description</responsedescription>
+      </multistatus>
+
     """
     zope.interface.implements(IMultiStatus)
 
@@ -639,6 +1095,223 @@ class MultiStatus(object):
 
         return el
 
+    def serialize(self):
+        nsmap = NamespaceMap()
+        data = [None]
+        for response in self.responses:
+            data.append(response.serialize(nsmap))
+
+        if self.responsedescription:
+            data.append("<D:responsedescription>%s</D:responsedescription>" %
+                        serializetext(self.responsedescription))
+
+        data.append("</D:multistatus>")
+        data[0] = "<D:multistatus%s>" % nsmap.declarations()
+        return "".join(data)
+
+
+class RenderedResponse(object):
+    """A `response` XML element that has already been rendered, for example
+    by an earlier request. It can be appended to a `StreamingMultiStatus`
+    object like any `IResponse` object.
+
+      >>> response = Response('/container')
+      >>> response.addProperty(200, makedavelement(u'test1', u'test one'))
+      >>> rendered = RenderedResponse('/container', response.serialize())
+      >>> rendered.href
+      ['/container']
+
+      >>> ms = StreamingMultiStatus()
+      >>> ms.append(rendered)
+      >>> print ms.getResult() #doctest:+XMLDATA
+      <multistatus xmlns="DAV:">
+        <response>
+          <href>/container</href>
+          <propstat>
+            <prop>
+              <test1>test one</test1>
+            </prop>
+            <status>HTTP/1.1 200 Ok</status>
+          </propstat>
+        </response>
+      </multistatus>
+
+    """
+
+    def __init__(self, href, data):
+        self.href = [href]
+        self.data = data
+
+
+class StreamingMultiStatus(object):
+    """Multistatus element generation, one response at a time.
+
+    Unlike the `MultiStatus` object we don't hold onto the `IResponse`
+    objects. Each response is rendered has soon has it is appended and the
+    data is kept in memory until it grows larger then `spoolsize` bytes,
+    after which it is spooled to a temporary file.
+
+      >>> ms = StreamingMultiStatus()
+      >>> print ms.getResult() #doctest:+XMLDATA
+      <multistatus xmlns="DAV:" />
+
+      >>> response = Response('/container')
+      >>> response.addProperty(200, makedavelement(u'test1', u'test one'))
+      >>> ms.append(response)
+      >>> response2 = Response('/container2')
+      >>> response2.addProperty(404, makedavelement(u'test2'))
+      >>> ms.append(response2)
+      >>> ms.responsedescription = u'simple description'
+      >>> print ms.getResult() #doctest:+XMLDATA
+      <multistatus xmlns="DAV:">
+        <response>
+          <href>/container</href>
+          <propstat>
+            <prop>
+              <test1>test one</test1>
+            </prop>
+            <status>HTTP/1.1 200 Ok</status>
+          </propstat>
+        </response>
+        <response>
+          <href>/container2</href>
+          <propstat>
+            <prop>
+              <test2 />
+            </prop>
+            <status>HTTP/1.1 404 Not Found</status>
+          </propstat>
+        </response>
+        <responsedescription>simple description</responsedescription>
+      </multistatus>
+
+    The namespaces used by the properties are declared once, on the
+    multistatus element.
+
+      >>> ms = StreamingMultiStatus()
+      >>> for href in ('/a', '/b'):
+      ...     resp = Response(href)
+      ...     resp.addProperty(200, makeelement(
+      ...         'http://example.com/ns', 'test', 'value'))
+      ...     ms.append(resp)
+      >>> print ms.getResult()
+      <D:multistatus xmlns:D="DAV:" xmlns:ns1="http://example.com/ns"><D:response><D:href>/a</D:href><D:propstat><D:prop><ns1:test>value</ns1:test></D:prop><D:status>HTTP/1.1 200 Ok</D:status></D:propstat></D:response><D:response><D:href>/b</D:href><D:propstat><D:prop><ns1:test>value</ns1:test></D:prop><D:status>HTTP/1.1 200 Ok</D:status></D:propstat></D:response></D:multistatus>
+
+    When the rendered responses get to big we spool them to disk and return
+    an iterable result that reads the data back in chunks.
+
+      >>> ms = StreamingMultiStatus()
+      >>> ms.spoolsize = 10
+      >>> ms.append(response)
+      >>> result = ms.getResult()
+      >>> IResult.providedBy(result)
+      True
+      >>> data = "".join(result)
+      >>> len(result) == len(data)
+      True
+      >>> print data #doctest:+XMLDATA
+      <multistatus xmlns="DAV:">
+        <response>
+          <href>/container</href>
+          <propstat>
+            <prop>
+              <test1>test one</test1>
+            </prop>
+            <status>HTTP/1.1 200 Ok</status>
+          </propstat>
+        </response>
+      </multistatus>
+
+    """
+
+    # Maximum number of bytes we keep in memory before spooling to disk.
+    spoolsize = 512 * 1024
+
+    def __init__(self):
+        # text
+        self.responsedescription = ""
+
+        self._data = StringIO()
+        self._size = 0
+        self._spooled = False
+
+        # namespaces used by the responses, declared on the root element.
+        self.nsmap = NamespaceMap()
+
+    def write(self, data):
+        """Write a rendered XML fragment into the body of the multistatus
+        element.
+        """
+        self._data.write(data)
+        self._size += len(data)
+
+        if not self._spooled and self._size > self.spoolsize:
+            spool = tempfile.TemporaryFile()
+            spool.write(self._data.getvalue())
+            self._data = spool
+            self._spooled = True
+
+    def append(self, response):
+        if isinstance(response, RenderedResponse):
+            self.write(response.data)
+        elif hasattr(response, "serialize"):
+            self.write(response.serialize(self.nsmap))
+        else:
+            self.write(ElementTree.tostring(response(), encoding = "utf-8"))
+
+    def _start(self):
+        return "<D:multistatus%s>" % self.nsmap.declarations()
+
+    def _end(self):
+        end = "</D:multistatus>"
+        if self.responsedescription:
+            end = "<D:responsedescription>%s</D:responsedescription>%s" %(
+                serializetext(self.responsedescription), end)
+        return end
+
+    def getResult(self):
+        """Return the rendered multistatus XML element. This is a string
+        when all the data is in memory, otherwise an iterable `IResult`
+        object whose length is the length of the rendered body.
+        """
+        if not self._spooled:
+            return self._start() + self._data.getvalue() + self._end()
+
+        return SpooledResult(self._start(), self._data, self._end())
+
+
+class SpooledResult(object):
+    """Iterate over the data spooled to a temporary file by the
+    `StreamingMultiStatus` object.
+    """
+    zope.interface.implements(IResult)
+
+    chunksize = 64 * 1024
+
+    def __init__(self, start, spool, end):
+        self.start = start
+        self.spool = spool
+        self.end = end
+
+        spool.seek(0, 2)
+        self._length = len(start) + spool.tell() + len(end)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        yield self.start
+
+        self.spool.seek(0)
+        while True:
+            data = self.spool.read(self.chunksize)
+            if not data:
+                break
+            yield data
+        self.spool.close()
+
+        yield self.end
+
 ################################################################################
 #
 # Some other miscellanous helpful methods
@@ -656,3 +1329,140 @@ def getObjectURL(ob, req):
         url += "/"
 
     return url
+
+
+def preferMinimal(req):
+    """Return True if the client asked for a minimal response with the
+    `return=minimal' preference of the Prefer header, see RFC 7240 and
+    section 3 of RFC 8144.
+
+      >>> from zope.publisher.browser import TestRequest
+      >>> preferMinimal(TestRequest())
+      False
+      >>> preferMinimal(TestRequest(environ = {
+      ...     'HTTP_PREFER': 'return=minimal'}))
+      True
+      >>> preferMinimal(TestRequest(environ = {
+      ...     'HTTP_PREFER': 'respond-async, Return = "minimal"; x=1'}))
+      True
+      >>> preferMinimal(TestRequest(environ = {
+      ...     'HTTP_PREFER': 'return=representation'}))
+      False
+
+    """
+    header = req.getHeader("prefer", None)
+    if not header:
+        return False
+
+    for preference in header.split(","):
+        token = preference.split(";")[0].split("=", 1)
+        if len(token) == 2 and token[0].strip().lower() == "return" and \
+               token[1].strip().strip('"').lower() == "minimal":
+            return True
+
+    return False
+
+
+def addVary(response, header):
+    """Add `header` to the Vary header of `response`, keeping the headers
+    already listed.
+
+      >>> from zope.publisher.http import HTTPResponse
+      >>> response = HTTPResponse()
+      >>> addVary(response, 'Prefer')
+      >>> response.getHeader('vary')
+      'Prefer'
+      >>> addVary(response, 'Accept-Encoding')
+      >>> addVary(response, 'prefer')
+      >>> response.getHeader('vary')
+      'Prefer, Accept-Encoding'
+
+    """
+    vary = response.getHeader("vary")
+    if not vary:
+        response.setHeader("vary", header)
+    elif header.lower() not in [name.strip().lower()
+                                for name in vary.split(",")]:
+        response.setHeader("vary", vary + ", " + header)
+
+
+def getChildURL(ob, req, parent, parenturl):
+    """Return the URL for the object `ob` found by listing the collection
+    `parent` whose URL is `parenturl`.
+
+    When `ob` uses the default `IAbsoluteURL` adapter we can append its
+    quoted name to `parenturl` instead of walking up the `__parent__` chain
+    to the root of the site for every resource in a listing.
+
+      >>> from zope.publisher.browser import TestRequest
+      >>> from zope.location.interfaces import IRoot
+      >>> from zope.location.location import Location
+      >>> from zope.traversing.browser.absoluteurl import SiteAbsoluteURL
+      >>> gsm = zope.component.getGlobalSiteManager()
+      >>> gsm.registerAdapter(AbsoluteURL,
+      ...     (zope.interface.Interface, zope.interface.Interface),
+      ...     IAbsoluteURL)
+      >>> gsm.registerAdapter(SiteAbsoluteURL,
+      ...     (IRoot, zope.interface.Interface), IAbsoluteURL)
+
+      >>> class Root(object):
+      ...     zope.interface.implements(IRoot)
+      ...     __parent__ = __name__ = None
+      >>> root = Root()
+      >>> request = TestRequest()
+      >>> folder = Location()
+      >>> folder.__parent__ = root
+      >>> folder.__name__ = u'folder'
+      >>> child = Location()
+      >>> child.__parent__ = folder
+      >>> child.__name__ = u'caf\xe9 menu'
+
+      >>> getChildURL(child, request, folder, 'http://127.0.0.1/folder/')
+      'http://127.0.0.1/folder/caf%C3%A9%20menu'
+      >>> getChildURL(child, request, folder, 'http://127.0.0.1/folder')
+      'http://127.0.0.1/folder/caf%C3%A9%20menu'
+
+    Objects with a custom `IAbsoluteURL` adapter, or objects whose parent
+    isn't the collection we listed, are looked up the usual way.
+
+      >>> class CustomURL(object):
+      ...     def __init__(self, context, request):
+      ...         pass
+      ...     def __call__(self):
+      ...         return 'http://127.0.0.1/elsewhere'
+      >>> gsm.registerAdapter(CustomURL, (Location, None), IAbsoluteURL)
+      >>> getChildURL(child, request, folder, 'http://127.0.0.1/folder/')
+      'http://127.0.0.1/elsewhere'
+      >>> gsm.unregisterAdapter(CustomURL, (Location, None), IAbsoluteURL)
+      True
+
+      >>> getChildURL(child, request, Location(), 'http://127.0.0.1/other/')
+      'http://127.0.0.1/folder/caf%C3%A9%20menu'
+
+    Cleanup
+
+      >>> gsm.unregisterAdapter(AbsoluteURL,
+      ...     (zope.interface.Interface, zope.interface.Interface),
+      ...     IAbsoluteURL)
+      True
+      >>> gsm.unregisterAdapter(SiteAbsoluteURL,
+      ...     (IRoot, zope.interface.Interface), IAbsoluteURL)
+      True
+
+    """
+    name = getattr(ob, "__name__", None)
+    if not name or \
+           not sameProxiedObjects(getattr(ob, "__parent__", None), parent) or \
+           sameProxiedObjects(ob, req.getVirtualHostRoot()) or \
+           zope.component.getSiteManager().adapters.lookup(
+               (zope.interface.providedBy(ob), zope.interface.providedBy(req)),
+               IAbsoluteURL) is not AbsoluteURL:
+        return getObjectURL(ob, req)
+
+    if parenturl[-1] != "/":
+        parenturl += "/"
+    url = parenturl + urllib.quote(name.encode("utf-8"), "@+")
+    if IReadContainer.providedBy(ob):
+        url += "/"
+
+    return url
@@ -15,7 +15,7 @@ __docformat__ = 'restructuredtext'
 
 import datetime
 import calendar
-from xml.etree import ElementTree
+from collections import OrderedDict
 
 import zope.component
 import zope.interface
@@ -26,6 +26,8 @@ import interfaces
 import zope.datetime
 from zope.formlib.interfaces import ConversionError, MissingInputError
 
+from z3c.dav.xmlengine import ElementTree
+
 DEFAULT_NS = 'DAV:'
 
 
@@ -195,6 +197,31 @@ class ListDAVWidget(DAVWidget):
 ################################################################################
 
 
+_proppatch_index_key = "z3c.dav.widgets.proppatchindex"
+
+def getProppatchIndex(request):
+    """
+    Return an ordered mapping of the tags of the properties set in the body
+    of a PROPPATCH request to the last element setting each of them. The
+    body is indexed on first use and the index is kept in the annotations
+    of the request, so the input widgets don't search the whole body for
+    each property.
+    """
+    xmlDataSource = request.xmlDataSource
+    cached = request.annotations.get(_proppatch_index_key, None)
+    if cached is not None and cached[0] is xmlDataSource:
+        return cached[1]
+
+    index = OrderedDict()
+    if xmlDataSource is not None:
+        for props in xmlDataSource.findall("{DAV:}set/{DAV:}prop"):
+            for prop in props:
+                index[prop.tag] = prop
+
+    request.annotations[_proppatch_index_key] = (xmlDataSource, index)
+    return index
+
+
 class DAVInputWidget(object):
     zope.interface.implements(interfaces.IDAVInputWidget)
     zope.interface.classProvides(interfaces.IIDAVInputWidget)
@@ -211,8 +238,11 @@ class DAVInputWidget(object):
         can't update a property only once during a PROPPATCH request -> this
         method and implementation is meaningless.
         """
-        return self.request.xmlDataSource.findall(
-            '{DAV:}set/{DAV:}prop/{%s}%s' % (self.namespace, self.name))[-1:]
+        el = getProppatchIndex(self.request).get(
+            '{%s}%s' % (self.namespace, self.name), None)
+        if el is None:
+            return []
+        return [el]
 
     def hasInput(self):
         if self.getProppatchElement():
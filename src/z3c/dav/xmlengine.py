@@ -0,0 +1,228 @@
+##############################################################################
+# Copyright (c) 2009 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+##############################################################################
+"""The XML engine used to parse and render WebDAV requests.
+
+lxml is used when it is installed, otherwise we fall back to the
+`xml.etree.ElementTree` module in the standard library. The engine can be
+forced by setting the `Z3C_DAV_XMLENGINE` environment variable to `lxml` or
+`py25` before z3c.dav is imported. All of z3c.dav gets its `ElementTree`
+module from here so that elements created by the two engines are never
+mixed in the same tree.
+
+  >>> el = fromstring('<D:prop xmlns:D="DAV:"><!-- comment --><D:a /></D:prop>')
+  >>> el.tag
+  '{DAV:}prop'
+  >>> iselement(el)
+  True
+
+Comments and processing instructions are dropped when parsing so that the
+children of an element are always elements.
+
+  >>> [child.tag for child in el]
+  ['{DAV:}a']
+
+  >>> print tostring(el) #doctest:+XMLDATA
+  <prop xmlns="DAV:"><a /></prop>
+
+"""
+__docformat__ = 'restructuredtext'
+
+import os
+import copy
+
+# environment variable naming the engine to use, see `engine`
+engine_env_key = "Z3C_DAV_XMLENGINE"
+
+if os.environ.get(engine_env_key) == "py25":
+    from xml.etree import ElementTree
+    lxml = False
+elif os.environ.get(engine_env_key) == "lxml":
+    from lxml import etree as ElementTree
+    lxml = True
+else:
+    try:
+        from lxml import etree as ElementTree
+    except ImportError:
+        from xml.etree import ElementTree
+        lxml = False
+    else:
+        lxml = True
+
+# name of the engine in use, as known by z3c.etree
+engine = lxml and "lxml" or "py25"
+
+class BodyTooLarge(ValueError):
+    """The document is larger then the maximum size."""
+
+
+class LimitExceeded(ValueError):
+    """The document contains too many elements, nests them too deeply or
+    contains a document type declaration."""
+
+
+class _TreeBuilder(object):
+    # Parser target that builds the tree while checking the limits on the
+    # number and depth of the elements. Comments and processing
+    # instructions are dropped, and documents with a document type
+    # declaration are refused as their entities could expand to anything.
+
+    def __init__(self, maxElements = None, maxDepth = None):
+        self.builder = ElementTree.TreeBuilder()
+        self.maxElements = maxElements
+        self.maxDepth = maxDepth
+        self.elements = self.depth = 0
+
+    def start(self, tag, attrib):
+        self.elements += 1
+        if self.maxElements is not None and self.elements > self.maxElements:
+            raise LimitExceeded("More then %d elements" % self.maxElements)
+        self.depth += 1
+        if self.maxDepth is not None and self.depth > self.maxDepth:
+            raise LimitExceeded("Elements nested deeper then %d" %
+                                self.maxDepth)
+        return self.builder.start(tag, attrib)
+
+    def end(self, tag):
+        self.depth -= 1
+        return self.builder.end(tag)
+
+    def data(self, data):
+        self.builder.data(data)
+
+    def doctype(self, *args):
+        raise LimitExceeded("Document type declarations are not allowed")
+
+    def close(self):
+        return self.builder.close()
+
+
+if lxml:
+    # Don't load external entities or DTDs from the request bodies.
+    _parser = ElementTree.XMLParser(remove_comments = True,
+                                    remove_pis = True,
+                                    resolve_entities = False,
+                                    no_network = True)
+
+    def _createParser(target):
+        return ElementTree.XMLParser(target = target,
+                                     resolve_entities = False,
+                                     no_network = True)
+
+    def fromstring(text):
+        """Parse the XML document `text` and return the root element.
+        """
+        return ElementTree.fromstring(text, _parser)
+
+else:
+    def _createParser(target):
+        parser = ElementTree.XMLParser(target = target)
+        def doctype(*args):
+            target.doctype()
+        parser.parser.StartDoctypeDeclHandler = doctype
+        return parser
+
+    def fromstring(text):
+        return ElementTree.fromstring(text)
+
+
+def parse(source, maxSize = None, maxElements = None, maxDepth = None,
+          chunksize = 64 * 1024):
+    """Parse the file like object `source` incrementally and return the
+    root element. Stop has soon as the document turns out to be larger then
+    `maxSize` bytes, or to contain more then `maxElements` elements or
+    elements nested deeper then `maxDepth`.
+
+      >>> from cStringIO import StringIO
+      >>> body = '<D:propfind xmlns:D="DAV:"><D:prop><D:a /><D:b /></D:prop>' \\
+      ...        '</D:propfind>'
+      >>> parse(StringIO(body)).tag
+      '{DAV:}propfind'
+      >>> parse(StringIO(body), maxSize = len(body), maxElements = 4,
+      ...       maxDepth = 3).tag
+      '{DAV:}propfind'
+
+      >>> parse(StringIO(body), maxSize = 50, chunksize = 10)
+      Traceback (most recent call last):
+      ...
+      BodyTooLarge: Body larger then 50 bytes
+
+      >>> parse(StringIO(body), maxElements = 3)
+      Traceback (most recent call last):
+      ...
+      LimitExceeded: More then 3 elements
+
+      >>> parse(StringIO(body), maxDepth = 2)
+      Traceback (most recent call last):
+      ...
+      LimitExceeded: Elements nested deeper then 2
+
+    Documents declaring entities are refused.
+
+      >>> bomb = '''<?xml version="1.0"?>
+      ... <!DOCTYPE lolz [
+      ...  <!ENTITY lol "lol">
+      ...  <!ENTITY lol2 "&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;">
+      ... ]>
+      ... <lolz>&lol2;</lolz>'''
+      >>> parse(StringIO(bomb))
+      Traceback (most recent call last):
+      ...
+      LimitExceeded: Document type declarations are not allowed
+
+    """
+    target = _TreeBuilder(maxElements, maxDepth)
+    parser = _createParser(target)
+
+    size = 0
+    while True:
+        data = source.read(chunksize)
+        if not data:
+            break
+        size += len(data)
+        if maxSize is not None and size > maxSize:
+            raise BodyTooLarge("Body larger then %d bytes" % maxSize)
+        parser.feed(data)
+
+    return parser.close()
+
+
+def tostring(el):
+    """Serialize the element `el` to an UTF-8 encoded string, without an
+    XML declaration.
+    """
+    return ElementTree.tostring(el, encoding = "utf-8")
+
+
+def tofragment(el):
+    """Serialize the element `el` to an UTF-8 encoded string that declares
+    all the namespaces it uses, and no others, so that it can be written
+    into any XML document as it is. The tail of the element is dropped.
+
+      >>> root = fromstring('<D:prop xmlns:D="DAV:" xmlns:E="urn:e" '
+      ...                   'xmlns:F="urn:f"><E:a>x<F:b /></E:a> </D:prop>')
+      >>> data = tofragment(root[0])
+      >>> print data #doctest:+XMLDATA
+      <E:a xmlns:E="urn:e" xmlns:F="urn:f">x<F:b /></E:a>
+      >>> 'DAV:' in data
+      False
+      >>> data.endswith('>')
+      True
+
+    """
+    el = copy.deepcopy(el)
+    el.tail = None
+    if lxml:
+        ElementTree.cleanup_namespaces(el)
+    return tostring(el)
+
+
+iselement = ElementTree.iselement